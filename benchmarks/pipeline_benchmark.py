@@ -0,0 +1,425 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Benchmarks for the tracking pipeline. Every stage is timed on its own (detached image grab,
+# segmentation, centre of mass, pixel to stage conversion) as well as the whole headless TrackingEngine
+# on a simulated recording, and the results are saved as JSON so a change can be compared against a
+# saved baseline. compare exits with status 1 when a benchmark got slower than the tolerance allows, or
+# when the end-to-end run dropped more frames than in the baseline:
+#
+#     python pipeline_benchmark.py run --output baseline.json
+#     python pipeline_benchmark.py run --output results.json
+#     python pipeline_benchmark.py compare baseline.json results.json --tolerance 0.15
+
+import os
+import sys
+src_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "src"))
+if src_path not in sys.path:
+    sys.path.insert(0, src_path)
+
+from imports_and_constants import *
+from hardware_wrappers import CoreWrapper, LiveStreamWrapper, PixToCartCoords
+from image_processing import ImageGrabber, ImageSegmentation, bin_image
+from tracking_engine import FrameSegmenter, TrackingEngine, TRACKING_BINNING
+from dual_channel import DualChannel
+from camera_roi import FULL_ROI, panel_center
+from replay import ReplayStreamWrapper, ReplayCoreWrapper
+from metrics import MetricsRegistry
+import json
+import platform
+import datetime
+import click
+
+default_tolerance = 0.15 # A benchmark regresses when its median time grows by more than this fraction
+
+# ---- Simulated backend ----#
+
+# SimulatedRecording is an in-memory stand-in for a recorded session: a bright blob drifting across the
+# right panel of noisy 16 bit frames, with a stage that follows it one frame late
+class SimulatedRecording():
+
+    def __init__(self, num_frames: int = 30, frame_shape: tuple = (1024, 2048), seed: int = 0):
+        """
+        Generates the frames and the recording log.
+
+        Parameters
+        ----------
+        num_frames: int
+            Number of frames.
+        frame_shape: tuple
+            (height, width) of a frame, both panels side by side.
+        seed: int
+            Seed of the background noise.
+
+        Returns
+        -------
+        None
+        """
+
+        rng = np.random.default_rng(seed)
+        background = rng.poisson(100, size=frame_shape).astype(np.uint16)
+        height, width = frame_shape
+        self.frames = []
+        for i in range(num_frames):
+            frame = background.copy()
+            y = height // 2 + int(60 * np.sin(i / 5))
+            x = width * 3 // 4 + int(60 * np.cos(i / 5))
+            frame[y - 15:y + 15, x - 15:x + 15] = 4000
+            self.frames.append(frame)
+        self.positions = np.array([[10.0 * max(i - 1, 0), 5.0] for i in range(num_frames)])
+        self.elapsed = np.arange(num_frames) * 0.1
+        self.path = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def __getitem__(self, index):
+        return self.frames[index]
+
+# ---- Timing ----#
+
+def time_function(function, repeat: int = 7, min_time: float = 0.05) -> dict:
+    """
+    Times a function, calling it in batches long enough for the clock to be accurate.
+
+    Parameters
+    ----------
+    function: callable
+        Function without arguments.
+    repeat: int
+        Number of batches, the statistics are over the batches.
+    min_time: float
+        Shortest duration of a batch in seconds.
+
+    Returns
+    -------
+    dict
+        "median_ms", "min_ms" and "mean_ms" per call, "calls" per batch and "repeat".
+    """
+
+    # Calibrate the batch size, which also warms up caches and lazy imports
+    number = 1
+    while True:
+        s = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter() - s
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number *= 2 if elapsed <= 0 else max(2, min(10, int(min_time / elapsed) + 1))
+
+    times = []
+    for _ in range(repeat):
+        s = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - s) / number * 1000)
+    return {"median_ms": float(np.median(times)), "min_ms": float(np.min(times)), "mean_ms": float(np.mean(times)),
+            "calls": number, "repeat": repeat}
+
+# ---- Benchmarks ----#
+
+def benchmark_cases(recording: SimulatedRecording) -> dict:
+    """
+    Functions timed by the suite, each one processing the same data on every call.
+
+    Parameters
+    ----------
+    recording: SimulatedRecording
+        Source of the frame used by the stage benchmarks.
+
+    Returns
+    -------
+    dict
+        Benchmark name to function without arguments.
+    """
+
+    raw = recording[0]
+    frame = (raw / raw.max() * 255).astype("uint8")
+    sqr_crop_img = FrameSegmenter.crop_panel(np.flipud(frame), True)
+    segmented = ImageSegmentation.binary_thresholding(sqr_crop_img)
+    core_wrap = CoreWrapper(False)
+    live_stream_wrap = LiveStreamWrapper(False)
+    image_grabber = ImageGrabber(False)
+    coordinate_converter = PixToCartCoords(False)
+    dual_channel = DualChannel(offset=(0, 0))
+    pair = dual_channel.crop_pair(np.flipud(frame), FULL_ROI, panel_center(True), True)
+
+    return {
+        "get_image_detached": lambda: image_grabber.get_image(live_stream_wrap),
+        "scale_to_8_bits": lambda: (raw / raw.max() * 255).astype("uint8"),
+        "bin_tracking_frame": lambda: bin_image(raw, TRACKING_BINNING),
+        "binary_thresholding": lambda: ImageSegmentation.binary_thresholding(sqr_crop_img),
+        "inverted_binary_thresholding": lambda: ImageSegmentation.inverted_binary_thresholding(sqr_crop_img),
+        "find_center": lambda: ImageSegmentation.find_center(segmented),
+        "dual_channel": lambda: dual_channel.process(pair, False), # Against twice binary_thresholding and find_center
+        "pix_to_cart_coords": lambda: coordinate_converter.pixel_to_cartesian_coords(core_wrap, 300, 200, 512, 512),
+    }
+
+def run_engine(recording: SimulatedRecording, timeout: float = 60) -> dict:
+    """
+    Runs the TrackingEngine over the simulated recording, as fast as the frames can be grabbed and
+    segmented, with the tracker driving the simulated stage. A frame is handed to the segmenter only
+    once it took the previous one, so a slower segmentation makes the run longer instead of dropping frames.
+
+    Parameters
+    ----------
+    recording: SimulatedRecording
+        Simulated session.
+    timeout: float
+        Longest time to wait for the recording to run out, in seconds.
+
+    Returns
+    -------
+    dict
+        "seconds" until the last frame was segmented, with the engine's "frames" captured and the
+        frames "tracked" (valid targets), "dropped" (overwritten before they were segmented, none
+        unless the hand-off is broken) and "skipped" (unchanged, the last segmentation reused) by the segmenter.
+    """
+
+    live_stream_wrap = ReplayStreamWrapper(recording, realtime=False, loop=False)
+    core_wrap = ReplayCoreWrapper(live_stream_wrap)
+    engine = TrackingEngine(core_wrap, live_stream_wrap, False, segment_interval=0, track_interval=0.01)
+    registry = MetricsRegistry() # This run's metrics only
+    for worker in engine.workers:
+        worker.metrics = registry
+    engine.segmenter.roi_manager.metrics = registry
+    engine.tracker.stage_guard.metrics = registry
+    engine.tracker.is_tracking_enabled = True
+
+    # Lossless hand-off instead of the latest-frame one, the grabber waits for the segmenter
+    engine.grabber.unsubscribe("tracking_frame", engine.segmenter.receive_frame)
+    def hand_over(frame):
+        while engine.segmenter.frame_event.is_set() and not engine.grabber.stop_event.is_set():
+            time.sleep(0.0002)
+        engine.segmenter.receive_frame(frame)
+    engine.grabber.subscribe("tracking_frame", hand_over)
+
+    tracked = []
+    def count_target(target):
+        if not (isinstance(target, int) and target == -1): # -1 after a segmentation error
+            tracked.append(target)
+    engine.subscribe("target", count_target)
+
+    s = time.perf_counter()
+    engine.start()
+    try:
+        if not engine.wait_until_finished(timeout):
+            raise TimeoutError("The engine did not finish the recording in " + str(timeout) + " s")
+        # The last frame handed to the segmenter is segmented before the engine stops
+        while engine.segmenter.frame_event.is_set() and time.perf_counter() - s < timeout:
+            time.sleep(0.001)
+    finally:
+        engine.stop(timeout)
+    seconds = time.perf_counter() - s
+
+    return {"seconds": seconds, "frames": registry.total("frames_captured"), "tracked": len(tracked),
+            "dropped": registry.total("cv_frames_dropped"), "skipped": registry.total("cv_frames_skipped")}
+
+def benchmark_pipeline(recording: SimulatedRecording, repeat: int = 3) -> dict:
+    """
+    Runs the whole headless TrackingEngine over the simulated recording: grab, binning, ROI crop,
+    change detection, segmentation, coordinate conversion and the stage tracker behind its StageGuard.
+    Every frame is segmented, so the time per frame is that of the slower of grabbing and segmenting.
+
+    Parameters
+    ----------
+    recording: SimulatedRecording
+        Simulated session.
+    repeat: int
+        Number of runs.
+
+    Returns
+    -------
+    dict
+        Time per segmented frame like time_function, with the frame rate and the frames tracked,
+        skipped and dropped by the segmenter, the most dropped in any run.
+    """
+
+    times = []
+    dropped = 0
+    for _ in range(repeat):
+        run = run_engine(recording)
+        segmented = run["frames"] - run["dropped"]
+        times.append(run["seconds"] / max(segmented, 1) * 1000)
+        dropped = max(dropped, run["dropped"])
+    median_ms = float(np.median(times))
+    return {"median_ms": median_ms, "min_ms": float(np.min(times)), "mean_ms": float(np.mean(times)),
+            "calls": len(recording), "repeat": repeat, "fps": 1000 / median_ms, "frames": run["frames"],
+            "tracked": run["tracked"], "dropped": dropped, "skipped": run["skipped"]}
+
+def run_benchmarks(repeat: int = 7, min_time: float = 0.05, num_frames: int = 30, only: tuple = None,
+                   progress_callback = None) -> dict:
+    """
+    Runs the benchmark suite.
+
+    Parameters
+    ----------
+    repeat: int
+        Number of batches per stage benchmark.
+    min_time: float
+        Shortest duration of a batch in seconds.
+    num_frames: int
+        Frames in the simulated recording of the pipeline benchmark.
+    only: tuple
+        Names of the benchmarks to run, all of them if None.
+    progress_callback: callable
+        Called with the name of each benchmark before it runs.
+
+    Returns
+    -------
+    dict
+        Results with the machine they ran on. A benchmark that raised holds its "error" instead.
+    """
+
+    recording = SimulatedRecording(num_frames)
+    cases = benchmark_cases(recording)
+    cases["pipeline_end_to_end"] = None
+
+    benchmarks = {}
+    for name, function in cases.items():
+        if only and name not in only:
+            continue
+        if progress_callback is not None:
+            progress_callback(name)
+        try:
+            if function is None:
+                benchmarks[name] = benchmark_pipeline(recording, max(1, repeat // 2))
+            else:
+                benchmarks[name] = time_function(function, repeat, min_time)
+        except Exception as e:
+            benchmarks[name] = {"error": repr(e)}
+
+    return {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "benchmarks": benchmarks,
+    }
+
+# ---- Comparison ----#
+
+def compare_results(results: dict, baseline: dict, tolerance: float = default_tolerance) -> list:
+    """
+    Compares the median times of two runs, and the frames dropped where both runs count them.
+
+    Parameters
+    ----------
+    results: dict
+        Results of run_benchmarks.
+    baseline: dict
+        Saved results to compare against.
+    tolerance: float
+        Allowed growth of a median time, as a fraction of the baseline.
+
+    Returns
+    -------
+    list
+        One dict per benchmark with its "name", "baseline_ms", "median_ms", "ratio", "dropped"
+        ((baseline, current) frames dropped, None if not counted) and "status": "ok", "improved",
+        "regressed" (slower, or more frames dropped), "new", "missing", "broken" (raised but worked in
+        the baseline) or "error" (raised in both).
+    """
+
+    rows = []
+    current, saved = results["benchmarks"], baseline["benchmarks"]
+    for name in list(saved) + [name for name in current if name not in saved]:
+        row = {"name": name, "baseline_ms": None, "median_ms": None, "ratio": None, "dropped": None}
+        if name not in current:
+            row["status"] = "missing"
+        elif "error" in current[name]:
+            row["status"] = "error" if name not in saved or "error" in saved[name] else "broken"
+        elif name not in saved or "error" in saved[name]:
+            row["median_ms"] = current[name]["median_ms"]
+            row["status"] = "new"
+        else:
+            row["baseline_ms"] = saved[name]["median_ms"]
+            row["median_ms"] = current[name]["median_ms"]
+            row["ratio"] = row["median_ms"] / row["baseline_ms"]
+            if row["ratio"] > 1 + tolerance:
+                row["status"] = "regressed"
+            elif row["ratio"] < 1 / (1 + tolerance):
+                row["status"] = "improved"
+            else:
+                row["status"] = "ok"
+
+            # Frames the segmenter could not keep up with are a slowdown the time per frame does not show
+            if "dropped" in current[name] and "dropped" in saved[name]:
+                row["dropped"] = (saved[name]["dropped"], current[name]["dropped"])
+                if row["dropped"][1] > row["dropped"][0]:
+                    row["status"] = "regressed"
+        rows.append(row)
+    return rows
+
+def has_regressions(rows: list) -> bool:
+    # A benchmark that stopped working counts too, it is no evidence of anything
+    return any(row["status"] in ("regressed", "broken") for row in rows)
+
+def describe_row(row: dict) -> str:
+    if row["ratio"] is None:
+        return row["name"] + ": " + row["status"]
+    dropped = ""
+    if row["dropped"] is not None and row["dropped"][0] != row["dropped"][1]:
+        dropped = ", dropped " + str(row["dropped"][0]) + " -> " + str(row["dropped"][1]) + " frames"
+    return (row["name"] + ": " + "{:.4g}".format(row["baseline_ms"]) + " ms -> " + "{:.4g}".format(row["median_ms"]) +
+            " ms (" + "{:+.1f}".format((row["ratio"] - 1) * 100) + "%" + dropped + ") " + row["status"])
+
+# ---- Command line ----#
+
+@click.group()
+def cli():
+    """Benchmarks for the tracking pipeline."""
+
+@cli.command("run")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Write the results as JSON.")
+@click.option("--repeat", type=click.IntRange(1), default=7, show_default=True, help="Timed batches per benchmark.")
+@click.option("--min-time", type=click.FloatRange(0), default=0.05, show_default=True, help="Shortest batch in seconds.")
+@click.option("--frames", "num_frames", type=click.IntRange(1), default=30, show_default=True,
+              help="Frames in the simulated recording of the end-to-end benchmark.")
+@click.option("--only", multiple=True, help="Run only this benchmark, can be repeated.")
+def run_command(output, repeat, min_time, num_frames, only):
+    """Runs the benchmarks."""
+    results = run_benchmarks(repeat, min_time, num_frames, only, progress_callback=lambda name: click.echo(name + "..."))
+    for name, result in results["benchmarks"].items():
+        if "error" in result:
+            click.echo(name + ": failed with " + result["error"])
+        else:
+            click.echo(name + ": " + "{:.4g}".format(result["median_ms"]) + " ms (min " + "{:.4g}".format(result["min_ms"]) + " ms)")
+    if output is not None:
+        with open(output, "w") as f:
+            json.dump(results, f, indent=2)
+        click.echo("Results written to " + output)
+
+@cli.command("compare")
+@click.argument("baseline_path", type=click.Path(exists=True, dir_okay=False))
+@click.argument("results_path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--tolerance", type=click.FloatRange(0), default=default_tolerance, show_default=True,
+              help="Allowed slowdown as a fraction of the baseline median.")
+def compare_command(baseline_path, results_path, tolerance):
+    """Compares results with a baseline, exits with status 1 on a regression."""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(results_path) as f:
+        results = json.load(f)
+    rows = compare_results(results, baseline, tolerance)
+    for row in rows:
+        click.echo(describe_row(row))
+    if has_regressions(rows):
+        click.echo("Regressions beyond " + str(round(tolerance * 100)) + "% found")
+        sys.exit(1)
+    click.echo("No regressions beyond " + str(round(tolerance * 100)) + "%")
+
+if __name__ == "__main__":
+    cli()
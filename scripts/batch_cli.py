@@ -0,0 +1,175 @@
+"""
+Non-interactive batch tools for recordings, for headless processing nodes. Runs the same conversion
+as compression_app.py and the same splitting as hdf5_splitter.py, spread over several processes.
+
+Examples:
+    python batch_cli.py convert night1/recording_* --output-dir h5 --workers 4 --codec gzip --level 4 --report convert.json
+    python batch_cli.py split h5/*.h5 --ranges "(0,4999) (5000,9999)" --workers 8 --report split.json
+    python batch_cli.py advise h5/recording_a.h5 --workload pixel --apply h5/recording_a_pixel.h5
+"""
+
+import os
+import time
+import click
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from compression_app import create_video_hdf5
+from hdf5_splitter import parse_input, write_subvideo, subvideo_path
+from recording_journal import write_json_atomic
+from chunk_advisor import advise_command
+
+# ================================
+# Option parsing
+# ================================
+
+def parse_chunks(ctx, param, value):
+    if value is None:
+        return None
+    try:
+        chunks = tuple(int(size) for size in value.split(","))
+    except ValueError:
+        raise click.BadParameter("expected comma separated sizes, e.g. 1,1024,2048")
+    if len(chunks) != 3 or min(chunks) < 1:
+        raise click.BadParameter("expected three positive sizes (frames, height, width)")
+    return chunks
+
+def codec_options(codec, level):
+    # Maps the --codec/--level options onto h5py's compression arguments
+    if codec == "none":
+        return None, None
+    if codec == "lzf":
+        return "lzf", None
+    return "gzip", level
+
+def common_options(function):
+    function = click.option("--report", type=click.Path(dir_okay=False), default=None,
+                            help="JSON file rewritten after every job with progress and throughput.")(function)
+    function = click.option("--chunks", callback=parse_chunks, default=None,
+                            help="Output chunk shape as frames,height,width.")(function)
+    function = click.option("--level", type=click.IntRange(1, 9), default=4, show_default=True,
+                            help="gzip compression level.")(function)
+    function = click.option("--codec", type=click.Choice(["gzip", "lzf", "none"]), default=None,
+                            help="Output compression.")(function)
+    function = click.option("--workers", type=click.IntRange(1), default=os.cpu_count(), show_default=True,
+                            help="Number of files/ranges processed at once.")(function)
+    return function
+
+# ================================
+# Progress report
+# ================================
+
+class Report():
+    def __init__(self, path, command, total_jobs):
+        self.path = path
+        self.start_time = time.time()
+        self.data = {"command": command, "total_jobs": total_jobs, "done_jobs": 0, "failed_jobs": 0, "jobs": []}
+        self.write()
+
+    def add(self, job):
+        self.data["jobs"].append(job)
+        if "error" in job:
+            self.data["failed_jobs"] += 1
+        else:
+            self.data["done_jobs"] += 1
+        self.write()
+
+    def write(self):
+        elapsed = time.time() - self.start_time
+        input_bytes = sum(job.get("input_bytes", 0) for job in self.data["jobs"])
+        self.data["elapsed_seconds"] = round(elapsed, 3)
+        self.data["input_mb_per_s"] = round(input_bytes / elapsed / 1e6, 3) if elapsed > 0 else 0
+        if self.path is not None:
+            write_json_atomic(self.path, self.data)
+
+def run_jobs(jobs, workers, report):
+    # jobs maps a description to (function, args, kwargs), each one runs in its own process
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(function, *args, **kwargs): name for name, (function, args, kwargs) in jobs.items()}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                job = dict(future.result(), job=name)
+                click.echo("Done " + name + " in " + str(round(job["seconds"], 2)) + " s")
+            except Exception as e:
+                job = {"job": name, "error": repr(e)}
+                click.echo("Failed " + name + ": " + repr(e), err=True)
+            report.add(job)
+    return report.data["failed_jobs"]
+
+# ================================
+# Jobs, module level so they can be sent to worker processes
+# ================================
+
+def convert_job(tif_folder, hdf5_file_path, compression, compression_opts, chunks, resume):
+    stats = create_video_hdf5(tif_folder, hdf5_file_path, compression=compression, compression_opts=compression_opts,
+                              chunks=chunks, resume=resume)
+    return dict(stats, input=tif_folder, output=hdf5_file_path,
+                input_mb_per_s=stats["input_bytes"] / stats["seconds"] / 1e6 if stats["seconds"] > 0 else 0)
+
+def split_job(hdf5_file_path, start_index, end_index, output_path, **layout):
+    start_index, end_index, output_path, seconds, direct = write_subvideo(hdf5_file_path, "video_frames", start_index,
+                                                                          end_index, output_path, **layout)
+    output_bytes = os.path.getsize(output_path)
+    return {"input": hdf5_file_path, "output": output_path, "start": start_index, "end": end_index,
+            "seconds": seconds, "direct_chunk_copy": direct, "output_bytes": output_bytes,
+            "output_mb_per_s": output_bytes / seconds / 1e6 if seconds > 0 else 0}
+
+# ================================
+# Commands
+# ================================
+
+@click.group()
+def cli():
+    """Batch conversion and splitting of confocal recordings."""
+
+@cli.command()
+@click.argument("folders", nargs=-1, required=True, type=click.Path(exists=True, file_okay=False))
+@click.option("--output-dir", type=click.Path(file_okay=False), default=None,
+              help="Where the .h5 files go, defaults to next to each folder.")
+@click.option("--resume", is_flag=True, help="Continue interrupted conversions from their last checkpoint.")
+@common_options
+def convert(folders, output_dir, resume, workers, codec, level, chunks, report):
+    """Convert TIFF recording folders to HDF5 videos, one output file per folder."""
+
+    compression, compression_opts = codec_options(codec or "gzip", level)
+    jobs = {}
+    for folder in folders:
+        folder = os.path.abspath(folder)
+        directory = output_dir if output_dir is not None else os.path.dirname(folder)
+        hdf5_file_path = os.path.join(directory, os.path.basename(folder) + ".h5")
+        jobs[folder] = (convert_job, (folder, hdf5_file_path, compression, compression_opts,
+                                      chunks or (1, 1024, 2048), resume), {})
+
+    failed = run_jobs(jobs, workers, Report(report, "convert", len(jobs)))
+    raise SystemExit(1 if failed else 0)
+
+@cli.command()
+@click.argument("videos", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--ranges", required=True, help='Inclusive frame ranges, e.g. "(0,99) (100,199)".')
+@common_options
+def split(videos, ranges, workers, codec, level, chunks, report):
+    """Split HDF5 videos into sub-videos. Without --codec/--chunks the source layout is kept,
+    so compressed chunks are copied without recompression."""
+
+    try:
+        tuple_list = parse_input(ranges.strip())
+    except (ValueError, SyntaxError):
+        raise click.BadParameter("expected tuples like (0,99) (100,199)", param_hint="--ranges")
+
+    layout = {"chunks": chunks}
+    if codec is not None:
+        layout["compression"], layout["compression_opts"] = codec_options(codec, level)
+        if layout["compression"] is None:
+            layout["compression"] = False # None would mean "same as source" to write_subvideo
+    jobs = {}
+    for video in videos:
+        for start_index, end_index in tuple_list:
+            output_path = subvideo_path(video, start_index, end_index)
+            jobs[output_path] = (split_job, (video, start_index, end_index, output_path), layout)
+
+    failed = run_jobs(jobs, workers, Report(report, "split", len(jobs)))
+    raise SystemExit(1 if failed else 0)
+
+cli.add_command(advise_command, name="advise")
+
+if __name__ == "__main__":
+    cli()
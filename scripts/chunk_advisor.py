@@ -0,0 +1,200 @@
+"""
+Chunk layout and codec advisor for recorded HDF5 videos. Takes a sample of a recording, writes it
+with several chunk shapes and codecs, and measures compression ratio, write throughput and how much
+data has to be read for the access patterns analysis uses: a single frame, the time-series of one
+pixel, and a small ROI over time. Recommends a layout for a workload and can rechunk the video to it.
+
+Examples:
+    python chunk_advisor.py video.h5 --workload pixel
+    python chunk_advisor.py video.h5 --workload roi --apply video_rechunked.h5
+"""
+
+import os
+import time
+import math
+import itertools
+import click
+import numpy as np
+import h5py
+from hdf5_splitter import write_subvideo
+
+# Blosc and Zstd are only available when the hdf5plugin package is installed
+try:
+    import hdf5plugin
+except ImportError:
+    hdf5plugin = None
+
+workloads = ("frame", "pixel", "roi", "balanced")
+roi_size = 64 # Side of the square ROI read over time
+
+def candidate_chunks(frame_shape, num_frames):
+    # From whole frames (playback) to small, long bricks (time-series), clamped to the video size
+    height, width = frame_shape
+    shapes = [
+        (1, height, width),
+        (1, 256, 256),
+        (16, 128, 128),
+        (64, 64, 64),
+    ]
+    chunks = []
+    for t, y, x in shapes:
+        shape = (min(t, num_frames), min(y, height), min(x, width))
+        if shape not in chunks:
+            chunks.append(shape)
+    return chunks
+
+def candidate_codecs():
+    # (name, keyword arguments for create_dataset)
+    codecs = [
+        ("gzip-1", {"compression": "gzip", "compression_opts": 1}),
+        ("gzip-4", {"compression": "gzip", "compression_opts": 4}),
+        ("gzip-9", {"compression": "gzip", "compression_opts": 9}),
+        ("lzf", {"compression": "lzf"}),
+    ]
+    if hdf5plugin is not None:
+        codecs.append(("blosc-zstd-5", dict(hdf5plugin.Blosc(cname="zstd", clevel=5, shuffle=hdf5plugin.Blosc.SHUFFLE))))
+        codecs.append(("zstd-3", dict(hdf5plugin.Zstd(clevel=3))))
+    return codecs
+
+def chunks_touched(chunks, selection):
+    # Number of chunks a read of the given (start, stop) per axis has to decompress
+    return math.prod((stop - 1) // size - start // size + 1 for (start, stop), size in zip(selection, chunks))
+
+def benchmark_layout(sample, chunks, codec_kwargs, reads=5, seed=0):
+    """
+    Writes sample into an in-memory HDF5 file with the given layout and times the access patterns
+    with the chunk cache turned off, so every read pays for its chunks like a cold read from disk.
+    """
+
+    num_frames, height, width = sample.shape
+    rng = np.random.default_rng(seed)
+    roi = min(roi_size, height, width)
+
+    with h5py.File("advisor_" + str(id(sample)) + ".h5", 'w', driver='core', backing_store=False,
+                   rdcc_nbytes=0) as file:
+        video = file.create_dataset('video_frames', shape=sample.shape, dtype=sample.dtype, chunks=chunks, **codec_kwargs)
+        s = time.perf_counter()
+        video.write_direct(sample)
+        file.flush()
+        write_seconds = time.perf_counter() - s
+
+        stored_bytes = video.id.get_storage_size()
+        num_chunks = math.prod(math.ceil(n / c) for n, c in zip(sample.shape, chunks))
+        chunk_bytes = stored_bytes / num_chunks
+
+        patterns = {}
+        for pattern in ("frame", "pixel", "roi"):
+            seconds = 0.0
+            touched = 0
+            for _ in range(reads):
+                t = int(rng.integers(num_frames))
+                y = int(rng.integers(height - roi + 1))
+                x = int(rng.integers(width - roi + 1))
+                if pattern == "frame":
+                    selection = ((t, t + 1), (0, height), (0, width))
+                elif pattern == "pixel":
+                    selection = ((0, num_frames), (y, y + 1), (x, x + 1))
+                else:
+                    selection = ((0, num_frames), (y, y + roi), (x, x + roi))
+                s = time.perf_counter()
+                video[tuple(slice(start, stop) for start, stop in selection)]
+                seconds += time.perf_counter() - s
+                touched += chunks_touched(chunks, selection)
+            patterns[pattern] = {"ms": seconds / reads * 1000, "mb_read": touched / reads * chunk_bytes / 1e6}
+
+    return {
+        "chunks": tuple(chunks),
+        "compression_ratio": sample.nbytes / stored_bytes,
+        "write_mb_per_s": sample.nbytes / write_seconds / 1e6,
+        "patterns": patterns,
+    }
+
+def workload_cost(result, workload):
+    if workload == "balanced":
+        # Geometric mean, so no single pattern dominates because of its scale
+        return math.prod(result["patterns"][pattern]["ms"] for pattern in ("frame", "pixel", "roi")) ** (1 / 3)
+    return result["patterns"][workload]["ms"]
+
+def advise(hdf5_file_path, dataset_name="video_frames", sample_frames=32, workload="balanced",
+           min_write_mb_per_s=0, reads=5):
+    """
+    Benchmarks every candidate layout on the first sample_frames frames of the video.
+    Returns (recommended result, all results sorted best first, the current layout's result). Layouts
+    writing slower than min_write_mb_per_s are only recommended if nothing else is fast enough.
+    """
+
+    with h5py.File(hdf5_file_path, 'r') as file:
+        video = file[dataset_name]
+        sample = video[:min(sample_frames, video.shape[0])]
+        current_chunks = video.chunks
+        current_codec = {"compression": video.compression, "compression_opts": video.compression_opts}
+
+    results = []
+    codecs = candidate_codecs()
+    candidates = list(itertools.product(candidate_chunks(sample.shape[1:], sample.shape[0]), codecs))
+    for chunks, (codec_name, codec_kwargs) in candidates:
+        result = benchmark_layout(sample, chunks, codec_kwargs, reads)
+        result.update(codec=codec_name, codec_kwargs=codec_kwargs)
+        results.append(result)
+
+    current = None
+    if current_chunks is not None:
+        current_chunks = tuple(min(c, n) for c, n in zip(current_chunks, sample.shape))
+        current = benchmark_layout(sample, current_chunks, {k: v for k, v in current_codec.items() if v is not None}, reads)
+        current.update(codec="current", codec_kwargs=current_codec)
+
+    results.sort(key=lambda result: (workload_cost(result, workload), -result["compression_ratio"]))
+    fast_enough = [result for result in results if result["write_mb_per_s"] >= min_write_mb_per_s]
+    return (fast_enough or results)[0], results, current
+
+def rechunk(hdf5_file_path, output_path, result, dataset_name="video_frames"):
+    # Streams the whole video into the recommended layout, never holding more than a few chunks in memory
+    with h5py.File(hdf5_file_path, 'r') as file:
+        num_frames = file[dataset_name].shape[0]
+    codec_kwargs = result["codec_kwargs"]
+    return write_subvideo(hdf5_file_path, dataset_name, 0, num_frames - 1, output_path, chunks=result["chunks"],
+                          compression=codec_kwargs.get("compression") or False,
+                          compression_opts=codec_kwargs.get("compression_opts"))
+
+def describe(result):
+    patterns = result["patterns"]
+    return (str(result["chunks"]).ljust(18) + result["codec"].ljust(14) +
+            ("x" + str(round(result["compression_ratio"], 2))).ljust(8) +
+            (str(round(result["write_mb_per_s"])) + " MB/s").ljust(11) +
+            "  ".join(pattern + " " + str(round(patterns[pattern]["ms"], 1)) + " ms/" +
+                      str(round(patterns[pattern]["mb_read"], 2)) + " MB" for pattern in ("frame", "pixel", "roi")))
+
+@click.command()
+@click.argument("video", type=click.Path(exists=True, dir_okay=False))
+@click.option("--workload", type=click.Choice(workloads), default="balanced", show_default=True,
+              help="Access pattern to optimise for.")
+@click.option("--sample-frames", type=click.IntRange(1), default=32, show_default=True,
+              help="Frames from the start of the video used for the benchmark.")
+@click.option("--min-write-mb-per-s", type=float, default=0, show_default=True,
+              help="Only recommend layouts that write at least this fast.")
+@click.option("--apply", "output_path", type=click.Path(dir_okay=False), default=None,
+              help="Rechunk the video into this file with the recommended layout.")
+def advise_command(video, workload, sample_frames, min_write_mb_per_s, output_path):
+    """Benchmark chunk layouts and codecs on a recording and recommend one."""
+
+    if hdf5plugin is None:
+        click.echo("hdf5plugin not installed, Blosc and Zstd are skipped")
+    best, results, current = advise(video, sample_frames=sample_frames, workload=workload,
+                                    min_write_mb_per_s=min_write_mb_per_s)
+    click.echo("Layouts, best first for the " + workload + " workload:")
+    for result in results:
+        click.echo("  " + describe(result))
+    if current is not None:
+        click.echo("Current layout:\n  " + describe(current))
+        if workload != "balanced":
+            ratio = current["patterns"][workload]["mb_read"] / max(best["patterns"][workload]["mb_read"], 1e-9)
+            click.echo("Recommended layout reads " + str(round(ratio, 1)) + "x less data per " + workload + " read")
+    click.echo("Recommended: " + describe(best))
+
+    if output_path is not None:
+        click.echo("Rechunking into " + output_path + "...")
+        _, _, _, seconds, _ = rechunk(video, output_path, best)
+        click.echo("Done in " + str(round(seconds, 2)) + " seconds")
+
+if __name__ == "__main__":
+    advise_command()
@@ -4,13 +4,52 @@ import os
 import h5py
 import time
 import shutil
+import threading
 from PyQt5.QtWidgets import QApplication, QWidget, QPushButton, QVBoxLayout, QFileDialog, QLabel, QSlider, QHBoxLayout
+from PyQt5.QtCore import QThread, pyqtSignal
 import math
+import re
+import itertools
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from recording_journal import checkpoint_video_hdf5, recover_video_hdf5, set_aside, default_checkpoint_interval
 
 
+# Runs the conversion in the background so the window stays responsive
+class ConversionThread(QThread):
+    progress_updated = pyqtSignal(int, int, float) # Frames done, total frames, seconds left (-1 if unknown)
+    conversion_done = pyqtSignal(dict)
+    conversion_failed = pyqtSignal(str)
+
+    def __init__(self, tif_folder, hdf5_file_path, compression_value, resume=False):
+        super().__init__()
+        self.tif_folder = tif_folder
+        self.hdf5_file_path = hdf5_file_path
+        self.compression_value = compression_value
+        self.resume = resume
+        self.cancel_event = threading.Event()
+
+    def run(self):
+        def report_progress(done, total, time_left):
+            self.progress_updated.emit(done, total, time_left if time_left is not None else -1)
+
+        try:
+            stats = create_video_hdf5(self.tif_folder, self.hdf5_file_path, compression="gzip",
+                                      compression_opts=self.compression_value, resume=self.resume,
+                                      progress_callback=report_progress, cancel_event=self.cancel_event)
+        except Exception as e:
+            self.conversion_failed.emit(repr(e))
+            return
+        self.conversion_done.emit(stats)
+
+    def cancel(self):
+        # Stops after the batch being written, the video is left consistent and can be resumed
+        self.cancel_event.set()
+
 class VideoHDF5App(QWidget):
     def __init__(self):
         super().__init__()
+        self.conversion_thread = None
 
         self.init_ui()
 
@@ -27,11 +66,16 @@ class VideoHDF5App(QWidget):
         self.compression_slider.setMaximum(9)  # Set maximum value
         self.compression_display = QLabel('Compression Factor: 1')
         self.run_button = QPushButton('Run Function')
+        self.resume_button = QPushButton('Resume Interrupted Conversion')
+        self.cancel_button = QPushButton('Cancel')
+        self.cancel_button.setEnabled(False)
         self.progress_label = QLabel('Progress:  Time left:')
 
         # Connect button clicks to functions
         self.folder_button.clicked.connect(self.select_folder)
         self.run_button.clicked.connect(self.run_function)
+        self.resume_button.clicked.connect(self.resume_function)
+        self.cancel_button.clicked.connect(self.cancel_function)
         self.compression_slider.valueChanged.connect(self.update_compression_display)
 
         # Set up the layout
@@ -41,6 +85,8 @@ class VideoHDF5App(QWidget):
         layout.addWidget(self.compression_slider)
         layout.addWidget(self.compression_display)
         layout.addWidget(self.run_button)
+        layout.addWidget(self.resume_button)
+        layout.addWidget(self.cancel_button)
         layout.addWidget(self.progress_label)
 
         self.setLayout(layout)
@@ -75,84 +121,228 @@ class VideoHDF5App(QWidget):
         compression_value = self.compression_slider.value()
         self.compression_display.setText(f'Compression Factor: {compression_value}')
 
-    def run_function(self):
+    def resume_function(self):
+        self.run_function(resume=True)
+
+    def cancel_function(self):
+        if self.conversion_thread is not None:
+            self.cancel_button.setEnabled(False)
+            self.progress_label.setText(self.progress_label.text() + "  Cancelling...")
+            self.conversion_thread.cancel()
+
+    def run_function(self, resume=False):
         # print(self.selected_folder)
-        if hasattr(self, 'selected_folder'):
+        if hasattr(self, 'selected_folder') and self.conversion_thread is None:
             compression_value = self.compression_slider.value()
 
             # Example output file path, adjust as needed
             hdf5_file_path = self.selected_folder + '/../' + 'output/video.h5'
 
-            # Call the modified function with progress callback
-            self.create_video_hdf5_with_progress(self.selected_folder, hdf5_file_path, compression_value)
+            # Start the conversion in the background, progress comes back through signals
+            self.create_video_hdf5_with_progress(self.selected_folder, hdf5_file_path, compression_value, resume=resume)
 
-    def create_video_hdf5_with_progress(self, tif_folder, hdf5_file_path, compression_value):
+    def create_video_hdf5_with_progress(self, tif_folder, hdf5_file_path, compression_value, resume=False):
 
-        # Find number of files in folder
-        ls = os.listdir(tif_folder)
-        num_files = len(ls)
-        count = 0
+        # The GUI always writes into a fresh output folder unless it resumes
+        output_directory = os.path.dirname(hdf5_file_path)
+        if not (resume and os.path.exists(hdf5_file_path)):
+            if os.path.exists(output_directory):
+                shutil.rmtree(output_directory)
+            os.makedirs(output_directory)
 
-        # Find out initial shape
-        first_img = os.path.join(tif_folder, ls[1])
-        tif_array = tifffile.imread(first_img)
-        frame_shape = tif_array.shape
+        self.hdf5_file_path = hdf5_file_path
+        self.conversion_thread = ConversionThread(tif_folder, hdf5_file_path, compression_value, resume)
+        self.conversion_thread.progress_updated.connect(self.update_progress)
+        self.conversion_thread.conversion_done.connect(self.conversion_done)
+        self.conversion_thread.conversion_failed.connect(self.conversion_failed)
+        self.set_running(True)
+        self.progress_label.setText("Progress: starting...")
+        self.conversion_thread.start()
 
-        output_directory = os.path.dirname(hdf5_file_path)
-        if os.path.exists(output_directory):
-            shutil.rmtree(output_directory)
-        os.makedirs(output_directory)
-
-        with h5py.File(hdf5_file_path, 'a') as hdf5_file:
-            video_dataset = hdf5_file.require_dataset('video_frames', shape=(0, frame_shape[0], frame_shape[1]),
-                                                      maxshape=(None, 2048, 2048), compression="gzip",
-                                                      compression_opts=compression_value, chunks=(1, 1024, 2048), dtype='uint16')
-
-            # Loop through all files in folder
-            ls = os.listdir(tif_folder)
-            for filename in ls:
-
-                if (filename.endswith(('.tif', '.tiff')) == False):
-                    count = count + 1
-                    continue
-
-                s = time.time()
-                file_path = os.path.join(tif_folder, filename)
-                tif_array = tifffile.imread(file_path)
-                current_size = video_dataset.shape[0]
-                video_dataset.resize(current_size + 1, axis=0)
-                video_dataset[current_size, :, :] = tif_array
-                e = time.time()
-                time_elapsed = e - s
-                print("Time taken: " + str(time_elapsed))
-
-                approx_time_left = time_elapsed * (num_files - count)
-
-                # Update progress in the GUI
-                self.progress_label.setText("Progress: " + str(count) + "\\" + str(num_files) + " Time left: <" + str(
-                    math.ceil(approx_time_left / 60)) + " minute(s)")
-                count = count + 1
-                QApplication.processEvents()  # Ensure GUI updates
-
-            self.progress_label.setText("Progress: " + str(count) + "\\" + str(num_files) + " Time left: Done!")
-
-        # Display HDF5 file contents
-        with h5py.File(hdf5_file_path, 'r') as hdf5_file:
-
-            print("\nInput: " + self.selected_folder)
-            print("Output: " + hdf5_file_path +"\n")
-
-            print("Contents of HDF5 file:")
-            print("-----------------------")
-            print("Attributes:")
-            print(hdf5_file.attrs)
-            print("\nDatasets:")
-            for name, dataset in hdf5_file.items():
-                print(f"Dataset: {name}")
-                print(f"Shape: {dataset.shape}")
-                print(f"Dtype: {dataset.dtype}")
-                print(f"Compression: {dataset.compression}")
-                print(f"Compression Options: {dataset.compression_opts}")
+    def closeEvent(self, event):
+        # Qt aborts if a running thread is destroyed, a conversion stops after the batch being written
+        # and can be resumed later
+        if self.conversion_thread is not None:
+            self.conversion_thread.cancel()
+            self.conversion_thread.wait()
+        event.accept()
+
+    def set_running(self, running):
+        self.run_button.setEnabled(not running)
+        self.resume_button.setEnabled(not running)
+        self.folder_button.setEnabled(not running)
+        self.cancel_button.setEnabled(running)
+
+    def update_progress(self, count, num_files, approx_time_left):
+        # Update progress in the GUI
+        time_left = "?" if approx_time_left < 0 else "<" + str(math.ceil(approx_time_left / 60)) + " minute(s)"
+        self.progress_label.setText("Progress: " + str(count) + "\\" + str(num_files) + " Time left: " + time_left)
+
+    def conversion_done(self, stats):
+        self.conversion_thread.wait()
+        self.conversion_thread = None
+        self.set_running(False)
+        if stats["cancelled"]:
+            self.progress_label.setText("Progress: " + str(stats["frames"]) + "\\" + str(stats["files"]) +
+                                        " Cancelled, press Resume to continue")
+            return
+        self.progress_label.setText("Progress: " + str(stats["files"]) + "\\" + str(stats["files"]) + " Time left: Done!")
+
+        print("\nInput: " + self.selected_folder)
+        print_hdf5_contents(self.hdf5_file_path)
+
+    def conversion_failed(self, message):
+        self.conversion_thread.wait()
+        self.conversion_thread = None
+        self.set_running(False)
+        self.progress_label.setText("Conversion failed: " + message)
+        print("Conversion failed: " + message)
+
+class EtaEstimator():
+    # Exponentially weighted frame rate, so one slow or fast batch doesn't swing the time left
+    def __init__(self, frames_done, smoothing=0.2):
+        self.smoothing = smoothing
+        self.rate = None
+        self.last_done = frames_done
+        self.last_time = time.monotonic()
+
+    def update(self, frames_done, total_frames):
+        now = time.monotonic()
+        if now > self.last_time:
+            rate = (frames_done - self.last_done) / (now - self.last_time)
+            self.rate = rate if self.rate is None else self.rate + self.smoothing * (rate - self.rate)
+        self.last_done = frames_done
+        self.last_time = now
+        if not self.rate:
+            return None
+        return (total_frames - frames_done) / self.rate
+
+def natural_sort_key(filename):
+    # Compares the numbers in file names as numbers, so frame_2.tif comes before frame_10.tif
+    return [int(part) if part.isdigit() else part for part in re.split(r'(\d+)', filename)]
+
+def read_frames(file_paths, read_workers=4, prefetch=16):
+    # Yields the TIFFs in order while a thread pool is already reading up to `prefetch` files ahead
+    with ThreadPoolExecutor(max_workers=read_workers) as pool:
+        paths = iter(file_paths)
+        pending = deque(pool.submit(tifffile.imread, path) for path in itertools.islice(paths, prefetch))
+        while pending:
+            frame = pending.popleft().result()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append(pool.submit(tifffile.imread, next_path))
+            yield frame
+
+def create_video_hdf5(tif_folder, hdf5_file_path, compression="gzip", compression_opts=4, chunks=(1, 1024, 2048),
+                      resume=False, progress_callback=None, read_workers=4, prefetch=16, batch_bytes=64 * 1024 ** 2,
+                      cancel_event=None):
+    """
+    Converts a folder of TIFF frames into the 'video_frames' dataset of an HDF5 file. Has no GUI
+    dependencies so the batch command line (batch_cli.py) can run it too. progress_callback, if given,
+    is called after every written batch with (frames done, total frames, estimated seconds left or None).
+    Setting cancel_event (a threading.Event) stops after the current batch, leaving a video that can be resumed.
+    Returns a dict with the number of frames and files, seconds taken, input/output bytes and whether it was cancelled.
+    """
+
+    s_total = time.time()
+
+    # Count and order the frames up front so the dataset can be allocated once
+    tif_files = sorted((filename for filename in os.listdir(tif_folder) if filename.endswith(('.tif', '.tiff'))),
+                       key=natural_sort_key)
+    num_files = len(tif_files)
+    file_paths = [os.path.join(tif_folder, filename) for filename in tif_files]
+    frame_shape = tifffile.imread(file_paths[0]).shape
+
+    # Resuming truncates the video to its last checkpoint and skips the frames already in it. A file
+    # that cannot be resumed is kept under another name and the conversion starts from scratch
+    frames_done = 0
+    if resume and os.path.exists(hdf5_file_path):
+        try:
+            frames_done = recover_video_hdf5(hdf5_file_path)
+        except (OSError, ValueError) as e:
+            corrupt_path = set_aside(hdf5_file_path)
+            print("Could not resume " + hdf5_file_path + " (" + str(e) + "), moved it to " + corrupt_path)
+    elif os.path.exists(hdf5_file_path):
+        os.remove(hdf5_file_path)
+    os.makedirs(os.path.dirname(os.path.abspath(hdf5_file_path)), exist_ok=True)
+
+    input_bytes = 0
+    with h5py.File(hdf5_file_path, 'a') as hdf5_file:
+        if 'video_frames' in hdf5_file:
+            video_dataset = hdf5_file['video_frames'] # Resumed video
+            video_dataset.resize(num_files, axis=0)
+        else:
+            video_dataset = hdf5_file.create_dataset('video_frames', shape=(num_files, frame_shape[0], frame_shape[1]),
+                                                     maxshape=(None, 2048, 2048), compression=compression,
+                                                     compression_opts=compression_opts, chunks=tuple(chunks), dtype='uint16')
+            checkpoint_video_hdf5(hdf5_file, video_dataset, 0) # Marks the video as journaled, so it can be resumed
+
+        # Frames are collected into whole chunks' worth of frames and written with one call per batch
+        frame_bytes = int(np.prod(frame_shape)) * video_dataset.dtype.itemsize
+        chunk_frames = video_dataset.chunks[0]
+        batch_frames = max(1, batch_bytes // (frame_bytes * chunk_frames)) * chunk_frames
+        buffer = np.empty((batch_frames,) + tuple(frame_shape), dtype=video_dataset.dtype)
+
+        index = frames_done
+        last_checkpoint = frames_done
+        n = 0
+        cancelled = False
+        eta = EtaEstimator(frames_done)
+        frames = read_frames(file_paths[frames_done:], read_workers, prefetch)
+        for frame in frames:
+            buffer[n] = frame
+            input_bytes = input_bytes + frame.nbytes
+            n = n + 1
+
+            # Flush on the global batch grid, so a resumed conversion is chunk aligned again after one batch
+            if (index + n) % batch_frames != 0 and index + n != num_files:
+                continue
+            video_dataset.write_direct(buffer, np.s_[0:n], np.s_[index:index + n])
+            index = index + n
+            n = 0
+            if index - last_checkpoint >= default_checkpoint_interval:
+                checkpoint_video_hdf5(hdf5_file, video_dataset, index)
+                last_checkpoint = index
+
+            if progress_callback is not None:
+                progress_callback(index, num_files, eta.update(index, num_files))
+            if cancel_event is not None and cancel_event.is_set():
+                cancelled = True
+                break
+        frames.close()
+
+        # A cancelled video is cut back to what was written, resuming grows it again
+        if cancelled:
+            video_dataset.resize(index, axis=0)
+        checkpoint_video_hdf5(hdf5_file, video_dataset, index)
+        num_frames = video_dataset.shape[0]
+
+    return {
+        "frames": num_frames,
+        "files": num_files,
+        "cancelled": cancelled,
+        "seconds": time.time() - s_total,
+        "input_bytes": input_bytes,
+        "output_bytes": os.path.getsize(hdf5_file_path),
+    }
+
+def print_hdf5_contents(hdf5_file_path):
+    # Display HDF5 file contents
+    with h5py.File(hdf5_file_path, 'r') as hdf5_file:
+
+        print("Output: " + hdf5_file_path +"\n")
+
+        print("Contents of HDF5 file:")
+        print("-----------------------")
+        print("Attributes:")
+        print(hdf5_file.attrs)
+        print("\nDatasets:")
+        for name, dataset in hdf5_file.items():
+            print(f"Dataset: {name}")
+            print(f"Shape: {dataset.shape}")
+            print(f"Dtype: {dataset.dtype}")
+            print(f"Compression: {dataset.compression}")
+            print(f"Compression Options: {dataset.compression_opts}")
 
 
 if __name__ == '__main__':
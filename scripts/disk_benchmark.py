@@ -0,0 +1,92 @@
+"""
+Pre-flight disk benchmark for record_raw.py. Writes real frames to the chosen output directory,
+with the same TIFF writer and codec the recorder uses, to predict the highest frame rate the disk
+can sustain and pick a compression level that keeps up with the acquisition rate.
+
+Benchmark a directory from the command line:
+    python disk_benchmark.py <output_directory> [target_fps]
+"""
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+import tifffile
+from recording_journal import frame_file_name, tiff_compression_args, fsync_path
+
+default_frame_shape = (1024, 2048) # 16 bit frames with the ROI set by the tracking program
+default_levels = (0, 1, 3, 6, 9) # 0 is uncompressed, the rest are zlib levels
+default_headroom = 1.2 # Predicted rate has to beat the target by this factor to count as sustainable
+
+def make_sample_frame(frame_shape=default_frame_shape):
+    # Dim background with shot noise, compresses about as well as a real confocal frame
+    rng = np.random.default_rng(0)
+    frame = rng.poisson(100, size=frame_shape) + np.linspace(0, 400, frame_shape[1])
+    return frame.astype(np.uint16)
+
+def benchmark_write_throughput(directory, sample_frame, compression_level=0, n_frames=24):
+    """
+    Writes n_frames copies of sample_frame as TIFFs into a scratch folder in directory, syncing
+    each one so the page cache can't hide a slow disk, and returns the measured rates.
+    """
+
+    bench_path = tempfile.mkdtemp(prefix=".disk_benchmark_", dir=directory)
+    disk_bytes = 0
+    try:
+        s = time.perf_counter()
+        for i in range(n_frames):
+            full_path = os.path.join(bench_path, frame_file_name(i))
+            tifffile.imwrite(full_path, sample_frame, **tiff_compression_args(compression_level))
+            fsync_path(full_path)
+            disk_bytes += os.path.getsize(full_path)
+        e = time.perf_counter()
+    finally:
+        shutil.rmtree(bench_path, ignore_errors=True)
+
+    elapsed = e - s
+    raw_bytes = sample_frame.nbytes * n_frames
+    return {
+        "compression_level": compression_level,
+        "fps": n_frames / elapsed,
+        "raw_mb_per_s": raw_bytes / elapsed / 1e6,
+        "disk_mb_per_s": disk_bytes / elapsed / 1e6,
+        "compression_ratio": raw_bytes / disk_bytes,
+    }
+
+def plan_recording(directory, target_fps, sample_frame=None, levels=default_levels,
+                   headroom=default_headroom, n_frames=24):
+    """
+    Benchmarks compression levels from cheapest to strongest and returns (chosen result, all results).
+    The first level that sustains target_fps with headroom wins, as it costs the least CPU. If none
+    does, the fastest one is returned and its fps is below the target.
+    """
+
+    if sample_frame is None:
+        sample_frame = make_sample_frame()
+    results = []
+    for level in levels:
+        result = benchmark_write_throughput(directory, sample_frame, level, n_frames)
+        results.append(result)
+        if result["fps"] >= target_fps * headroom:
+            return result, results
+    return max(results, key=lambda result: result["fps"]), results
+
+def describe(result):
+    level = "uncompressed" if result["compression_level"] == 0 else "zlib level " + str(result["compression_level"])
+    return (level + ": " + str(round(result["fps"], 1)) + " fps, " + str(round(result["raw_mb_per_s"], 1)) + " MB/s of frames, " +
+            str(round(result["disk_mb_per_s"], 1)) + " MB/s to disk, ratio " + str(round(result["compression_ratio"], 2)))
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python disk_benchmark.py <output_directory> [target_fps]")
+        sys.exit(1)
+
+    target_fps = float(sys.argv[2]) if len(sys.argv) == 3 else 10
+    chosen, results = plan_recording(sys.argv[1], target_fps)
+    for result in results:
+        print(describe(result))
+    if chosen["fps"] < target_fps:
+        print("Warning: no compression level sustains " + str(target_fps) + " fps on this directory")
+    print("Selected " + describe(chosen))
@@ -12,6 +12,8 @@ import sys
 import ast
 import os
 import threading
+import itertools
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # ================================
 # Video processing functions
@@ -21,8 +23,8 @@ def load_video(hdf5_file_path, dataset_name):
     hdf5_file = h5py.File(hdf5_file_path, 'r')
     video = hdf5_file[dataset_name]
     num_frames = video.shape[0]
-    total_memory_mb = video.nbytes / (1024 ** 3)  # Convert bytes to megabytes
-    print("Loaded in the video. It has " + str(num_frames) + " frames and takes " + str(round(total_memory_mb,3)) + " GB w/o compression")
+    total_memory_gb = video.nbytes / (1024 ** 3)  # Convert bytes to gigabytes
+    print("Loaded in the video. It has " + str(num_frames) + " frames and takes " + str(round(total_memory_gb,3)) + " GB w/o compression")
     return video
 
 def parse_input(input_string):
@@ -32,13 +34,98 @@ def parse_input(input_string):
         tuple_list.append(ast.literal_eval(tuple_string))
     return tuple_list
 
-def split_video(video,start_index, end_index):
-    return video[start_index:end_index+1,:,:] 
-
-def save_cropped_video(cropped_video, output_path):
-    with h5py.File(output_path, 'w') as file:
-        # file.create_dataset('video_frames', data=cropped_video)
-        file.create_dataset('video_frames', data=cropped_video, compression='gzip', compression_opts=9, chunks=(1, 1024, 2048), dtype='uint8')
+def subvideo_path(path, start_index, end_index):
+    return os.path.join(os.path.dirname(path), os.path.basename(path).split(".")[0] + "_subvideo" + str(start_index) + "to" + str(end_index) + ".h5")
+
+def target_layout(video, chunks=None, compression=None, compression_opts=None, dtype=None):
+    # Anything not given is taken from the source video, which lets chunks be copied as they are
+    if compression is None:
+        compression = video.compression
+    elif compression is False:
+        compression = None # Explicitly uncompressed
+    if compression_opts is None and compression == video.compression:
+        compression_opts = video.compression_opts
+    return {
+        "chunks": tuple(chunks) if chunks is not None else video.chunks,
+        "compression": compression,
+        "compression_opts": compression_opts,
+        "dtype": np.dtype(dtype) if dtype is not None else video.dtype,
+    }
+
+def can_copy_chunks(video, layout, start_index):
+    # Raw chunks are only valid in the output if they'd be encoded exactly the same way and line up in time
+    return (video.chunks is not None and
+            layout["chunks"] == video.chunks and
+            layout["compression"] == video.compression and
+            layout["compression_opts"] == video.compression_opts and
+            layout["dtype"] == video.dtype and
+            not video.shuffle and not video.fletcher32 and video.scaleoffset is None and
+            start_index % video.chunks[0] == 0)
+
+def copy_chunks(video, sub_video, start_index, num_frames):
+    # Move compressed chunks straight from one file to the other, no decompression or recompression
+    chunks = video.chunks
+    spatial_offsets = [range(0, video.shape[axis], chunks[axis]) for axis in range(1, video.ndim)]
+    for t in range(0, num_frames, chunks[0]):
+        for spatial in itertools.product(*spatial_offsets):
+            source_offset = (start_index + t,) + spatial
+            if video.id.get_chunk_info_by_coord(source_offset).byte_offset is None:
+                continue # Never written in the source, reads back as the fill value in both files
+            filter_mask, data = video.id.read_direct_chunk(source_offset)
+            sub_video.id.write_direct_chunk((t,) + spatial, data, filter_mask)
+
+def stream_frames(video, sub_video, start_index, num_frames, batch_bytes=64 * 1024 ** 2):
+    # Decode and re-encode a few output chunks at a time through one reused buffer
+    frame_bytes = int(np.prod(video.shape[1:])) * sub_video.dtype.itemsize
+    chunk_frames = sub_video.chunks[0]
+    batch_frames = max(1, batch_bytes // (frame_bytes * chunk_frames)) * chunk_frames
+    buffer = np.empty((min(batch_frames, num_frames),) + video.shape[1:], dtype=sub_video.dtype)
+    for t in range(0, num_frames, batch_frames):
+        n = min(batch_frames, num_frames - t)
+        video.read_direct(buffer, np.s_[start_index + t:start_index + t + n], np.s_[0:n])
+        sub_video[t:t + n] = buffer[:n]
+
+def write_subvideo(hdf5_file_path, dataset_name, start_index, end_index, output_path,
+                   chunks=None, compression=None, compression_opts=None, dtype=None):
+    """
+    Writes frames start_index to end_index (inclusive) of the video to output_path without ever holding
+    the whole range in memory. Runs in a worker process, so it opens the files itself.
+    Returns (start_index, end_index, output_path, seconds taken, True if chunks were copied directly).
+    """
+
+    s = time.time()
+    with h5py.File(hdf5_file_path, 'r') as hdf5_file:
+        video = hdf5_file[dataset_name]
+        end_index = min(end_index, video.shape[0] - 1)
+        num_frames = end_index - start_index + 1
+        if num_frames <= 0:
+            raise ValueError("Frames " + str(start_index) + " to " + str(end_index) + " are outside the video")
+
+        layout = target_layout(video, chunks, compression, compression_opts, dtype)
+        direct = can_copy_chunks(video, layout, start_index)
+        with h5py.File(output_path, 'w') as file:
+            sub_video = file.create_dataset(dataset_name, shape=(num_frames,) + video.shape[1:],
+                                            chunks=layout["chunks"], compression=layout["compression"],
+                                            compression_opts=layout["compression_opts"], dtype=layout["dtype"])
+            for key, value in video.attrs.items():
+                sub_video.attrs[key] = value
+            if "frames_written" in sub_video.attrs:
+                sub_video.attrs["frames_written"] = num_frames
+
+            if direct:
+                copy_chunks(video, sub_video, start_index, num_frames)
+            else:
+                stream_frames(video, sub_video, start_index, num_frames)
+    return start_index, end_index, output_path, time.time() - s, direct
+
+def split_video_parallel(hdf5_file_path, dataset_name, tuple_list, workers=None, **layout):
+    # Writes every sub-video in its own process, results are yielded in the order they finish
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(write_subvideo, hdf5_file_path, dataset_name, tup[0], tup[1],
+                               subvideo_path(hdf5_file_path, tup[0], tup[1]), **layout)
+                   for tup in tuple_list]
+        for future in as_completed(futures):
+            yield future.result()
 
 # ================================
 # Animations
@@ -111,21 +198,20 @@ if __name__ == "__main__":
     string_input = input("Enter here: ") # DEBUG, UNCOMMENT LATER
     tuple_list = parse_input(string_input) # Function completed
 
-    # Step 4: Create sub-videos
+    # Step 4: Create sub-videos, all at once in separate processes
     print("\n4. Generating the sub-videos in the same directory as the input path")
-    for i, tup in enumerate(tuple_list):
-
-        print("Creating a sub-video from frame " + str(tup[0]) + " to " + str(tup[1]) + "...        ", end="", flush=True)
-        spinner_stop_event = start_spinner()
-
-        s = time.time()
-        sub_video = split_video(video, tup[0], tup[1]) # Complete function
-        output_path = os.path.dirname(path) + slash + os.path.basename(path).split(".")[0] + "_subvideo" + str(tup[0]) + "to" + str(tup[1]) + ".h5"
-        save_cropped_video(sub_video,output_path) # DEBUG, UNCOMMENT LATER
+    print("Creating " + str(len(tuple_list)) + " sub-video(s)...        ", end="", flush=True)
+    spinner_stop_event = start_spinner()
+
+    s = time.time()
+    try:
+        for start_index, end_index, output_path, seconds, direct in split_video_parallel(path, "video_frames", tuple_list):
+            method = "copied compressed chunks" if direct else "recompressed"
+            sys.stdout.write("\rCreated a sub-video from frame " + str(start_index) + " to " + str(end_index) + "!" +
+                             " Took " + str(round(seconds,2)) + " seconds (" + method + ").\n        ")
+    finally:
         stop_spinner(spinner_stop_event)
-        e = time.time() 
+    e = time.time()
 
-        print("\rCreated a sub-video from frame " + str(tup[0]) + " to " + str(tup[1]) + "!" + " Took " + str(round(e-s,2)) + " seconds.")
+    print("\rAll sub-videos done in " + str(round(e-s,2)) + " seconds.")
     print()
-
-
@@ -13,17 +13,33 @@ import pycromanager
 import sys
 import os
 import shutil
+import threading
 from datetime import datetime
 import tifffile
 from pycromanager import Core
+from recording_journal import RecordingJournal, recover_recording
+from disk_benchmark import plan_recording, describe, default_headroom
 
 Microscope = True # If False, simulates image capture
 
 dataset_name = "image"
 Time = True
+target_fps = 10 # Acquisition rate the recording thread paces itself to
 temp_path = ".\\temp\\"
 default_output_path = ".\\temp"
 
+# Offline frame for detached mode, memory mapped once instead of loaded for every frame
+offline_frame_paths = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "hongruo.npy"),
+                       os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "hongruo.npy")]
+offline_frame = None
+
+def load_offline_frame():
+    global offline_frame
+    if offline_frame is None:
+        path = next((path for path in offline_frame_paths if os.path.exists(path)), "hongruo.npy")
+        offline_frame = np.load(path, mmap_mode="r")[512:1536,:] # The image would already be cropped
+    return offline_frame
+
 # Wrapper for MicroManager core
 class CoreWrapper():
     def __init__(self):
@@ -85,7 +101,7 @@ class LiveStreamWrapper():
             frame = self.livestream_instance.snap(display_img_bool)
         else:
             time.sleep(0.1)
-            frame = np.load('hongruo.npy')[512:1536,:]
+            frame = np.array(load_offline_frame())
         return frame # Microscope
 
     def is_live_mode_on(self):
@@ -116,12 +132,11 @@ class ImageGrabber():
 
             # image_array = (image_array / image_array.max() * 255).astype("uint8")[0, :, :]
             # image_array = (image_array).astype("uint8")[0, :, :] # No autocorrection
-            time.sleep(0.02) # Gets closer to 10 Hz
-            return image_array # 16 bit!!!
+            return image_array # 16 bit!!! Frame rate is set by FramePacer in RecordingThread
 
         else:
             s = time.time()
-            reshaped_img = np.load('hongruo.npy')[512:1536,:] # The image would already be cropped
+            reshaped_img = load_offline_frame()
             # reshaped_img = np.random.randint(0, 256, size=(2048, 2048), dtype=np.uint16) # Detached
             image = (reshaped_img / reshaped_img.max() * 255).astype("uint8")
             # image = (reshaped_img).astype("uint8") # No autocorrection
@@ -131,42 +146,130 @@ class ImageGrabber():
             # print("Time for getting image: " + str(e-s))
             return image
 
+# Schedules frame acquisition on fixed monotonic deadlines so the frame rate doesn't drift
+class FramePacer():
+    def __init__(self, fps):
+        self.period = 1.0 / fps
+        self.reset()
+
+    def reset(self):
+        self.start_time = None
+        self.next_deadline = None
+        self.last_tick = None
+        self.interval_count = 0
+        self.interval_mean = 0.0
+        self.interval_m2 = 0.0
+        self.max_deviation = 0.0
+        self.missed_deadlines = 0
+
+    def wait_for_next_frame(self):
+        # Returns (monotonic time, wall clock time) of the frame slot once its deadline is reached
+        if self.next_deadline is None:
+            self.start_time = time.monotonic()
+            self.next_deadline = self.start_time
+
+        delay = self.next_deadline - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        tick = time.monotonic()
+        wall = time.time()
+
+        # Deadlines advance by whole periods from the first frame, so sleep error never accumulates.
+        # If a frame overran by more than a period, skip the missed slots instead of bursting to catch up.
+        self.next_deadline += self.period
+        if tick >= self.next_deadline:
+            missed = int((tick - self.next_deadline) // self.period) + 1
+            self.missed_deadlines += missed
+            self.next_deadline += missed * self.period
+
+        if self.last_tick is not None:
+            self.add_interval(tick - self.last_tick)
+        self.last_tick = tick
+        return tick, wall
+
+    def add_interval(self, interval):
+        # Welford's running mean/variance, so long sessions don't keep every interval in memory
+        self.interval_count += 1
+        delta = interval - self.interval_mean
+        self.interval_mean += delta / self.interval_count
+        self.interval_m2 += delta * (interval - self.interval_mean)
+        self.max_deviation = max(self.max_deviation, abs(interval - self.period))
+
+    def elapsed(self, tick):
+        return tick - self.start_time
+
+    def jitter_stats(self):
+        std = (self.interval_m2 / (self.interval_count - 1)) ** 0.5 if self.interval_count > 1 else 0.0
+        return {
+            "target_interval_ms": self.period * 1000,
+            "mean_interval_ms": self.interval_mean * 1000,
+            "jitter_std_ms": std * 1000,
+            "max_deviation_ms": self.max_deviation * 1000,
+            "missed_deadlines": self.missed_deadlines,
+            "intervals": self.interval_count,
+        }
+
 class RecordingThread(QThread):
     count_updated = pyqtSignal(int)
+    jitter_updated = pyqtSignal(dict)
 
-    def __init__(self, image_queue):
+    def __init__(self, image_queue, fps=target_fps):
         super().__init__()
         self.image_queue = image_queue
         self.is_recording = False
+        self.is_running = True
+        self.record_event = threading.Event() # Set while recording, lets run() block instead of spinning when idle
+        self.pacer = FramePacer(fps)
         self.count = 0
 
     def run(self):
-        while True:
-            if self.is_recording:
-                s = time.time()
-                frame = ImageGrabber.get_image(live_stream_wrap)
-                e = time.time()
-
-                # This block takes about 0.006s
-                x_cur_pos = GetStageCoords.get_x_coord(core_wrap)
-                y_cur_pos = GetStageCoords.get_y_coord(core_wrap)
-                elapsed_time = time.time() - mainWindow.start_time
-                # print([x_cur_pos,y_cur_pos, elapsed_time]) # Put this in a tuple of (image, x_cur_pos, y_cur_pos, elapsed_time)
-                frame_info = (frame,x_cur_pos,y_cur_pos,elapsed_time)
-
-                self.image_queue.put(frame_info) # Put tuple in queue
-                # print("Image capture time: " + str(round(e-s,2)) +", Count: " + str(self.count)) # DEBUG
-                self.count_updated.emit(self.count)
-                self.count += 1
+        was_recording = False
+        while self.is_running:
+            if not self.record_event.wait(0.5):
+                if was_recording:
+                    self.report_jitter()
+                    was_recording = False
+                continue
+
+            if not was_recording:
+                self.pacer.reset()
+                was_recording = True
+
+            tick, wall = self.pacer.wait_for_next_frame()
+            frame = ImageGrabber.get_image(live_stream_wrap)
+
+            # This block takes about 0.006s
+            x_cur_pos = GetStageCoords.get_x_coord(core_wrap)
+            y_cur_pos = GetStageCoords.get_y_coord(core_wrap)
+            elapsed_time = self.pacer.elapsed(tick) # Monotonic, unaffected by system clock changes
+            frame_info = (frame,x_cur_pos,y_cur_pos,elapsed_time,wall)
+
+            self.image_queue.put(frame_info) # Put tuple in queue
+            self.count_updated.emit(self.count)
+            if self.count % 50 == 0:
+                self.jitter_updated.emit(self.pacer.jitter_stats())
+            self.count += 1
+
+    def report_jitter(self):
+        stats = self.pacer.jitter_stats()
+        self.jitter_updated.emit(stats)
+        print("Frame interval: " + str(round(stats["mean_interval_ms"],2)) + " ms (target " + str(round(stats["target_interval_ms"],2)) +
+              " ms), jitter std: " + str(round(stats["jitter_std_ms"],2)) + " ms, max deviation: " + str(round(stats["max_deviation_ms"],2)) +
+              " ms, missed deadlines: " + str(stats["missed_deadlines"]))
 
     def toggle_recording(self):
         self.is_recording = not self.is_recording
+        if self.is_recording:
+            self.record_event.set()
+        else:
+            self.record_event.clear()
 
     def stop(self):
         self.is_running = False
 
 class WriteToDiskThread(QThread):
     count_updated = pyqtSignal(int)
+    throughput_updated = pyqtSignal(dict)
 
     def __init__(self, image_queue, file_queue, parent=None):
         super().__init__(parent)
@@ -177,39 +280,76 @@ class WriteToDiskThread(QThread):
         self.output_path = default_output_path
         self.text_file_path = None
         self.recording_path = ""
+        self.journal = None # Writes frames and log lines, and checkpoints them for crash recovery
+        self.journal_lock = threading.Lock()
+        self.compression_level = 0 # Picked by the disk benchmark when an output directory is selected
+        self.predicted = None # Disk benchmark result for the selected compression level
+        self.telemetry_interval = 2.0 # Seconds between throughput reports
+        self.window_start = time.monotonic()
+        self.window_frames = 0
+        self.window_bytes = 0
 
     def run(self):
         time.sleep(0.1)
         while self.running:
             if not self.image_queue.empty():
-                s = time.time()
-
-                # Grab image from queue and save it
-                # get tuple from queue
+                # Grab tuple from queue, the journal saves the image then its log line
                 image_info = self.image_queue.get()
-                image = image_info[0]
-                tiff_file_path = self.numpy_image_to_tiff(image) 
-
-                # Write to text file 
-                data = (self.count, (image_info[1],image_info[2]),image_info[3])
-                with open(writetodiskThread.text_file_path, 'a') as file:
-                    file.write(str(data) + '\n')
-
-                e = time.time()
-                # print("Save to disk time: " + str(round(e-s,2)) + ",  Count: " + str(self.count)) # DEBUG
-                self.count += 1
+                with self.journal_lock:
+                    self.journal.append(*image_info)
+                    self.count = self.journal.count
+                self.window_frames += 1
+                self.window_bytes += image_info[0].nbytes
+                self.report_throughput()
 
             else:
+                # Queue drained, make everything written so far durable before idling
+                with self.journal_lock:
+                    if self.journal is not None:
+                        self.journal.checkpoint()
                 time.sleep(0.1)  # Sleep briefly to avoid hogging CPU
 
     def toggle_recording(self):
         self.recording = not self.recording  # Toggle the recording state
 
-    def numpy_image_to_tiff(self, image):
-        tiff_output_path = "frame_" + str(self.count) + ".tif"
-        full_path = self.recording_path + "\\" + tiff_output_path
-        tifffile.imwrite(full_path, image, compression=None) # DEBUG!
-        return tiff_output_path
+    def report_throughput(self):
+        # Compare the rate frames actually reach the disk with the benchmark's prediction
+        now = time.monotonic()
+        elapsed = now - self.window_start
+        if elapsed < self.telemetry_interval:
+            return
+        telemetry = {
+            "fps": self.window_frames / elapsed,
+            "mb_per_s": self.window_bytes / elapsed / 1e6,
+            "queue": self.image_queue.qsize(),
+            "predicted_fps": self.predicted["fps"] if self.predicted else None,
+            "predicted_mb_per_s": self.predicted["raw_mb_per_s"] if self.predicted else None,
+        }
+        self.throughput_updated.emit(telemetry)
+        self.window_start = now
+        self.window_frames = 0
+        self.window_bytes = 0
+
+    def set_compression(self, benchmark_result):
+        self.compression_level = benchmark_result["compression_level"]
+        self.predicted = benchmark_result
+
+    def start_journal(self, journal):
+        with self.journal_lock:
+            if self.journal is not None:
+                self.journal.close()
+            # New and resumed recordings alike use the level the disk benchmark picked, recover_recording
+            # does not know it
+            journal.compression_level = self.compression_level
+            self.journal = journal
+            self.count = journal.count
+            self.recording_path = journal.recording_path
+            self.text_file_path = journal.text_file_path
+
+    def close_journal(self):
+        with self.journal_lock:
+            if self.journal is not None:
+                self.journal.close()
 
     def force_stop(self):
         print("Add force stop functionality")
@@ -217,6 +357,24 @@ class WriteToDiskThread(QThread):
     def update_output_path(self,new_path):
         self.output_path = new_path
 
+class DiskBenchmarkThread(QThread):
+    # Runs plan_recording off the GUI thread, it writes and syncs real frames for every compression level
+    benchmark_done = pyqtSignal(dict, list)
+    benchmark_failed = pyqtSignal(str)
+
+    def __init__(self, output_directory, sample_frame, parent=None):
+        super().__init__(parent)
+        self.output_directory = output_directory
+        self.sample_frame = sample_frame
+
+    def run(self):
+        try:
+            chosen, results = plan_recording(self.output_directory, target_fps, self.sample_frame)
+        except Exception as e:
+            self.benchmark_failed.emit(repr(e))
+            return
+        self.benchmark_done.emit(chosen, results)
+
 class MainWindow(QMainWindow):
     # Define a signal that doesn't pass any data
     record_signal = pyqtSignal()
@@ -235,12 +393,19 @@ class MainWindow(QMainWindow):
         self.recordCount = 0
 
         self.record = False
+        self.resume_journal = None # Set by --resume, the next recording appends to it
+        self.benchmark_thread = None # Benchmarks the selected output directory
 
         # Assuming recordingThread are passed and stored as attributes
         if recordingThread:
             recordingThread.count_updated.connect(self.updateRecordCount)
             recordingThread.count_updated.connect(self.updateTimerLabel)
-        
+            recordingThread.jitter_updated.connect(self.updateJitter)
+        if writetodiskThread:
+            writetodiskThread.throughput_updated.connect(self.updateThroughput)
+        self.jitterText = ""
+        self.throughputText = ""
+
 
         # Status Bar setup
         self.statusBar = self.statusBar()  # Initialize the status bar
@@ -340,22 +505,27 @@ class MainWindow(QMainWindow):
         self.record = not self.record
         # Make new folder
         if(self.record == True):
-            folder_name = current_time = datetime.now()
-            time_str = current_time.strftime("%m%d%Y_%H%M%S")
-
-            new_folder = writetodiskThread.output_path + "\\" + "recording_" + time_str
-            os.makedirs(new_folder) # DEBUG
-            writetodiskThread.recording_path = new_folder
-            print("\nNew folder at " + new_folder + "\n")
-
-            # Make a new text file 
-            text_file_name = "recording_log_" + time_str + ".txt"
-            text_file_path = writetodiskThread.output_path + "\\" + text_file_name
-            writetodiskThread.text_file_path = text_file_path
-            with open(text_file_path, 'w') as file:
-                file.write('(Frame count, (X coord, Y coord), Elapsed Time) \n')
-            
-            self.reset_counts()
+            if self.resume_journal is not None:
+                # Keep appending to the recording recovered with --resume
+                journal = self.resume_journal
+                self.resume_journal = None
+                print("\nResuming " + journal.recording_path + " at frame " + str(journal.count) + "\n")
+            else:
+                folder_name = current_time = datetime.now()
+                time_str = current_time.strftime("%m%d%Y_%H%M%S")
+
+                new_folder = writetodiskThread.output_path + "\\" + "recording_" + time_str
+                os.makedirs(new_folder) # DEBUG
+                print("\nNew folder at " + new_folder + "\n")
+
+                # Make a new text file 
+                text_file_name = "recording_log_" + time_str + ".txt"
+                text_file_path = writetodiskThread.output_path + "\\" + text_file_name
+                journal = RecordingJournal(new_folder, text_file_path,
+                                           header='(Frame count, (X coord, Y coord), Elapsed Time, Wall Clock Time) \n')
+            writetodiskThread.start_journal(journal)
+
+            self.reset_counts(journal.count)
             self.start_time = time.time()
         # Emit the signal when the record button is clicked
         self.record_signal.emit()
@@ -389,13 +559,30 @@ class MainWindow(QMainWindow):
         self.recordCount = count
         self.updateStatusBar()
 
-    def updateStatusBar(self):
-        self.statusBar.showMessage(f"Record Count: {self.recordCount}")
+    def updateJitter(self, stats):
+        self.jitterText = f"Frame interval: {stats['mean_interval_ms']:.1f} ± {stats['jitter_std_ms']:.1f} ms, Missed: {stats['missed_deadlines']}"
+        self.updateStatusBar()
 
-    def reset_counts(self):
-        self.statusBar.showMessage("Record Count: 0")
-        self.recordingThread.count = 0
-        self.writetodiskThread.count = 0
+    def updateThroughput(self, telemetry):
+        self.throughputText = f"Disk: {telemetry['fps']:.1f} fps, {telemetry['mb_per_s']:.0f} MB/s"
+        if telemetry["predicted_fps"] is not None:
+            self.throughputText += f" (predicted {telemetry['predicted_fps']:.1f} fps, {telemetry['predicted_mb_per_s']:.0f} MB/s)"
+        self.throughputText += f", Queue: {telemetry['queue']}"
+        self.updateStatusBar()
+
+    def updateStatusBar(self):
+        message = f"Record Count: {self.recordCount}"
+        for text in (self.jitterText, self.throughputText):
+            if text:
+                message += "    " + text
+        self.statusBar.showMessage(message)
+
+    def reset_counts(self, start_count=0):
+        self.jitterText = ""
+        self.throughputText = ""
+        self.statusBar.showMessage(f"Record Count: {start_count}")
+        self.recordingThread.count = start_count
+        self.writetodiskThread.count = start_count
 
     def select_output_directory(self):
         dir_path = QFileDialog.getExistingDirectory(self, "Select Output Directory")
@@ -403,6 +590,39 @@ class MainWindow(QMainWindow):
             self.output_directory = dir_path
             self.dir_select_button.setText(f"Output Directory: {self.output_directory}")
             self.writetodiskThread.update_output_path(self.output_directory)
+            self.benchmark_output_directory()
+
+    def benchmark_output_directory(self):
+        # Write real frames to the chosen disk to check it keeps up with target_fps before recording. The
+        # benchmark takes seconds, so it runs in its own thread and the window stays responsive
+        self.statusBar.showMessage("Benchmarking output directory...")
+        self.dir_select_button.setEnabled(False)
+        sample_frame = np.asarray(ImageGrabber.get_image(live_stream_wrap))
+        self.benchmark_thread = DiskBenchmarkThread(self.output_directory, sample_frame, self)
+        self.benchmark_thread.benchmark_done.connect(self.apply_benchmark)
+        self.benchmark_thread.benchmark_failed.connect(self.benchmark_failed)
+        self.benchmark_thread.start()
+
+    def benchmark_failed(self, error):
+        self.dir_select_button.setEnabled(True)
+        self.updateStatusBar()
+        QMessageBox.warning(self, "Disk benchmark failed", f"Could not benchmark {self.output_directory}: {error}")
+
+    def apply_benchmark(self, chosen, results):
+        self.dir_select_button.setEnabled(True)
+        for result in results:
+            print("Disk benchmark, " + describe(result))
+
+        self.writetodiskThread.set_compression(chosen)
+        level = "no compression" if chosen["compression_level"] == 0 else "compression " + str(chosen["compression_level"])
+        self.dir_select_button.setText(f"Output Directory: {self.output_directory}    (max {chosen['fps']:.1f} fps with {level})")
+        self.updateStatusBar()
+
+        if chosen["fps"] < target_fps * default_headroom:
+            QMessageBox.warning(self, "Slow output directory",
+                                f"This directory sustains about {chosen['fps']:.1f} fps at best ({level}), "
+                                f"the recording runs at {target_fps} fps. Frames will pile up in memory, "
+                                "consider a faster disk.")
 
 if __name__ == "__main__":
     app = QApplication([])
@@ -430,6 +650,12 @@ if __name__ == "__main__":
 
     mainWindow = MainWindow(recordingThread, writetodiskThread)
 
+    # python record_raw.py --resume <recording_folder> truncates a crashed recording to its last
+    # consistent frame, and the next press of Record appends to it
+    if len(sys.argv) == 3 and sys.argv[1] == "--resume":
+        mainWindow.resume_journal = recover_recording(sys.argv[2])
+        mainWindow.record_button.setText("Record (resume at frame " + str(mainWindow.resume_journal.count) + ")")
+
     mainWindow.record_signal.connect(recordingThread.toggle_recording)
     mainWindow.record_signal.connect(writetodiskThread.toggle_recording)
 
@@ -437,4 +663,7 @@ if __name__ == "__main__":
     writetodiskThread.start()
 
     mainWindow.show()
-    app.exec_()
\ No newline at end of file
+    app.exec_()
+    if mainWindow.benchmark_thread is not None:
+        mainWindow.benchmark_thread.wait() # Qt aborts if a running thread is destroyed
+    writetodiskThread.close_journal()
\ No newline at end of file
@@ -0,0 +1,229 @@
+"""
+Journaled writing for confocal recordings. Frames and the recording log are flushed to disk
+at regular checkpoints, so a crash of record_raw.py or of the PC costs at most the frames
+written since the last checkpoint, and a recording can be recovered and appended to.
+
+Recover a TIFF recording folder (or an HDF5 video from compression_app.py) from the command line:
+    python recording_journal.py <recording_folder or video.h5>
+"""
+
+import os
+import sys
+import ast
+import json
+import time
+import tifffile
+import h5py
+
+checkpoint_name = "checkpoint.json"
+default_checkpoint_interval = 50 # Frames written between checkpoints
+partial_suffix = ".part" # Frames are written under this suffix and renamed once complete
+
+def frame_file_name(index):
+    return "frame_" + str(index) + ".tif"
+
+def frame_index(file_name):
+    # Returns the frame number of a "frame_N.tif" file name, None for anything else
+    if not (file_name.startswith("frame_") and file_name.endswith(".tif")):
+        return None
+    number = file_name[len("frame_"):-len(".tif")]
+    return int(number) if number.isdigit() else None
+
+def tiff_compression_args(level):
+    # Level 0 writes uncompressed TIFFs, 1-9 are zlib levels like the compression sliders
+    if not level:
+        return {"compression": None}
+    return {"compression": "zlib", "compressionargs": {"level": level}}
+
+def fsync_path(path):
+    with open(path, 'rb+') as file:
+        os.fsync(file.fileno())
+
+def write_json_atomic(path, data):
+    # Write to a temporary file then rename over the old one, the rename is atomic on Windows and POSIX
+    tmp_path = path + partial_suffix
+    with open(tmp_path, 'w') as file:
+        json.dump(data, file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+# ================================
+# TIFF folder recordings
+# ================================
+
+class RecordingJournal():
+    def __init__(self, recording_path, text_file_path, header=None,
+                 checkpoint_interval=default_checkpoint_interval, count=0, resume_point=None, compression_level=0):
+        self.recording_path = recording_path
+        self.text_file_path = text_file_path
+        self.checkpoint_interval = checkpoint_interval
+        self.compression_level = compression_level
+        self.count = count
+        self.resume_point = resume_point # (elapsed, wall clock) of the last recovered frame
+        self.last_elapsed, self.last_wall = resume_point if resume_point is not None else (0.0, None)
+        self.elapsed_offset = 0.0
+        self.unsynced_frames = []
+        self.dirty = True
+
+        # Binary mode so tell() gives a real byte offset for the checkpoint on every platform
+        if header is not None:
+            with open(text_file_path, 'wb') as file:
+                file.write(header.encode())
+        self.text_file = open(text_file_path, 'ab')
+        self.checkpoint()
+
+    def append(self, image, x_pos, y_pos, elapsed_time, wall_time):
+        # Continue the elapsed time of a recovered recording across the gap left by the crash
+        if self.resume_point is not None:
+            last_elapsed, last_wall = self.resume_point
+            self.elapsed_offset = last_elapsed + (wall_time - last_wall) - elapsed_time
+            self.resume_point = None
+        elapsed_time = elapsed_time + self.elapsed_offset
+
+        # Frame first, then its log line: a log entry always refers to a complete TIFF
+        full_path = os.path.join(self.recording_path, frame_file_name(self.count))
+        tifffile.imwrite(full_path + partial_suffix, image, **tiff_compression_args(self.compression_level))
+        os.replace(full_path + partial_suffix, full_path)
+
+        data = (self.count, (x_pos, y_pos), round(elapsed_time, 6), round(wall_time, 6))
+        self.text_file.write((str(data) + '\n').encode())
+
+        self.unsynced_frames.append(full_path)
+        self.last_elapsed = elapsed_time
+        self.last_wall = wall_time
+        self.count += 1
+        self.dirty = True
+        if self.count % self.checkpoint_interval == 0:
+            self.checkpoint()
+
+    def checkpoint(self):
+        # Make everything written so far durable, then record it as the new consistent state
+        if not self.dirty:
+            return
+        self.text_file.flush()
+        os.fsync(self.text_file.fileno())
+        for path in self.unsynced_frames:
+            fsync_path(path)
+        self.unsynced_frames = []
+
+        write_json_atomic(os.path.join(self.recording_path, checkpoint_name), {
+            "frames": self.count,
+            "log_file": os.path.basename(self.text_file_path),
+            "log_bytes": self.text_file.tell(),
+            "elapsed": self.last_elapsed,
+            "wall": self.last_wall,
+            "time": time.time(),
+        })
+        self.dirty = False
+
+    def close(self):
+        if self.text_file.closed:
+            return
+        self.checkpoint()
+        self.text_file.close()
+
+def recover_recording(recording_path, checkpoint_interval=default_checkpoint_interval):
+    """
+    Truncates a crashed recording to its last consistent frame and reopens it for appending.
+    Frames written after the checkpoint are kept when both the TIFF and its log line are complete.
+    """
+
+    with open(os.path.join(recording_path, checkpoint_name), 'r') as file:
+        checkpoint = json.load(file)
+    text_file_path = os.path.join(os.path.dirname(os.path.abspath(recording_path)), checkpoint["log_file"])
+
+    frames = checkpoint["frames"]
+    consistent_bytes = checkpoint["log_bytes"]
+    last_elapsed = checkpoint["elapsed"]
+    last_wall = checkpoint["wall"]
+
+    with open(text_file_path, 'rb') as file:
+        file.seek(consistent_bytes)
+        tail = file.read()
+
+    # The last piece after split is either empty or a partially written line
+    for line in tail.split(b'\n')[:-1]:
+        try:
+            entry = ast.literal_eval(line.decode())
+            if entry[0] != frames:
+                break
+            tifffile.imread(os.path.join(recording_path, frame_file_name(frames)))
+        except Exception:
+            break
+        consistent_bytes += len(line) + 1
+        frames += 1
+        last_elapsed = entry[2]
+        last_wall = entry[3]
+
+    with open(text_file_path, 'rb+') as file:
+        file.truncate(consistent_bytes)
+
+    # Remove frames past the consistent point and any half written files
+    removed = 0
+    for file_name in os.listdir(recording_path):
+        index = frame_index(file_name)
+        if file_name.endswith(partial_suffix) or (index is not None and index >= frames):
+            os.remove(os.path.join(recording_path, file_name))
+            removed += 1
+    print("Recovered " + str(frames) + " frames in " + recording_path + ", removed " + str(removed) + " incomplete file(s)")
+
+    resume_point = (last_elapsed, last_wall) if last_wall is not None else None
+    return RecordingJournal(recording_path, text_file_path, checkpoint_interval=checkpoint_interval,
+                            count=frames, resume_point=resume_point)
+
+# ================================
+# HDF5 videos
+# ================================
+
+def checkpoint_video_hdf5(hdf5_file, video_dataset, frames_written):
+    # Mark how many frames are complete and push data and metadata out to the file
+    video_dataset.attrs["frames_written"] = frames_written
+    hdf5_file.flush()
+
+def recover_video_hdf5(hdf5_file_path, dataset_name="video_frames"):
+    """
+    Truncates an interrupted HDF5 video to its last checkpointed frame and returns the frame count
+    to resume from. Only videos carrying the "frames_written" checkpoint are changed. Any other file,
+    e.g. a complete video from an older converter or one without the dataset, raises ValueError and
+    is left as it is. A file that cannot be opened raises OSError, it is never removed here.
+    """
+
+    if not os.path.exists(hdf5_file_path):
+        return 0
+    with h5py.File(hdf5_file_path, 'r') as hdf5_file:
+        video_dataset = hdf5_file.get(dataset_name)
+        if not isinstance(video_dataset, h5py.Dataset) or "frames_written" not in video_dataset.attrs:
+            raise ValueError(hdf5_file_path + " has no checkpointed '" + dataset_name + "' dataset, it was not written by a journaled conversion")
+    with h5py.File(hdf5_file_path, 'a') as hdf5_file:
+        video_dataset = hdf5_file[dataset_name]
+        frames = int(video_dataset.attrs["frames_written"])
+        if video_dataset.shape[0] > frames:
+            video_dataset.resize(frames, axis=0)
+    print("Recovered " + str(frames) + " frames in " + hdf5_file_path)
+    return frames
+
+def set_aside(path):
+    # Renames a file that cannot be resumed to the first free "<path>.corrupt[N]" and returns the new path
+    corrupt_path = path + ".corrupt"
+    number = 1
+    while os.path.exists(corrupt_path):
+        number += 1
+        corrupt_path = path + ".corrupt" + str(number)
+    os.rename(path, corrupt_path)
+    return corrupt_path
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("Usage: python recording_journal.py <recording_folder or video.h5>")
+        sys.exit(1)
+
+    path = sys.argv[1]
+    if os.path.isdir(path):
+        recover_recording(path).close()
+    else:
+        try:
+            recover_video_hdf5(path)
+        except (OSError, ValueError) as e:
+            print("Could not recover " + path + ": " + str(e) + ", it was left as it is")
+            sys.exit(1)
@@ -0,0 +1,287 @@
+"""
+Lazy random access to confocal recordings, for analysis notebooks and for replaying sessions.
+Opens a TIFF folder written by record_raw.py or an HDF5 video written by compression_app.py,
+batch_cli.py or hdf5_splitter.py, without loading it:
+
+    with Recording("recording_05062024_101500") as recording:
+        frame = recording[100]              # One frame
+        roi = recording[:, 400:464, 900:964] # ROI over time
+        x, y = recording.positions[100]      # Stage position logged with frame 100
+
+Frames are read a chunk at a time (one TIFF, or one HDF5 chunk) through an LRU cache with a memory
+limit, and uncompressed TIFFs and contiguous HDF5 datasets are memory-mapped instead of read.
+"""
+
+import os
+import ast
+import json
+import math
+import itertools
+from collections import OrderedDict
+import numpy as np
+import tifffile
+import h5py
+from recording_journal import checkpoint_name, frame_file_name, frame_index
+
+default_cache_bytes = 512 * 1024 ** 2
+
+# ================================
+# Chunk cache
+# ================================
+
+class ChunkCache():
+    # Least recently used chunks are dropped once the cached arrays exceed max_bytes
+    def __init__(self, max_bytes=default_cache_bytes):
+        self.max_bytes = max_bytes
+        self.chunks = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, load):
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            self.hits += 1
+            return chunk
+        self.misses += 1
+        chunk = load()
+        self.chunks[key] = chunk
+        self.nbytes += chunk.nbytes
+        while self.nbytes > self.max_bytes and len(self.chunks) > 1:
+            _, dropped = self.chunks.popitem(last=False)
+            self.nbytes -= dropped.nbytes
+        return chunk
+
+    def clear(self):
+        self.chunks.clear()
+        self.nbytes = 0
+
+# ================================
+# Storage backends, each exposes shape, dtype, chunks and load_chunk(chunk coordinates)
+# ================================
+
+class TiffFolderSource():
+    def __init__(self, folder):
+        indices = sorted(index for index in map(frame_index, os.listdir(folder)) if index is not None)
+        if not indices:
+            raise ValueError("No frame_N.tif files in " + folder)
+        if indices != list(range(len(indices))):
+            raise ValueError("Frames in " + folder + " are not numbered 0 to " + str(len(indices) - 1) +
+                             ", recover the recording with recording_journal.py first")
+        self.folder = folder
+        first = self.open_frame(0)
+        self.shape = (len(indices),) + first.shape
+        self.dtype = first.dtype
+        self.chunks = (1,) + first.shape
+
+    def open_frame(self, index):
+        # Uncompressed TIFFs (what record_raw.py writes by default) are mapped, not read
+        path = os.path.join(self.folder, frame_file_name(index))
+        try:
+            return tifffile.memmap(path, mode='r')
+        except ValueError:
+            return tifffile.imread(path)
+
+    def load_chunk(self, chunk):
+        return self.open_frame(chunk[0])[np.newaxis]
+
+    def close(self):
+        pass
+
+class Hdf5Source():
+    def __init__(self, path, dataset_name):
+        # HDF5's own chunk cache is turned off, the reader's cache replaces it
+        self.file = h5py.File(path, 'r', rdcc_nbytes=0)
+        self.dataset = self.file[dataset_name]
+        self.shape = self.dataset.shape
+        self.dtype = self.dataset.dtype
+        self.memmap = None
+        if self.dataset.chunks is None and self.dataset.compression is None and self.dataset.id.get_offset() is not None:
+            self.memmap = np.memmap(path, mode='r', dtype=self.dtype, shape=self.shape, offset=self.dataset.id.get_offset())
+        self.chunks = self.dataset.chunks or (1,) + self.shape[1:]
+
+    def load_chunk(self, chunk):
+        selection = tuple(slice(c * size, min((c + 1) * size, n)) for c, size, n in zip(chunk, self.chunks, self.shape))
+        if self.memmap is not None:
+            return self.memmap[selection]
+        return self.dataset[selection]
+
+    def close(self):
+        self.file.close()
+
+# ================================
+# Reader
+# ================================
+
+def find_log(folder):
+    # record_raw.py puts recording_log_<time>.txt next to recording_<time>, the checkpoint names it too
+    checkpoint_path = os.path.join(folder, checkpoint_name)
+    parent = os.path.dirname(os.path.abspath(folder))
+    if os.path.exists(checkpoint_path):
+        with open(checkpoint_path, 'r') as file:
+            return os.path.join(parent, json.load(file)["log_file"])
+    name = os.path.basename(os.path.normpath(folder))
+    if name.startswith("recording_"):
+        log_path = os.path.join(parent, "recording_log_" + name[len("recording_"):] + ".txt")
+        if os.path.exists(log_path):
+            return log_path
+    return None
+
+def read_log(log_path):
+    """
+    Parses a recording log into arrays indexed by frame number: positions (N, 2), elapsed (N,) and
+    wall clock (N,) times. Older logs without wall clock times give NaN for them.
+    """
+
+    entries = {}
+    with open(log_path, 'r') as file:
+        next(file) # Header
+        for line in file:
+            if not line.strip():
+                continue
+            entry = ast.literal_eval(line)
+            entries[entry[0]] = entry
+    num_frames = max(entries) + 1 if entries else 0
+    positions = np.full((num_frames, 2), np.nan)
+    elapsed = np.full(num_frames, np.nan)
+    wall = np.full(num_frames, np.nan)
+    for index, entry in entries.items():
+        positions[index] = entry[1]
+        elapsed[index] = entry[2]
+        if len(entry) > 3:
+            wall[index] = entry[3]
+    return positions, elapsed, wall
+
+def normalize_axis(key, size):
+    # Turns an index for one axis into (indices to read, True if the axis is dropped from the result)
+    if isinstance(key, (int, np.integer)):
+        if not -size <= key < size:
+            raise IndexError("index " + str(key) + " is out of bounds for axis with size " + str(size))
+        return np.array([key % size]), True
+    if isinstance(key, slice):
+        return np.arange(size)[key], False
+    return np.arange(size)[np.asarray(key)], False
+
+class Recording():
+    def __init__(self, path, cache_bytes=default_cache_bytes, dataset_name="video_frames", log_path=None):
+        """
+        Opens a recording lazily.
+
+        Parameters
+        ----------
+        path: str
+            A TIFF recording folder or an HDF5 video file.
+        cache_bytes: int
+            Memory limit of the chunk cache.
+        dataset_name: str
+            Dataset holding the frames in an HDF5 file.
+        log_path: str
+            Recording log with the stage positions. Found automatically for TIFF folders.
+        """
+
+        self.path = path
+        if os.path.isdir(path):
+            self.source = TiffFolderSource(path)
+            self.format = "tiff"
+            if log_path is None:
+                log_path = find_log(path)
+        else:
+            self.source = Hdf5Source(path, dataset_name)
+            self.format = "hdf5"
+        self.cache = ChunkCache(cache_bytes)
+
+        self.log_path = log_path
+        self.positions = self.elapsed = self.wall = None
+        if log_path is not None:
+            self.positions, self.elapsed, self.wall = read_log(log_path)
+
+    @property
+    def shape(self):
+        return self.source.shape
+
+    @property
+    def dtype(self):
+        return self.source.dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def nbytes(self):
+        return math.prod(self.shape) * self.dtype.itemsize
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.cache.clear()
+        self.source.close()
+
+    def __getitem__(self, key):
+        """
+        NumPy style indexing: integers, slices (with steps) and integer arrays on any axis. Arrays on
+        more than one axis are applied to each axis separately (outer indexing) rather than broadcast.
+        """
+
+        if not isinstance(key, tuple):
+            key = (key,)
+        if any(k is Ellipsis for k in key):
+            position = key.index(Ellipsis)
+            key = key[:position] + (slice(None),) * (self.ndim - len(key) + 1) + key[position + 1:]
+        if len(key) > self.ndim:
+            raise IndexError("too many indices for recording with " + str(self.ndim) + " dimensions")
+        key = key + (slice(None),) * (self.ndim - len(key))
+
+        axes = [normalize_axis(k, n) for k, n in zip(key, self.shape)]
+        result = self.read([indices for indices, _ in axes])
+        dropped = tuple(axis for axis, (_, drop) in enumerate(axes) if drop)
+        return result.reshape([n for axis, n in enumerate(result.shape) if axis not in dropped])
+
+    def read(self, indices):
+        # Gathers the cartesian product of the per-axis indices from every chunk they touch
+        chunks = self.source.chunks
+        result = np.empty([len(i) for i in indices], dtype=self.dtype)
+        if result.size == 0:
+            return result
+
+        # For every axis, the chunk numbers touched and which result positions come from each of them
+        per_axis = []
+        for axis_indices, size in zip(indices, chunks):
+            chunk_numbers = axis_indices // size
+            per_axis.append([(c, np.nonzero(chunk_numbers == c)[0]) for c in np.unique(chunk_numbers)])
+
+        for parts in itertools.product(*per_axis):
+            chunk = tuple(c for c, _ in parts)
+            data = self.cache.get(chunk, lambda: self.source.load_chunk(chunk))
+            local = tuple(indices[axis][positions] - c * chunks[axis] for axis, (c, positions) in enumerate(parts))
+            result[np.ix_(*[positions for _, positions in parts])] = data[np.ix_(*local)]
+        return result
+
+    def frame(self, index):
+        return self[index]
+
+    def stage_position(self, index):
+        if self.positions is None:
+            raise ValueError("No recording log found for " + self.path)
+        return tuple(self.positions[index])
+
+    def frames_with_positions(self, start=0, stop=None):
+        # Yields (frame, x, y, elapsed time) in frame order, joined with the recording log
+        if self.positions is None:
+            raise ValueError("No recording log found for " + self.path)
+        stop = len(self) if stop is None else min(stop, len(self))
+        for index in range(start, min(stop, len(self.positions))):
+            x_pos, y_pos = self.positions[index]
+            yield self[index], x_pos, y_pos, self.elapsed[index]
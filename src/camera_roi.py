@@ -0,0 +1,350 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Camera region of interest that follows the tracked specimen. The camera reads out only a square
+# around the tracked panel instead of both panels, which raises its frame rate and cuts the traffic
+# over the bridge. When the specimen outruns the stage, the crop segmented by the computer vision
+# follows it inside the readout, and the readout grows when the crop no longer fits. Once the
+# specimen is back in the centre for a while, the readout shrinks again.
+#
+# Positions are in sensor pixels unless said otherwise. A frame is the readout of one ROI, so a
+# sensor position (x, y) is at frame[y - roi_y, x - roi_x]. Tracking pixels are those of the 512x512
+# image the segmentation works on, made from a CROP_SIZE square crop.
+
+from imports_and_constants import *
+from metrics import metrics
+
+PANEL_WIDTH = 1024 # Width of each panel of the split view, left panel first
+FULL_ROI = (0, 512, 2048, 1024) # (x, y, width, height) with both panels, set at startup
+CROP_SIZE = 770 # Side of the square segmented by the computer vision
+TRACK_SIZE = 512 # Side of the image the segmentation works on
+ROI_LEVELS = ((898, 898), (1024, 1024)) # Readout sizes around the tracked panel, smallest first, FULL_ROI after the last
+
+def panel_center(track_right: bool) -> tuple:
+    # Sensor position of the optical centre of a panel, where the stage keeps the specimen
+    return (PANEL_WIDTH if track_right else 0) + PANEL_WIDTH // 2, FULL_ROI[1] + FULL_ROI[3] // 2
+
+def crop_square(frame: np.ndarray, roi: tuple, center: tuple, binning: int = 1) -> np.ndarray:
+    """
+    Crops the CROP_SIZE square around a sensor position out of a frame.
+
+    Parameters
+    ----------
+    frame: np.ndarray
+        Readout of roi.
+    roi: tuple
+        (x, y, width, height) of the readout on the sensor.
+    center: tuple
+        (x, y) sensor position of the centre of the crop, the crop must fit inside roi.
+    binning: int
+        Sensor pixels per frame pixel in each direction, for a binned readout.
+
+    Returns
+    -------
+    np.ndarray
+        CROP_SIZE x CROP_SIZE view of the frame, CROP_SIZE // binning for a binned one.
+    """
+
+    x_start = (center[0] - CROP_SIZE // 2 - roi[0]) // binning
+    y_start = (center[1] - CROP_SIZE // 2 - roi[1]) // binning
+    size = CROP_SIZE // binning
+    return frame[y_start:y_start + size, x_start:x_start + size]
+
+# ReadoutFrame is an image that knows the readout it was read with, views and arithmetic keep the tag
+class ReadoutFrame(np.ndarray):
+
+    def __new__(cls, frame: np.ndarray, roi: tuple):
+        tagged = np.asarray(frame).view(cls)
+        tagged.roi = roi # (x, y, width, height) on the sensor, None if the readout changed while it was grabbed
+        return tagged
+
+    def __array_finalize__(self, obj):
+        self.roi = getattr(obj, "roi", None)
+
+# RoiManager is an object that chooses the camera readout and the crop segmented inside it
+class RoiManager():
+
+    def __init__(self, core_wrap, live_stream_wrap = None, adaptive: bool = False, levels: tuple = ROI_LEVELS,
+                 start_level: int = 0, grow_at: float = 0.7, shrink_at: float = 0.3, shrink_after: int = 30,
+                 min_interval: float = 1.0):
+        """
+        Initializes the manager. Without adaptive, the readout stays FULL_ROI and the crop at the
+        centre of the tracked panel, as the camera was set up at startup.
+
+        Parameters
+        ----------
+        core_wrap: CoreWrapper
+            Takes an instance of the wrapper of the Core object in Micromanager.
+        live_stream_wrap: LiveStreamWrapper
+            Live stream paused while the ROI changes, None if there is none to pause.
+        adaptive: bool
+            True to narrow the readout and let the crop follow the specimen.
+        levels: tuple
+            (width, height) readout sizes around the tracked panel, smallest first, each at least CROP_SIZE.
+        start_level: int
+            Index of the level to start at, len(levels) for FULL_ROI.
+        grow_at: float
+            Share of the crop's half size the specimen may stray from the crop centre before the crop follows it.
+        shrink_at: float
+            Share of the crop's half size within which the specimen counts as centred.
+        shrink_after: int
+            Consecutive centred targets before the readout shrinks one level.
+        min_interval: float
+            Shortest time between two ROI changes, in seconds, each one restarts the live stream.
+
+        Returns
+        -------
+        None
+        """
+
+        self.core_wrap = core_wrap
+        self.live_stream_wrap = live_stream_wrap
+        self.adaptive = adaptive
+        self.levels = levels
+        self.grow_at = grow_at
+        self.shrink_at = shrink_at
+        self.shrink_after = shrink_after
+        self.min_interval = min_interval
+        self.track_right = True
+        self.both_panels = False # Dual channel processing needs both panels read out
+        self.start_level = min(start_level, len(levels))
+        self.level = len(levels)
+        self.roi = FULL_ROI # Set up at startup
+        self.previous_roi = FULL_ROI # Frames read out before the last change may still be on their way
+        self.crop_center = panel_center(self.track_right)
+        self.centred_targets = 0
+        self.last_change = None
+        self.generation = 0 # Odd while the readout changes, so a grab spanning a change can be told apart
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        if adaptive:
+            self.apply(self.start_level)
+
+    def roi_for(self, level: int) -> tuple:
+        """
+        Readout of a level around the tracked panel's centre, kept inside FULL_ROI.
+
+        Parameters
+        ----------
+        level: int
+            Index into levels, len(levels) for FULL_ROI.
+
+        Returns
+        -------
+        tuple
+            (x, y, width, height) on the sensor.
+        """
+
+        if level >= len(self.levels):
+            return FULL_ROI
+        width, height = self.levels[level]
+        center_x, center_y = panel_center(self.track_right)
+        x_start = min(max(center_x - width // 2, FULL_ROI[0]), FULL_ROI[0] + FULL_ROI[2] - width)
+        y_start = min(max(center_y - height // 2, FULL_ROI[1]), FULL_ROI[1] + FULL_ROI[3] - height)
+        return x_start, y_start, width, height
+
+    def fits(self, center: tuple, roi: tuple) -> bool:
+        # True if the crop around center lies inside roi
+        half = CROP_SIZE // 2
+        return (roi[0] <= center[0] - half and center[0] - half + CROP_SIZE <= roi[0] + roi[2] and
+                roi[1] <= center[1] - half and center[1] - half + CROP_SIZE <= roi[1] + roi[3])
+
+    def clamp(self, center: tuple, roi: tuple) -> tuple:
+        # Nearest crop centre whose crop lies inside roi
+        half = CROP_SIZE // 2
+        return (min(max(center[0], roi[0] + half), roi[0] + roi[2] - CROP_SIZE + half),
+                min(max(center[1], roi[1] + half), roi[1] + roi[3] - CROP_SIZE + half))
+
+    def apply(self, level: int, now: float = None):
+        """
+        Switches the camera to the readout of a level, the crop is moved inside it.
+
+        Parameters
+        ----------
+        level: int
+            Index into levels, len(levels) for FULL_ROI.
+        now: float
+            Current time from time.perf_counter(), defaults to now.
+
+        Returns
+        -------
+        None
+        """
+
+        roi = self.roi_for(level)
+        if roi != self.roi:
+            self.generation += 1
+            if self.live_stream_wrap is not None:
+                self.live_stream_wrap.set_live_mode_on(False)
+            self.core_wrap.set_roi(*roi)
+            if self.live_stream_wrap is not None:
+                self.live_stream_wrap.set_live_mode_on(True)
+            self.metrics.count("roi_changes")
+            self.previous_roi, self.roi = self.roi, roi
+            self.last_change = time.perf_counter() if now is None else now
+            self.generation += 1
+        self.level = level
+        self.crop_center = self.clamp(self.crop_center, roi)
+        self.metrics.set_gauge("readout_share", roi[2] * roi[3] / (FULL_ROI[2] * FULL_ROI[3]))
+
+    def set_track_right(self, track_right: bool):
+        with self.lock:
+            self.track_right = track_right
+            self.crop_center = panel_center(track_right)
+            self.centred_targets = 0
+            if self.adaptive:
+                self.apply(self.level)
+                # Frames still on their way from the other panel's readout must not be cropped here
+                self.previous_roi = self.roi
+
+    def readout(self) -> tuple:
+        # (generation, roi) to take before grabbing a frame and pass to read_with after it
+        generation = self.generation
+        return generation, self.roi
+
+    def read_with(self, start: tuple) -> tuple:
+        """
+        Readout a frame was read with, from the readout taken before it was grabbed.
+
+        Parameters
+        ----------
+        start: tuple
+            readout() from before the grab.
+
+        Returns
+        -------
+        tuple
+            (x, y, width, height) of the readout, None if it changed while the frame was grabbed.
+        """
+
+        if start[0] % 2 == 1 or self.generation != start[0]:
+            return None
+        return start[1]
+
+    def set_both_panels(self, both_panels: bool):
+        # Reads out both panels, and holds the readout there, while both are segmented
+        with self.lock:
+            self.both_panels = both_panels
+            self.centred_targets = 0
+            if self.adaptive:
+                self.apply(len(self.levels) if both_panels else self.start_level)
+
+    def placement(self, frame: np.ndarray, binning: int = 1) -> tuple:
+        """
+        Where a frame was read out and where its crop is.
+
+        Parameters
+        ----------
+        frame: np.ndarray
+            Frame from the frame grabber.
+        binning: int
+            Sensor pixels per frame pixel in each direction, for a binned frame.
+
+        Returns
+        -------
+        tuple
+            (roi, crop centre) for the frame, None if it was read with neither the current readout
+            nor the one before, e.g. a frame from before a quick succession of changes. A ReadoutFrame
+            is matched by the readout it is tagged with, any other frame by its shape.
+        """
+
+        with self.lock:
+            if isinstance(frame, ReadoutFrame):
+                roi = frame.roi
+                if roi in (self.roi, self.previous_roi) and frame.shape[:2] == (roi[3] // binning, roi[2] // binning):
+                    return roi, self.clamp(self.crop_center, roi)
+                return None
+            for roi in (self.roi, self.previous_roi):
+                if frame.shape[:2] == (roi[3] // binning, roi[2] // binning):
+                    return roi, self.clamp(self.crop_center, roi)
+            return None
+
+    def crop(self, frame: np.ndarray, binning: int = 1) -> tuple:
+        """
+        Crops the square segmented by the computer vision out of a frame.
+
+        Parameters
+        ----------
+        frame: np.ndarray
+            Frame from the frame grabber.
+        binning: int
+            Sensor pixels per frame pixel in each direction, for a binned frame.
+
+        Returns
+        -------
+        tuple
+            (crop, crop centre) with the crop centre in sensor pixels, (None, None) if the frame
+            does not match the readout.
+        """
+
+        placement = self.placement(frame, binning)
+        if placement is None:
+            self.metrics.count("roi_mismatched_frames")
+            return None, None
+        roi, center = placement
+        return np.asarray(crop_square(frame, roi, center, binning)), center
+
+    def tracking_offset(self, crop_center: tuple) -> tuple:
+        # Offset of a crop's centre from the panel's optical centre, in tracking pixels, to add to
+        # positions in the crop before converting them to stage coordinates
+        center_x, center_y = panel_center(self.track_right)
+        return ((crop_center[0] - center_x) * TRACK_SIZE / CROP_SIZE,
+                (crop_center[1] - center_y) * TRACK_SIZE / CROP_SIZE)
+
+    def observe(self, head_coordinates: tuple, crop_center: tuple, now: float = None):
+        """
+        Moves the crop and resizes the readout after a target was found.
+
+        Parameters
+        ----------
+        head_coordinates: tuple
+            (x, y) of the target in tracking pixels of the crop.
+        crop_center: tuple
+            Sensor position of the centre of the crop the target was found in.
+        now: float
+            Current time from time.perf_counter(), defaults to now.
+
+        Returns
+        -------
+        None
+        """
+
+        if not self.adaptive:
+            return
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            scale = CROP_SIZE / TRACK_SIZE
+            target = (crop_center[0] + (head_coordinates[0] - TRACK_SIZE / 2) * scale,
+                      crop_center[1] + (head_coordinates[1] - TRACK_SIZE / 2) * scale)
+            target = (int(round(target[0])), int(round(target[1])))
+            center = panel_center(self.track_right)
+            can_change = not self.both_panels and (self.last_change is None or now - self.last_change >= self.min_interval)
+
+            if max(abs(target[0] - self.crop_center[0]), abs(target[1] - self.crop_center[1])) > self.grow_at * CROP_SIZE / 2:
+                # The specimen is near the edge of the crop, centre the crop on it and read out more if it does not fit
+                self.centred_targets = 0
+                self.crop_center = target
+                if not self.fits(target, self.roi) and self.level < len(self.levels) and can_change:
+                    self.apply(self.level + 1, now)
+                self.crop_center = self.clamp(target, self.roi)
+
+            elif max(abs(target[0] - center[0]), abs(target[1] - center[1])) < self.shrink_at * CROP_SIZE / 2:
+                # Back in the centre, the crop returns there and the readout shrinks after a while
+                self.crop_center = center
+                self.centred_targets += 1
+                if self.centred_targets >= self.shrink_after and self.level > 0 and can_change:
+                    self.centred_targets = 0
+                    self.apply(self.level - 1, now)
+            else:
+                self.centred_targets = 0
@@ -0,0 +1,145 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Live performance dashboard for the MainWindow. It samples the metrics registry while it is shown
+# and draws the recent history of every metric as a small sparkline, so a degrading pipeline
+# (falling capture rate, growing latency, dropped frames) is visible during a run.
+
+from imports_and_constants import *
+from PyQt5.QtWidgets import QLabel, QGridLayout, QWidget
+from PyQt5.QtCore import Qt, QTimer, QPointF
+from PyQt5.QtGui import QPainter, QPen, QColor, QPolygonF, QFont
+from metrics import MetricsRegistry, metrics
+
+# (title, metric name, unit, scale) of every row, counters are shown as rates
+DASHBOARD_METRICS = (
+    ("Capture", "frames_captured", "fps", 1),
+    ("Capture time", "capture_time", "ms", 1000),
+    ("CV latency", "cv_latency", "ms", 1000),
+    ("CV dropped frames", "cv_frames_dropped", "/s", 1),
+    ("CV skipped frames", "cv_frames_skipped", "/s", 1),
+    ("CV queue", "cv_queue", "", 1),
+    ("Tracker loop", "tracker_steps", "Hz", 1),
+    ("Stage commands", "stage_commands", "Hz", 1),
+    ("Display", "display_refreshes", "fps", 1),
+    ("Display dropped frames", "display_frames_dropped", "/s", 1),
+    ("Display queue", "display_queue", "", 1),
+)
+
+# ---- Widgets ----#
+
+# Sparkline is a small line plot of recent values, scaled between zero and the largest value shown
+class Sparkline(QWidget):
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.values = []
+        self.setMinimumSize(120, 24)
+
+    def set_values(self, values: list):
+        self.values = [value for value in values if value is not None]
+        self.update()
+
+    def paintEvent(self, event):
+        if len(self.values) < 2:
+            return
+        painter = QPainter(self)
+        painter.setRenderHint(QPainter.Antialiasing)
+        painter.setPen(QPen(QColor("#2b7bb9"), 1.5))
+
+        width, height = self.width() - 2, self.height() - 2
+        top = max(max(self.values), 1e-9)
+        step = width / (len(self.values) - 1)
+        points = [QPointF(1 + i * step, 1 + height * (1 - value / top)) for i, value in enumerate(self.values)]
+        painter.drawPolyline(QPolygonF(points))
+        painter.end()
+
+# MetricsDashboard is an object that shows the rolling pipeline metrics, sampled only while it is visible
+class MetricsDashboard(QWidget):
+
+    def __init__(self, registry: MetricsRegistry = None, interval: int = 500, parent=None):
+        """
+        Initializes the dashboard.
+
+        Parameters
+        ----------
+        registry: MetricsRegistry
+            Registry to sample, defaults to the one shared by the pipeline.
+        interval: int
+            Time between samples in milliseconds.
+        parent: QWidget
+            Parent widget.
+
+        Returns
+        -------
+        None
+        """
+
+        super().__init__(parent)
+        self.registry = metrics if registry is None else registry
+        self.value_labels = {}
+        self.sparklines = {}
+
+        layout = QGridLayout()
+        title = QLabel("PIPELINE")
+        title.setFont(QFont("Arial", 16))
+        layout.addWidget(title, 0, 0, 1, 3, alignment=Qt.AlignHCenter)
+        for row, (name, metric, unit, scale) in enumerate(DASHBOARD_METRICS, start=1):
+            self.value_labels[metric] = QLabel("-")
+            self.sparklines[metric] = Sparkline()
+            layout.addWidget(QLabel(name), row, 0)
+            layout.addWidget(self.value_labels[metric], row, 1)
+            layout.addWidget(self.sparklines[metric], row, 2)
+        layout.setRowStretch(len(DASHBOARD_METRICS) + 1, 1)
+        self.setLayout(layout)
+
+        self.timer = QTimer(self)
+        self.timer.setInterval(interval)
+        self.timer.timeout.connect(self.refresh)
+
+    @staticmethod
+    def format_value(value, unit: str, scale: float) -> str:
+        if value is None:
+            return "-"
+        return f"{value * scale:.1f} {unit}".strip()
+
+    def refresh(self):
+        """
+        Samples the registry and updates every row.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        values = self.registry.sample()
+        for name, metric, unit, scale in DASHBOARD_METRICS:
+            text = MetricsDashboard.format_value(values.get(metric), unit, scale)
+            if metric.endswith("_dropped"):
+                text += " (" + str(self.registry.total(metric)) + " total)"
+            self.value_labels[metric].setText(text)
+            self.sparklines[metric].set_values(self.registry.history(metric))
+
+    def showEvent(self, event):
+        self.registry.sample() # Rates start from when the dashboard opens
+        self.timer.start()
+        super().showEvent(event)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
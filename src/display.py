@@ -0,0 +1,386 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Display preparation off the GUI thread. Frames and computer vision results are turned into the
+# 8 bit preview panels in persistent buffers, each wrapped once by QImages that share its memory,
+# so the GUI thread only converts the latest prepared panels to pixmaps. Panels are prepared at most
+# max_fps times a second, frames arriving in between are dropped from the display only, the
+# tracking pipeline receives every frame.
+
+from imports_and_constants import *
+from PyQt5 import sip
+from PyQt5.QtCore import pyqtSignal
+from PyQt5.QtGui import QImage
+from tracking_engine import EngineWorker, FrameSegmenter
+from camera_roi import RoiManager, FULL_ROI, crop_square
+from threads import WorkerThread
+from collections import deque
+
+DISPLAY_MAX_FPS = 25 # Cap on GUI refreshes per second
+
+# ---- Buffers ----#
+
+# Holds only the most recent item, older ones are handed back to be recycled
+class LatestMailbox():
+
+    def __init__(self):
+        self.item = None
+        self.lock = threading.Lock()
+
+    def put(self, item):
+        """
+        Replaces the item in the mailbox.
+
+        Parameters
+        ----------
+        item: object
+            New item.
+
+        Returns
+        -------
+        object
+            The item it replaced, None if the mailbox was empty.
+        """
+
+        with self.lock:
+            replaced = self.item
+            self.item = item
+            return replaced
+
+    def take(self):
+        with self.lock:
+            item = self.item
+            self.item = None
+            return item
+
+# Counts events over the last few seconds to report their rate
+class RateMeter():
+
+    def __init__(self, window: float = 2.0):
+        self.window = window
+        self.times = deque()
+        self.lock = threading.Lock()
+
+    def tick(self, now: float = None):
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            self.times.append(now)
+            while self.times and now - self.times[0] > self.window:
+                self.times.popleft()
+
+    def rate(self, now: float = None) -> float:
+        """
+        Events per second over the window.
+
+        Parameters
+        ----------
+        now: float
+            Current time from time.perf_counter(), defaults to now.
+
+        Returns
+        -------
+        float
+            Rate in Hz, 0 with fewer than two events.
+        """
+
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            while self.times and now - self.times[0] > self.window:
+                self.times.popleft()
+            if len(self.times) < 2:
+                return 0.0
+            return (len(self.times) - 1) / max(now - self.times[0], 1e-9)
+
+# Persistent 8 bit image, with QImages built on its memory once and reused for every frame
+class DisplayBuffer():
+
+    def __init__(self):
+        self.array = None
+        self.images = {}
+
+    def ensure(self, shape: tuple) -> np.ndarray:
+        """
+        Returns the buffer, reallocating it only if the image size changed.
+
+        Parameters
+        ----------
+        shape: tuple
+            (height, width) of the image.
+
+        Returns
+        -------
+        np.ndarray
+            2D uint8 buffer.
+        """
+
+        if self.array is None or self.array.shape != tuple(shape):
+            self.array = np.zeros(shape, dtype=np.uint8)
+            self.images = {}
+        return self.array
+
+    def image(self, x_start: int = 0, width: int = None) -> QImage:
+        """
+        QImage showing columns x_start to x_start + width of the buffer without copying it.
+
+        Parameters
+        ----------
+        x_start: int
+            First column.
+        width: int
+            Number of columns, defaults to the rest of the buffer.
+
+        Returns
+        -------
+        QImage
+            Grayscale image sharing the buffer's memory.
+        """
+
+        height, buffer_width = self.array.shape
+        width = buffer_width - x_start if width is None else width
+        key = (x_start, width)
+        if key not in self.images:
+            pointer = sip.voidptr(self.array.ctypes.data + x_start)
+            self.images[key] = QImage(pointer, width, height, self.array.strides[0], QImage.Format_Grayscale8)
+        return self.images[key]
+
+# One set of preview panels: left and right panels, zoomed crop, segmentation and tracking point
+class DisplayFrame():
+
+    def __init__(self):
+        self.overview = DisplayBuffer() # Left and right panels side by side, downsampled in one pass
+        self.zoomed = DisplayBuffer()
+        self.segmented = DisplayBuffer()
+        self.track_image = DisplayBuffer()
+        self.versions = {"overview": None, "zoomed": None, "segmented": None, "track_image": None}
+        self.track_right = True
+
+    def fill(self, inputs: dict, versions: dict, track_right: bool):
+        """
+        Renders the latest inputs into the buffers, skipping panels already holding that version.
+
+        Parameters
+        ----------
+        inputs: dict
+            Latest "frame", "segmented" and "track_image" arrays, None if not received yet, and the
+            frame's "placement", (roi, crop centre) from a RoiManager or None for a FULL_ROI frame
+            zoomed on the centre of the panel.
+        versions: dict
+            Number of times each input has been received.
+        track_right: bool
+            True to zoom on the right panel, False for the left panel.
+
+        Returns
+        -------
+        None
+        """
+
+        frame = inputs["frame"]
+        placement = inputs.get("placement")
+        self.track_right = track_right
+        if frame is not None:
+            if self.versions["overview"] != versions["frame"]:
+                height, width = frame.shape
+                if placement is None or placement[0] == FULL_ROI:
+                    overview = self.overview.ensure((height // 2, width // 2))
+                    cv2.resize(frame, (width // 2, height // 2), dst=overview)
+                else:
+                    # A narrowed readout is shown where it lies on the sensor, the rest stays dark
+                    roi = placement[0]
+                    overview = self.overview.ensure((FULL_ROI[3] // 2, FULL_ROI[2] // 2))
+                    overview.fill(0)
+                    y_start, x_start = (roi[1] - FULL_ROI[1]) // 2, (roi[0] - FULL_ROI[0]) // 2
+                    overview[y_start:y_start + height // 2, x_start:x_start + width // 2] = cv2.resize(frame, (width // 2, height // 2))
+                self.versions["overview"] = versions["frame"]
+
+            if self.versions["zoomed"] != (versions["frame"], track_right):
+                zoomed = self.zoomed.ensure((512, 512))
+                crop = FrameSegmenter.crop_panel(frame, track_right) if placement is None else crop_square(frame, *placement)
+                cv2.resize(crop, (512, 512), dst=zoomed)
+                self.versions["zoomed"] = (versions["frame"], track_right)
+
+        segmented = inputs["segmented"]
+        if segmented is not None and self.versions["segmented"] != versions["segmented"]:
+            np.copyto(self.segmented.ensure(segmented.shape), segmented, casting='unsafe')
+            self.versions["segmented"] = versions["segmented"]
+
+        # Same conversion the GUI has always shown, uint8 then times 255 with wrap around
+        track_image = inputs["track_image"]
+        if track_image is not None and self.versions["track_image"] != versions["track_image"]:
+            buffer = self.track_image.ensure(track_image.shape)
+            np.copyto(buffer, track_image, casting='unsafe')
+            buffer *= 255
+            self.versions["track_image"] = versions["track_image"]
+
+    def left_image(self) -> QImage:
+        return self.overview.image(0, self.overview.array.shape[1] // 2)
+
+    def right_image(self) -> QImage:
+        half = self.overview.array.shape[1] // 2
+        return self.overview.image(half, self.overview.array.shape[1] - half)
+
+# ---- Display preparation ----#
+
+# Prepares preview panels from the latest inputs and publishes "display_ready" when a new set waits in the mailbox
+class DisplayPreparer(EngineWorker):
+    events = ("display_ready",)
+
+    def __init__(self, num_buffers: int = 3, max_fps: float = DISPLAY_MAX_FPS, roi_manager: RoiManager = None):
+        """
+        Initializes the display preparation stage.
+
+        Parameters
+        ----------
+        num_buffers: int
+            Number of panel sets. Three let one be shown, one wait in the mailbox and one be prepared.
+        max_fps: float
+            Most panel sets prepared per second, None for no cap.
+        roi_manager: RoiManager
+            Tells where each frame was read out and where its crop is, None if frames are always FULL_ROI.
+
+        Returns
+        -------
+        None
+        """
+
+        super().__init__()
+        self.max_fps = max_fps
+        self.last_prepared = None
+        self.prepared_frame = 0 # Version of the latest frame prepared
+        self.acquisition_meter = RateMeter() # Frames received
+        self.display_meter = RateMeter() # Panel sets taken by the GUI
+        self.track_right = True
+        self.roi_manager = roi_manager
+        self.inputs = {"frame": None, "placement": None, "segmented": None, "track_image": None}
+        self.versions = {"frame": 0, "segmented": 0, "track_image": 0}
+        self.free = [DisplayFrame() for _ in range(num_buffers)]
+        self.mailbox = LatestMailbox()
+        self.lock = threading.Lock()
+        self.input_event = threading.Event()
+
+    def receive(self, name: str, value: np.ndarray, **extra):
+        # extra inputs are replaced together with the input they describe
+        with self.lock:
+            self.inputs[name] = value
+            self.inputs.update(extra)
+            self.versions[name] += 1
+        self.input_event.set()
+
+    def receive_frame(self, frame: np.ndarray):
+        self.acquisition_meter.tick()
+        placement = None
+        if self.roi_manager is not None:
+            placement = self.roi_manager.placement(frame)
+            if placement is None:
+                return # Read out before the last ROI change
+        if self.versions["frame"] > self.prepared_frame:
+            self.metrics.count("display_frames_dropped") # Replaced before it was ever prepared
+        self.receive("frame", frame, placement=placement)
+
+    def receive_segmented(self, segmented: np.ndarray):
+        self.receive("segmented", segmented)
+
+    def receive_track_image(self, track_image: np.ndarray):
+        self.receive("track_image", track_image)
+
+    def toggle_track_right(self):
+        self.track_right = not self.track_right
+        self.input_event.set()
+
+    def prepare(self) -> DisplayFrame:
+        """
+        Fills a free panel set with the latest inputs.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        DisplayFrame
+            Prepared panels, None if every set is in use.
+        """
+
+        with self.lock:
+            if not self.free:
+                return None
+            display_frame = self.free.pop()
+            inputs = dict(self.inputs)
+            versions = dict(self.versions)
+            self.prepared_frame = versions["frame"]
+        display_frame.fill(inputs, versions, self.track_right)
+        return display_frame
+
+    def post(self, display_frame: DisplayFrame):
+        # Only the latest set is kept, a set that was never shown is recycled
+        replaced = self.mailbox.put(display_frame)
+        self.metrics.set_gauge("display_queue", 1)
+        if replaced is not None:
+            self.release(replaced)
+        else:
+            self.publish("display_ready", None)
+
+    def take(self) -> DisplayFrame:
+        display_frame = self.mailbox.take()
+        if display_frame is not None:
+            self.display_meter.tick()
+            self.metrics.count("display_refreshes")
+            self.metrics.set_gauge("display_queue", 0)
+        return display_frame
+
+    def rates(self) -> tuple:
+        # (display fps, acquisition fps)
+        return self.display_meter.rate(), self.acquisition_meter.rate()
+
+    def release(self, display_frame: DisplayFrame):
+        with self.lock:
+            self.free.append(display_frame)
+
+    def step(self):
+        if not self.input_event.wait(0.1):
+            return
+
+        # Hold off until the next display slot, inputs received meanwhile replace the waiting ones
+        if self.max_fps and self.last_prepared is not None:
+            delay = self.last_prepared + 1 / self.max_fps - time.perf_counter()
+            if delay > 0 and self.stop_event.wait(delay):
+                return
+        self.input_event.clear()
+        self.last_prepared = time.perf_counter()
+        display_frame = self.prepare()
+        if display_frame is not None:
+            self.post(display_frame)
+
+# DisplayThread runs the display preparation and tells the MainWindow when new panels are ready
+class DisplayThread(WorkerThread):
+    display_ready = pyqtSignal()
+
+    def __init__(self, max_fps: float = DISPLAY_MAX_FPS, roi_manager: RoiManager = None):
+        """
+        Initializes the display thread.
+
+        Parameters
+        ----------
+        max_fps: float
+            Most GUI refreshes per second, None for no cap.
+        roi_manager: RoiManager
+            Camera readout and crop shared with the computer vision, None if frames are always FULL_ROI.
+
+        Returns
+        -------
+        None
+        """
+
+        super().__init__()
+        self.worker = DisplayPreparer(max_fps=max_fps, roi_manager=roi_manager)
+        self.worker.subscribe("display_ready", lambda value: self.display_ready.emit())
@@ -0,0 +1,284 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Both panels of the split view segmented together. The tracked panel is the primary channel, the
+# other one the secondary. The panels are registered once, by phase correlation, and the offset is
+# kept, so the secondary crop shows the same part of the specimen as the primary one. Both crops are
+# resized into one stack, thresholded from their histograms and reduced to moments, so two channels
+# cost less than one did through ImageSegmentation. The secondary channel confirms the primary
+# target, and stands in for it when the primary loses the target. The ratio of the channels is
+# available for calcium imaging.
+#
+# Positions are in sensor pixels unless said otherwise, as in camera_roi.
+
+from imports_and_constants import *
+from camera_roi import PANEL_WIDTH, CROP_SIZE, TRACK_SIZE, crop_square
+from metrics import metrics
+
+FOREGROUND_QUANTILE = 0.9996 # As ImageSegmentation.binary_thresholding
+INVERSE_QUANTILE = 1 - 0.98 # As ImageSegmentation.inverted_binary_thresholding
+
+def register_channels(primary: np.ndarray, secondary: np.ndarray) -> tuple:
+    """
+    Finds the shift between two images of the same scene by phase correlation.
+
+    Parameters
+    ----------
+    primary: np.ndarray
+        Image of the primary channel.
+    secondary: np.ndarray
+        Image of the secondary channel, same shape.
+
+    Returns
+    -------
+    tuple
+        (x, y) in pixels of the images, a feature at p in primary is at p + (x, y) in secondary.
+    """
+
+    primary = primary.astype(np.float32) - primary.mean()
+    secondary = secondary.astype(np.float32) - secondary.mean()
+    cross_power = np.fft.fft2(secondary) * np.conj(np.fft.fft2(primary))
+    correlation = np.fft.ifft2(cross_power / (np.abs(cross_power) + 1e-9)).real
+    y, x = np.unravel_index(np.argmax(correlation), correlation.shape)
+
+    # Peaks past the middle are negative shifts
+    height, width = correlation.shape
+    return (int(x - width) if x > width // 2 else int(x), int(y - height) if y > height // 2 else int(y))
+
+# DualChannel is an object that crops, registers and segments both panels of a frame
+class DualChannel():
+
+    def __init__(self, offset: tuple = None, agree_within: float = 20, max_spread: float = 120):
+        """
+        Initializes the dual channel processing.
+
+        Parameters
+        ----------
+        offset: tuple
+            (x, y) of the secondary panel relative to the primary one, beyond the panel width, in
+            sensor pixels. None to register the panels on the first frame.
+        agree_within: float
+            Largest distance between the channels' targets, in tracking pixels, for them to confirm each other.
+        max_spread: float
+            Largest spread of a mask around its centre, in tracking pixels, before the channel counts
+            as having lost the target, e.g. when it thresholds noise all over the crop.
+
+        Returns
+        -------
+        None
+        """
+
+        self.offset = offset
+        self.agree_within = agree_within
+        self.max_spread = max_spread
+        self.metrics = metrics
+
+    def reset_registration(self):
+        # Registers the panels again on the next frame, e.g. after the optics were adjusted
+        self.offset = None
+
+    def secondary_center(self, center: tuple, track_right: bool, offset: tuple = (0, 0)) -> tuple:
+        # Centre of the secondary crop for the primary crop around center
+        return (center[0] + (-PANEL_WIDTH if track_right else PANEL_WIDTH) + offset[0], center[1] + offset[1])
+
+    def crop_pair(self, frame: np.ndarray, roi: tuple, center: tuple, track_right: bool, binning: int = 1) -> np.ndarray:
+        """
+        Crops the primary and the registered secondary square out of a frame, registering the panels
+        if they were not yet.
+
+        Parameters
+        ----------
+        frame: np.ndarray
+            Readout of roi.
+        roi: tuple
+            (x, y, width, height) of the readout on the sensor.
+        center: tuple
+            (x, y) sensor position of the centre of the primary crop.
+        track_right: bool
+            True if the primary channel is the right panel.
+        binning: int
+            Sensor pixels per frame pixel in each direction, for a binned readout.
+
+        Returns
+        -------
+        np.ndarray
+            2 x size x size stack of the primary and secondary crops, None if the secondary crop is
+            not inside the readout, e.g. a readout narrowed to the tracked panel.
+        """
+
+        if self.offset is None:
+            secondary = self.crop(frame, roi, self.secondary_center(center, track_right), binning)
+            if secondary is None:
+                return None
+            primary = crop_square(frame, roi, center, binning)
+            shift = register_channels(primary, secondary)
+            self.offset = (shift[0] * binning, shift[1] * binning)
+            print("Channels registered, offset:", self.offset)
+
+        secondary = self.crop(frame, roi, self.secondary_center(center, track_right, self.offset), binning)
+        if secondary is None:
+            return None
+        return np.stack((crop_square(frame, roi, center, binning), secondary))
+
+    @staticmethod
+    def crop(frame: np.ndarray, roi: tuple, center: tuple, binning: int = 1) -> np.ndarray:
+        # crop_square, None if the crop is not inside the readout
+        half = CROP_SIZE // 2
+        if not (roi[0] <= center[0] - half and center[0] - half + CROP_SIZE <= roi[0] + roi[2] and
+                roi[1] <= center[1] - half and center[1] - half + CROP_SIZE <= roi[1] + roi[3]):
+            return None
+        return crop_square(frame, roi, center, binning)
+
+    @staticmethod
+    def resize_pair(pair: np.ndarray) -> np.ndarray:
+        # Both crops resized to TRACK_SIZE into one 2 x TRACK_SIZE x TRACK_SIZE stack
+        if pair.dtype not in (np.uint8, np.uint16, np.float32):
+            pair = pair.astype(np.float32)
+        frames = np.empty((2, TRACK_SIZE, TRACK_SIZE), dtype=pair.dtype)
+        for channel in range(2):
+            cv2.resize(pair[channel], (TRACK_SIZE, TRACK_SIZE), dst=frames[channel])
+        return frames
+
+    @staticmethod
+    def ratio_image(frames: np.ndarray) -> np.ndarray:
+        # Primary over secondary, pixel by pixel, for resized frames that were not scaled per channel
+        return frames[0].astype(np.float32) / np.maximum(frames[1], 1).astype(np.float32)
+
+    @staticmethod
+    def thresholds(frames: np.ndarray, quantile: float) -> np.ndarray:
+        """
+        Smallest value at or above np.quantile of each channel, from the channels' histograms
+        instead of partially sorting every pixel.
+
+        Parameters
+        ----------
+        frames: np.ndarray
+            2 x height x width stack of 8 bit images.
+        quantile: float
+            Quantile, interpolated linearly as np.quantile does.
+
+        Returns
+        -------
+        np.ndarray
+            Integer threshold of each channel, a pixel is at or above the quantile if it is at or above it.
+        """
+
+        histograms = np.stack([cv2.calcHist([frame], [0], None, [256], [0, 256]).ravel() for frame in frames])
+        cumulative = np.cumsum(histograms, axis=1)
+        position = (frames[0].size - 1) * quantile
+        lower = int(position)
+        below = np.argmax(cumulative > lower, axis=1) # The sorted values either side of the quantile
+        above = np.argmax(cumulative > min(lower + 1, frames[0].size - 1), axis=1)
+        return np.where((position == lower) | (below == above), below, above)
+
+    @staticmethod
+    def segment(frames: np.ndarray, inverse: bool) -> np.ndarray:
+        """
+        Thresholds both channels as ImageSegmentation does a single one.
+
+        Parameters
+        ----------
+        frames: np.ndarray
+            2 x TRACK_SIZE x TRACK_SIZE stack of 8 bit images.
+        inverse: bool
+            True for inverse segmentation.
+
+        Returns
+        -------
+        np.ndarray
+            2 x TRACK_SIZE x TRACK_SIZE stack of binary masks, 255 inside.
+        """
+
+        thresholds = DualChannel.thresholds(frames, INVERSE_QUANTILE if inverse else FOREGROUND_QUANTILE)
+        segmented = np.empty_like(frames)
+        for channel in range(2):
+            # Values at or above the threshold are those above one less
+            cv2.threshold(frames[channel], float(thresholds[channel]) - 1, 255,
+                          cv2.THRESH_BINARY_INV if inverse else cv2.THRESH_BINARY, dst=segmented[channel])
+        return segmented
+
+    @staticmethod
+    def centers(segmented: np.ndarray) -> tuple:
+        """
+        Centre of mass and spread of both masks.
+
+        Parameters
+        ----------
+        segmented: np.ndarray
+            2 x height x width stack of binary masks.
+
+        Returns
+        -------
+        tuple
+            (centres, spreads, areas). centres is 2 x 2 of (x, y) per channel, nan for an empty mask,
+            spreads the root mean square distance from the centre, areas the number of pixels inside.
+        """
+
+        moments = [cv2.moments(mask, binaryImage=True) for mask in segmented]
+        areas = np.array([m["m00"] for m in moments])
+        sums = np.array([[m["m10"], m["m01"], m["m20"] + m["m02"]] for m in moments])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / areas[:, None]
+            variance = means[:, 2] - means[:, 0] ** 2 - means[:, 1] ** 2
+        return means[:, :2], np.sqrt(np.maximum(variance, 0)), areas
+
+    def process(self, pair: np.ndarray, inverse: bool, ratio: bool = False) -> tuple:
+        """
+        Segments both channels and picks the target.
+
+        Parameters
+        ----------
+        pair: np.ndarray
+            2 x size x size stack of the primary and secondary crops from crop_pair, 8 bit or raw.
+        inverse: bool
+            True for inverse segmentation.
+        ratio: bool
+            True to compute the ratio image as well.
+
+        Returns
+        -------
+        tuple
+            (segmented image, head pixel coordinates, ratio image). The segmented image and the
+            target come from the primary channel, or from the secondary one when the primary lost
+            the target. The head coordinates are None if both lost it, the ratio image None unless asked for.
+        """
+
+        frames = self.resize_pair(pair)
+        ratio_img = self.ratio_image(frames) if ratio else None
+
+        # Raw crops are scaled to 8 bits per channel, as in FrameSegmenter.process_frame
+        if frames.dtype != np.uint8:
+            peaks = np.maximum(frames.reshape(2, -1).max(axis=1).astype(np.float64), 1)
+            frames = (frames * (255 / peaks)[:, None, None]).astype("uint8")
+
+        segmented = self.segment(frames, inverse)
+        centers, spreads, areas = self.centers(segmented)
+        found = (areas > 0) & (spreads <= self.max_spread)
+
+        if found[0]:
+            channel = 0
+            if found[1]:
+                apart = np.hypot(*(centers[0] - centers[1]))
+                self.metrics.count("dual_confirmed" if apart <= self.agree_within else "dual_disagreements")
+        elif found[1]:
+            channel = 1
+            self.metrics.count("dual_fallbacks")
+        else:
+            return segmented[0], None, ratio_img
+
+        if ratio:
+            # Mean ratio over the target, the readout of an indicator over a reference channel
+            self.metrics.set_gauge("channel_ratio", float(ratio_img[segmented[channel] > 0].mean()))
+        head_coordinates = (int(centers[channel][0]), int(centers[channel][1]))
+        return segmented[channel], head_coordinates, ratio_img
@@ -13,7 +13,16 @@
 # limitations under the License.
 
 from imports_and_constants import *
+from PyQt5.QtWidgets import QApplication, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QSplashScreen, QMessageBox
+from PyQt5 import sip
+from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, Qt, QTimer
+from PyQt5.QtGui import QImage, QPixmap, QFont
 from threads import ImageGrabThread, ComputerVisionThread, TrackThread
+from display import DisplayThread, DISPLAY_MAX_FPS
+from dashboard import MetricsDashboard
+from profiler import SamplingProfiler, default_profile_seconds, default_profile_directory
+from resources import loading_screen_path
+from watchdog import Supervisor, WatchPolicy, describe_health
 from hardware_wrappers import *
 
 # ---- GUI Design ----#
@@ -47,6 +56,12 @@ class MainWindow(QWidget):
         self.track_thread = None
         self.computer_vision_thread = None
         self.grab_image_thread = None
+        self.display_thread = None
+        self.supervisor = None
+        self.profiler = None
+        self.profile_seconds = default_profile_seconds
+        self.profile_directory = default_profile_directory
+        self.shown_versions = {}
         self.core_wrap = core_wrap
         self.live_stream_wrap = live_stream_wrap
         self.track_right = True
@@ -79,8 +94,13 @@ class MainWindow(QWidget):
         self.stop_stage_button = QPushButton("Stop Stage")
         self.inverse_seg_button = QPushButton("Inverse Segmentation")
         self.track_other_panel_button = QPushButton("Track Other Panel")
+        self.dual_channel_button = QPushButton("Dual Channel")
+        self.dual_channel_button.setCheckable(True)
         self.display_capture_time_button = QPushButton("Display Capture Time")
         self.display_capture_time_button.setCheckable(True)
+        self.profile_button = QPushButton("Profile Threads")
+        self.dashboard_button = QPushButton("Dashboard")
+        self.dashboard_button.setCheckable(True)
         self.exit_button = QPushButton("Exit")
 
         # self.stop_stage_button.setEnabled(False) # DEBUG
@@ -92,7 +112,10 @@ class MainWindow(QWidget):
         buttons_layout.addWidget(self.stop_stage_button)
         buttons_layout.addWidget(self.inverse_seg_button)
         buttons_layout.addWidget(self.track_other_panel_button)
+        buttons_layout.addWidget(self.dual_channel_button)
         buttons_layout.addWidget(self.display_capture_time_button)
+        buttons_layout.addWidget(self.profile_button)
+        buttons_layout.addWidget(self.dashboard_button)
         buttons_layout.addWidget(self.exit_button)
         buttons_layout.addStretch()
 
@@ -130,12 +153,29 @@ class MainWindow(QWidget):
         upper_layout.addLayout(segmented_video_layout)
         upper_layout.addLayout(skeleton_video_layout)
 
+        # Performance dashboard, hidden until the Dashboard button is checked
+        self.dashboard = MetricsDashboard()
+        self.dashboard.hide()
+        upper_layout.addWidget(self.dashboard)
+
         # Label for coordinates and velocity bar
         self.coordinates_label = QLabel("Coordinates: (0,0)")
         bottom_layout = QHBoxLayout()
         bottom_layout.addWidget(self.coordinates_label)
         bottom_layout.setAlignment(Qt.AlignLeft)
 
+        # Labels for display refresh rate versus camera frame rate and for the health of the pipeline, refreshed once a second
+        self.display_rate_label = QLabel("Display: 0.0 fps | Camera: 0.0 fps")
+        bottom_layout.addSpacing(30)
+        bottom_layout.addWidget(self.display_rate_label)
+        self.health_label = QLabel("Health: starting")
+        bottom_layout.addSpacing(30)
+        bottom_layout.addWidget(self.health_label)
+        self.status_timer = QTimer(self)
+        self.status_timer.timeout.connect(self.update_display_rate)
+        self.status_timer.timeout.connect(self.update_health)
+        self.status_timer.start(1000)
+
         main_layout = QVBoxLayout()
         main_layout.addLayout(upper_layout)
         main_layout.addLayout(bottom_layout)
@@ -188,6 +228,9 @@ class MainWindow(QWidget):
         self.inverse_seg_button.clicked.connect(self.inverse_segmentation_clicked)
         self.display_capture_time_button.clicked.connect(self.display_capture_time)
         self.track_other_panel_button.clicked.connect(self.track_other_panel)
+        self.dual_channel_button.clicked.connect(self.dual_channel_clicked)
+        self.dashboard_button.clicked.connect(self.toggle_dashboard)
+        self.profile_button.clicked.connect(self.profile_threads)
 
     # When closed the application it makes sure the stage movement from our custom API is stopped
     def close_application(self):
@@ -217,6 +260,34 @@ class MainWindow(QWidget):
 
         self.close()
 
+    def stop_threads(self):
+        """ 
+        Stops the worker threads, Qt aborts if a running thread is destroyed.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        # The watchdog goes first, it would restart the workers being stopped
+        if self.supervisor is not None:
+            self.supervisor.stop()
+        for thread in (self.grab_image_thread, self.display_thread, self.computer_vision_thread, self.track_thread):
+            if thread is not None and not sip.isdeleted(thread):
+                thread.stop()
+
+    def closeEvent(self, event):
+        self.stop_threads()
+        event.accept()
+
+    def __del__(self):
+        # A running worker keeps its own thread alive, so a window dropped without closing must stop them
+        self.stop_threads()
+
     def stop_stage(self):
         """ 
         Stops movement in all directions to stabilize stage if control is lost.
@@ -237,6 +308,90 @@ class MainWindow(QWidget):
         MoveStage.runXYVectorialTransfer(-1, 0, -1, 0, self.microscope_online)
         print("Failsafe: Stopped the stage in all directions!")
 
+    @pyqtSlot()
+    def update_display(self):
+        """ 
+        Shows the latest panels prepared by the display thread.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        display_frame = self.display_thread.worker.take()
+        if display_frame is not None:
+            self.show_display_frame(display_frame)
+            self.display_thread.worker.release(display_frame)
+
+    def update_display_rate(self):
+        """ 
+        Shows how many times a second the panels are refreshed against the camera frame rate.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.display_thread is None:
+            return
+        display_fps, acquisition_fps = self.display_thread.worker.rates()
+        self.display_rate_label.setText(f"Display: {display_fps:.1f} fps | Camera: {acquisition_fps:.1f} fps")
+
+    def update_health(self):
+        """ 
+        Shows the health of the pipeline stages reported by the watchdog, in red when one is not ok.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.supervisor is None:
+            return
+        health = self.supervisor.health()
+        self.health_label.setText("Health: " + describe_health(health))
+        healthy = all(state["status"] in ("ok", "starting", "stopped") for state in health.values())
+        self.health_label.setStyleSheet("" if healthy else "color: red;")
+
+    def show_display_frame(self, display_frame):
+        """ 
+        Sets the labels whose panels changed since they were last shown.
+
+        Parameters
+        ----------
+        display_frame: DisplayFrame
+            Prepared panels.
+
+        Returns
+        -------
+        None
+        """
+
+        versions = display_frame.versions
+        if versions["overview"] is not None and versions["overview"] != self.shown_versions.get("overview"):
+            self.left_label.setPixmap(QPixmap.fromImage(display_frame.left_image()))
+            self.right_label.setPixmap(QPixmap.fromImage(display_frame.right_image()))
+        if versions["zoomed"] is not None and versions["zoomed"] != self.shown_versions.get("zoomed"):
+            self.zoomed_label.setPixmap(QPixmap.fromImage(display_frame.zoomed.image()))
+            self.zoomed_video_title.setText("RIGHT CROPPED" if display_frame.track_right else "LEFT CROPPED")
+        if versions["segmented"] is not None and versions["segmented"] != self.shown_versions.get("segmented"):
+            self.segmented_label.setPixmap(QPixmap.fromImage(display_frame.segmented.image()))
+        if versions["track_image"] is not None and versions["track_image"] != self.shown_versions.get("track_image"):
+            self.skeleton_label.setPixmap(QPixmap.fromImage(display_frame.track_image.image()))
+        self.shown_versions = dict(versions)
+
     @pyqtSlot(object)
     def update_image(self, frame: np.ndarray):
         """ 
@@ -252,39 +407,9 @@ class MainWindow(QWidget):
         None
         """
 
-        # Concatenate microscope view and zoomed in view
-        copy = frame.copy()
-        #original = cv2.resize(frame,(512,512))
-        left = cv2.resize(frame[:,:1024],(512,512))
-        right = cv2.resize(frame[:,1024:],(512,512))
-        # Add condition here for right-left
-        zoomed = None
-        if self.track_right:
-            zoomed = cv2.resize(frame[:,1024:][(512 - 385):(512 + 385), (512 - 385):(512 + 385)],(512,512)) # Get sqr crop of right panel
-            self.zoomed_video_title.setText("RIGHT CROPPED")
-        else:
-            zoomed = cv2.resize(frame[:,:1024][(512 - 385):(512 + 385), (512 - 385):(512 + 385)],(512,512)) # Get sqr crop of left panel
-            self.zoomed_video_title.setText("LEFT CROPPED")
-
-        # Convert the NumPy array to QImage (Updated for grayscale)
-        height, width = left.shape
-        bytes_per_line = width
-        image = QImage(left.tobytes(), width, height, bytes_per_line, QImage.Format_Grayscale8)
-        pixmap = QPixmap.fromImage(image)
-        self.left_label.setPixmap(pixmap)
-
-        height, width = right.shape
-        bytes_per_line = width
-        image = QImage(right.tobytes(), width, height, bytes_per_line, QImage.Format_Grayscale8)
-        pixmap = QPixmap.fromImage(image)
-        self.right_label.setPixmap(pixmap)
-
-        # Convert the NumPy array to QImage (Updated for grayscale)
-        height, width = zoomed.shape
-        bytes_per_line = width
-        image = QImage(zoomed.tobytes(), width, height, bytes_per_line, QImage.Format_Grayscale8)
-        pixmap = QPixmap.fromImage(image)
-        self.zoomed_label.setPixmap(pixmap)
+        # Panels are prepared on the display thread, never on the GUI thread
+        if self.display_thread is not None:
+            self.display_thread.worker.receive_frame(frame)
 
     @pyqtSlot(object)
     def update_segmented_image(self, frame: np.ndarray):
@@ -301,17 +426,8 @@ class MainWindow(QWidget):
         None
         """
 
-        # Convert the NumPy array to QImage (Updated for grayscale)
-        # height, width = frame.shape
-
-        copy = frame.copy()
-        height,width = copy.shape
-        bytes_per_line = width
-        image = QImage(copy.tobytes(), width, height, bytes_per_line, QImage.Format_Grayscale8)
-
-        # Set the image on the QLabel
-        pixmap = QPixmap.fromImage(image)
-        self.segmented_label.setPixmap(pixmap)
+        if self.display_thread is not None:
+            self.display_thread.worker.receive_segmented(frame)
 
     @pyqtSlot(object)
     def update_skeleton_image(self, frame: np.ndarray):
@@ -328,16 +444,8 @@ class MainWindow(QWidget):
         None
         """
 
-        # Convert the NumPy array to QImage (Updated for grayscale)
-        copy = frame.copy()
-        copy = copy.astype('uint8') * 255
-        height,width = copy.shape
-        bytes_per_line = width
-        image = QImage(copy.tobytes(), width, height, bytes_per_line, QImage.Format_Grayscale8)
-
-        # Set the image on the QLabel
-        pixmap = QPixmap.fromImage(image)
-        self.skeleton_label.setPixmap(pixmap)
+        if self.display_thread is not None:
+            self.display_thread.worker.receive_track_image(frame)
 
     @pyqtSlot(object)
     def update_coordinates(self, coordinates):
@@ -378,10 +486,12 @@ class MainWindow(QWidget):
             self.stop_stage_button.setEnabled(False)
             self.inverse_seg_button.setEnabled(False)
             self.track_other_panel_button.setEnabled(False)
+            self.dual_channel_button.setEnabled(False)
         else:
             self.stop_stage_button.setEnabled(True)
             self.inverse_seg_button.setEnabled(True)
             self.track_other_panel_button.setEnabled(True)
+            self.dual_channel_button.setEnabled(True)
     
     def inverse_segmentation_clicked(self):
         """ 
@@ -397,6 +507,21 @@ class MainWindow(QWidget):
         """
 
         self.computer_vision_thread.toggle_inverse()
+
+    def dual_channel_clicked(self):
+        """ 
+        Flips dual channel flag, segmenting both panels together.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.computer_vision_thread.toggle_dual_channel()
         
     def track_other_panel(self):
         """ 
@@ -413,7 +538,25 @@ class MainWindow(QWidget):
         
         self.computer_vision_thread.toggle_track_right()
         self.track_right = not self.track_right
+        if self.display_thread is not None:
+            self.display_thread.worker.toggle_track_right()
+        self.zoomed_video_title.setText("RIGHT CROPPED" if self.track_right else "LEFT CROPPED")
     
+    def toggle_dashboard(self):
+        """ 
+        Shows or hides the performance dashboard, which only samples the metrics while shown.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.dashboard.setVisible(self.dashboard_button.isChecked())
+
     def display_capture_time(self):
         """ 
         Displays capture time in terminal if enabled.
@@ -429,9 +572,73 @@ class MainWindow(QWidget):
 
         self.grab_image_thread.toggle_display_capture_time()
 
+    def profile_threads(self):
+        """ 
+        Samples the stacks of the grab, computer vision, tracker, display and GUI threads for
+        profile_seconds while the session keeps running, then writes the profile.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.profiler is not None and self.profiler.is_running():
+            return
+        print("Profiling threads for " + str(self.profile_seconds) + " s")
+        self.profiler = SamplingProfiler()
+        self.profiler.start()
+        self.profile_button.setEnabled(False)
+        self.profile_button.setText("Profiling...")
+        QTimer.singleShot(int(self.profile_seconds * 1000), self.finish_profile)
+
+    def finish_profile(self):
+        """ 
+        Stops the profiler and writes the collapsed stacks and the per-function summary.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.profiler.stop()
+        collapsed_path, summary_path = self.profiler.save(self.profile_directory)
+        print("Profile written to " + collapsed_path + " (collapsed stacks) and " + summary_path + " (summary)")
+        self.profile_button.setText("Profile Threads")
+        self.profile_button.setEnabled(True)
+
 class SplashScreen(QSplashScreen):
     def __init__(self, parent=None):
-        super(SplashScreen, self).__init__(QPixmap(r"assets\loading_screen.png"))
+        super(SplashScreen, self).__init__(QPixmap(loading_screen_path()))
 
     def showMessage(self, message):
-        self.showMessage(message, alignment=Qt.AlignBottom | Qt.AlignHCenter, color=Qt.white)
+        super(SplashScreen, self).showMessage(message, Qt.AlignBottom | Qt.AlignHCenter, Qt.white)
+
+    def show_progress(self, message: str, step: int, total: int):
+        """ 
+        Shows an initialization step on the splash screen and repaints it straight away, as the
+        event loop is not running yet during startup.
+
+        Parameters
+        ----------
+        message: str
+            Description of the step.
+        step: int
+            Number of the step.
+        total: int
+            Number of steps.
+
+        Returns
+        -------
+        None
+        """
+
+        self.showMessage("Initialization " + str(step) + "/" + str(total) + ": " + message)
+        QApplication.processEvents()
@@ -13,14 +13,17 @@
 # limitations under the License.
 
 from imports_and_constants import *
+from resources import offline_frame
 
 # Wrapper for MicroManager core
 class CoreWrapper():
+    replay = False # True for wrappers replaying a recorded session
+
     def __init__(self, microscope_online):
         self.microscope_online = microscope_online
 
         if self.microscope_online:
-            self.core_instance = Core() # Microscope
+            self.core_instance = pycromanager.Core() # Microscope
         else:
             pass # Detached
 
@@ -90,6 +93,8 @@ class CoreWrapper():
 
 # Wrapper for LiveStreamManager
 class LiveStreamWrapper():
+    replay = False # True for wrappers replaying a recorded session
+
     def __init__(self, microscope_online: bool):
         self.microscope_online = microscope_online
 
@@ -139,7 +144,7 @@ class LiveStreamWrapper():
             # return np.random.randint(0, 256, size=(2048, 2048), dtype=np.uint16) # Detached 1
 
             time.sleep(0.1) # Detached 2
-            return np.load('hongruo.npy')
+            return offline_frame()
 
     def is_live_mode_on(self) -> bool:
         """ 
@@ -180,6 +185,165 @@ class LiveStreamWrapper():
         else:
             pass
 
+# Replays a recorded session in place of the LiveStreamManager
+class ReplayStreamWrapper(LiveStreamWrapper):
+    replay = True
+
+    def __init__(self, recording, realtime: bool = True, loop: bool = False,
+                 start_index: int = 0, stop_index: int = None, fps: float = 10):
+        """ 
+        Initializes the replay of a recorded session.
+
+        Parameters
+        ----------
+        recording: Recording
+            Recorded session, e.g. scripts/recording_reader.Recording. Indexing it gives frames,
+            its positions and elapsed attributes give the recording log (or None without a log).
+        realtime: bool
+            If true, frames are served at the recorded frame times, otherwise as fast as they are requested.
+        loop: bool
+            If true, the replay starts over after the last frame, otherwise the last frame is repeated.
+        start_index: int
+            First frame to replay.
+        stop_index: int
+            Frame to stop before, defaults to the end of the recording.
+        fps: float
+            Frame rate used for pacing when the recording has no log.
+
+        Returns
+        -------
+        None
+        """
+
+        self.microscope_online = False
+        self.recording = recording
+        self.realtime = realtime
+        self.loop = loop
+        self.start_index = start_index
+        self.stop_index = len(recording) if stop_index is None else min(stop_index, len(recording))
+        self.fps = fps
+        self.index = start_index # Frame served last, the replayed stage position follows it
+        self.next_index = start_index
+        self.finished = False
+        self.clock_offset = None
+        self.lock = threading.Lock()
+
+    @property
+    def num_frames(self) -> int:
+        return max(self.stop_index - self.start_index, 0)
+
+    def frame_time(self, index: int) -> float:
+        """ 
+        Time of a frame since the start of the recording, from the recording log when it has one.
+
+        Parameters
+        ----------
+        index: int
+            Frame index.
+
+        Returns
+        -------
+        float
+            Time in seconds.
+        """
+
+        elapsed = self.recording.elapsed
+        if elapsed is not None and index < len(elapsed) and np.isfinite(elapsed[index]):
+            return float(elapsed[index])
+        return index / self.fps
+
+    def get_is_live_mode_on(self) -> bool:
+        return True
+
+    def is_live_mode_on(self) -> bool:
+        return True
+
+    def set_live_mode_on(self, on_or_off: bool):
+        pass
+
+    def snap(self, display_img_bool: bool) -> np.ndarray:
+        """ 
+        Returns the next frame of the recording, waiting for its recorded time in real time mode.
+
+        Parameters
+        ----------
+        display_img_bool: bool
+            Unused, kept for compatibility with LiveStreamWrapper.
+
+        Returns
+        -------
+        numpy.ndarray
+            2D numpy array of the recorded frame.
+        """
+
+        with self.lock:
+            if self.next_index >= self.stop_index:
+                if not self.loop or self.num_frames == 0:
+                    self.finished = True
+                    return self.recording[min(self.index, len(self.recording) - 1)]
+                self.next_index = self.start_index
+                self.clock_offset = None
+            index = self.next_index
+            self.next_index += 1
+
+            if self.realtime:
+                if self.clock_offset is None:
+                    self.clock_offset = time.perf_counter() - self.frame_time(index)
+                delay = self.clock_offset + self.frame_time(index) - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+        frame = self.recording[index]
+        self.index = index
+        return frame.reshape(frame.shape[-2:])
+
+# Replays the stage positions logged with a recorded session in place of the MicroManager core
+class ReplayCoreWrapper(CoreWrapper):
+    replay = True
+
+    def __init__(self, stream_wrap: ReplayStreamWrapper):
+        """ 
+        Initializes the replayed stage, which is wherever the stage was when the last served frame was recorded.
+
+        Parameters
+        ----------
+        stream_wrap: ReplayStreamWrapper
+            Replay whose frames the stage positions follow.
+
+        Returns
+        -------
+        None
+        """
+
+        self.microscope_online = False
+        self.stream_wrap = stream_wrap
+
+        # Frames missing from the log keep the last logged position
+        self.positions = None
+        if stream_wrap.recording.positions is not None:
+            self.positions = np.array(stream_wrap.recording.positions, dtype=float)
+            last = np.zeros(2)
+            for position in self.positions:
+                if np.isnan(position).any():
+                    position[:] = last
+                else:
+                    last = position.copy()
+
+    def get_position(self, index: int) -> tuple:
+        if self.positions is None or len(self.positions) == 0:
+            return 0, 0
+        x_pos, y_pos = self.positions[min(index, len(self.positions) - 1)]
+        return float(x_pos), float(y_pos)
+
+    def get_x_position(self):
+        return self.get_position(self.stream_wrap.index)[0]
+
+    def get_y_position(self):
+        return self.get_position(self.stream_wrap.index)[1]
+
+    def set_roi(self, x_start: int, y_start: int, x_size: int, y_size: int):
+        pass
+
 # Abstraction for stage interaction
 class MoveStage():
     
@@ -290,7 +454,7 @@ class GetStageCoords():
             Value of the x position of the stage.
         """
 
-        if self.microscope_online:
+        if self.microscope_online or self.core_wrap.replay:
             return self.core_wrap.get_x_position() # Microscope
         else:
             return 0 # Detached
@@ -309,7 +473,7 @@ class GetStageCoords():
             Value of the y position of the stage.
         """
 
-        if self.microscope_online:
+        if self.microscope_online or self.core_wrap.replay:
             return self.core_wrap.get_y_position() # Microscope
         else:
             return 0 # Detached
@@ -319,6 +483,7 @@ class PixToCartCoords():
 
     def __init__(self, microscope_online: bool):
         self.microscope_online = microscope_online
+        self.offset = (0, 0) # Offset of the image centre from the optical centre, in pixels of the image
 
     def pixel_to_cartesian_coords(self, core_wrap: CoreWrapper, 
                                   head_pixel_x:int, head_pixel_y:int,
@@ -346,17 +511,17 @@ class PixToCartCoords():
             Returns a 1x2 numpy array of the form [cartesian_x_coord, cartesian_y_coord]
         """
 
-        if self.microscope_online:
+        if self.microscope_online or core_wrap.replay:
             x_scaling_factor = 0.1 * (770 / 512)  # Microscope
             y_scaling_factor = 0.1 * (770 / 512)
 
             x_cur_pos = core_wrap.get_x_position()
             y_cur_pos = core_wrap.get_y_position()
 
-            # Convert pixel coordinates to stage coordinates
+            # Convert pixel coordinates to stage coordinates, the offset accounts for a crop away from the optical centre
             # Subtract y difference from y offset to account for different coordinate systems
-            x_new_pos = (head_pixel_x - image_width / 2) * x_scaling_factor + x_cur_pos
-            y_new_pos = (head_pixel_y - image_height / 2) * y_scaling_factor + y_cur_pos
+            x_new_pos = (head_pixel_x + self.offset[0] - image_width / 2) * x_scaling_factor + x_cur_pos
+            y_new_pos = (head_pixel_y + self.offset[1] - image_height / 2) * y_scaling_factor + y_cur_pos
 
             return [x_new_pos, y_new_pos]
         else:
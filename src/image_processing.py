@@ -14,6 +14,7 @@
 
 from imports_and_constants import *
 from hardware_wrappers import LiveStreamWrapper, CoreWrapper
+from resources import offline_frame, offline_image
 
 # Abstraction for retrieving image
 class ImageGrabber():
@@ -36,6 +37,23 @@ class ImageGrabber():
             Returns a 2D image.
         """
 
+        return self.image_from_raw(self.get_raw(live_stream_wrap), live_stream_wrap)
+
+    def get_raw(self, live_stream_wrap: LiveStreamWrapper) -> np.ndarray:
+        """ 
+        Grabs a raw frame from the live stream wrapper, at full resolution and bit depth.
+
+        Parameters
+        ----------
+        live_stream_wrap: LiveStreamWrapper
+            Takes an instance of the wrapper of the LiveStream object in Micromanager.
+
+        Returns
+        -------
+        np.ndarray
+            Returns a 2D 16 bit image.
+        """
+
         if self.microscope_online:
             # Only runs when micromanager live stream is on
             img = live_stream_wrap.snap(False)
@@ -45,16 +63,63 @@ class ImageGrabber():
                 tagged_image.pix,
                 newshape=[-1, tagged_image.tags['Height'], tagged_image.tags['Width']]
             )
+            return image_array[0, :, :]
 
-            image_array = (image_array / image_array.max() * 255).astype("uint8")[0, :, :]
-            return image_array
+        elif live_stream_wrap.replay:
+            # Recorded frames are raw 16 bit frames from the same ROI
+            return live_stream_wrap.snap(False)
         
         else:
             # reshaped_img = np.random.randint(0, 256, size=(2048, 2048), dtype=np.uint16) # Detached
             time.sleep(0.05)
-            reshaped_img = np.load(r'tests\hongruo.npy')[512:1536,:] # The image would already be cropped
-            image = (reshaped_img / reshaped_img.max() * 255).astype("uint8")
-            return image
+            return offline_frame()[512:1536,:] # The image would already be cropped
+
+    def image_from_raw(self, raw: np.ndarray, live_stream_wrap: LiveStreamWrapper) -> np.ndarray:
+        """ 
+        Scales a raw frame to 8 bits for display and segmentation.
+
+        Parameters
+        ----------
+        raw: np.ndarray
+            Raw frame from get_raw.
+        live_stream_wrap: LiveStreamWrapper
+            The live stream wrapper the frame came from.
+
+        Returns
+        -------
+        np.ndarray
+            Returns a 2D 8 bit image.
+        """
+
+        if not self.microscope_online and not live_stream_wrap.replay:
+            return offline_image() # Cropped and scaled once, shared read-only
+        return (raw / max(raw.max(), 1) * 255).astype("uint8")
+
+def bin_image(image: np.ndarray, factor: int) -> np.ndarray:
+    """ 
+    Downsamples an image by the mean of factor x factor blocks, in integer arithmetic. Rows and
+    columns left over at the bottom and right edges are dropped.
+
+    Parameters
+    ----------
+    image: np.ndarray
+        2D integer image.
+    factor: int
+        Side of the blocks, 1 returns the image itself.
+
+    Returns
+    -------
+    np.ndarray
+        Binned image of the same dtype, factor times smaller in each dimension.
+    """
+
+    if factor == 1:
+        return image
+    height, width = image.shape[0] // factor * factor, image.shape[1] // factor * factor
+    blocks = image[:height, :width].reshape(height // factor, factor, width // factor, factor)
+    sums = blocks.sum(axis=(1, 3), dtype=np.uint32)
+    sums //= factor * factor
+    return sums.astype(image.dtype)
 
 # Abstraction for segmentation
 class ImageSegmentation():
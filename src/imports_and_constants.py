@@ -16,21 +16,102 @@
 
 import numpy as np
 import sys
-import cv2
 import time
-from PyQt5.QtWidgets import QApplication, QLabel, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QSplashScreen, QMessageBox
-from PyQt5.QtCore import QThread, pyqtSignal, pyqtSlot, Qt, QTimer
-from PyQt5.QtGui import QImage, QPixmap, QFont
-import matplotlib.pyplot as plt
 import threading
-import sys
 import os
-from scipy.ndimage import binary_hit_or_miss
-import scipy.ndimage
+import types
+import importlib
 import importlib.util
 
-import pycromanager
-from pycromanager import Core
+# ---- Lazy imports ----#
+
+# Heavy modules are bound to stand-ins that import them on first use. Star imports copy the
+# stand-in itself, so every module shares it and the real import happens once, when first needed
+# or when preload_modules warms it up in the background during startup. PyQt5 is imported by the
+# GUI modules (gui.py, threads.py) only, so the tracking engine can run without it.
+class LazyModule(types.ModuleType):
+
+    def __init__(self, name: str, imports: tuple = None):
+        """ 
+        Initializes a stand-in for a module.
+
+        Parameters
+        ----------
+        name: str
+            Module the stand-in resolves to, e.g. "scipy".
+        imports: tuple
+            Modules to import when it is first used, defaults to name. Submodules like
+            "scipy.ndimage" make sure they are available as attributes of the package.
+
+        Returns
+        -------
+        None
+        """
+
+        super().__init__(name)
+        self.__dict__["_lazy_imports"] = imports if imports is not None else (name,)
+        self.__dict__["_lazy_module"] = None
+
+    def load(self) -> types.ModuleType:
+        """ 
+        Imports the module if it has not been yet.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        types.ModuleType
+            The real module.
+        """
+
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            for name in self.__dict__["_lazy_imports"]:
+                importlib.import_module(name)
+            module = sys.modules[self.__name__]
+            self.__dict__["_lazy_module"] = module
+        return module
+
+    def is_loaded(self) -> bool:
+        return self.__dict__["_lazy_module"] is not None
+
+    def __getattr__(self, attribute: str):
+        return getattr(self.load(), attribute)
+
+    def __dir__(self):
+        return dir(self.load())
+
+    def __repr__(self):
+        return "<lazy module " + repr(self.__name__) + (" (loaded)>" if self.is_loaded() else ">")
+
+def preload_modules(*modules: LazyModule) -> threading.Thread:
+    """ 
+    Imports lazy modules in a background thread, so they are ready by the time they are used.
+
+    Parameters
+    ----------
+    modules: LazyModule
+        Modules to import, in order.
+
+    Returns
+    -------
+    threading.Thread
+        The thread importing them.
+    """
+
+    def load_all():
+        for module in modules:
+            module.load()
+
+    thread = threading.Thread(target=load_all, name="preload_modules", daemon=True)
+    thread.start()
+    return thread
+
+cv2 = LazyModule("cv2")
+scipy = LazyModule("scipy", ("scipy.ndimage",))
+pycromanager = LazyModule("pycromanager")
 
 # ---- Set to True if attached to microscope, False for debugging ----#
 
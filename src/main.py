@@ -12,74 +12,132 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import time
+launch_time = time.perf_counter() # Startup is measured from here, before the imports
+
 from imports_and_constants import *
 from threads import *
 from gui import *
 from hardware_wrappers import *
+from startup import StartupTimer, connect_hardware
+from profiler import install_signal_trigger
+from camera_roi import RoiManager
 
 # ---- Main Function ----#
 
 if __name__ == "__main__":
+    startup_timer = StartupTimer(launch_time)
+    startup_timer.mark("Imports")
+
+    # Load the image processing modules in the background while Qt and the hardware start up
+    preload_modules(cv2, scipy)
+
     app = QApplication(sys.argv)
 
     splash = SplashScreen()
     splash.show()
-    time.sleep(1)
-    splash.close()
-
-    # global live_stream_wrap
-    live_stream_wrap = LiveStreamWrapper(microscope_online)
-
-    # Check to make sure the livestream is open first, this makes image capture faster
-    if live_stream_wrap.get_is_live_mode_on() == False:
-        print("Turn on the livestream before running our program!")
-        QMessageBox.critical(None,"Error","Turn on the livestream before running our program!")
-        sys.exit()
+    splash.show_progress("Connecting to MicroManager", 1, 7)
+
+    if len(sys.argv) == 3 and sys.argv[1] == "--replay":
+        # Replay a recorded session in real time instead of the live stream
+        from replay import open_replay
+        live_stream_wrap, core_wrap = open_replay(sys.argv[2])
+    else:
+        # Core and LiveStreamManager connect at the same time
+        live_stream_wrap, core_wrap = connect_hardware(microscope_online)
+
+        # Check to make sure the livestream is open first, this makes image capture faster
+        if live_stream_wrap.get_is_live_mode_on() == False:
+            print("Turn on the livestream before running our program!")
+            splash.close()
+            QMessageBox.critical(None,"Error","Turn on the livestream before running our program!")
+            sys.exit()
 
     ref_time = time.time()
-
-    # global core_wrap
-    core_wrap = CoreWrapper(microscope_online)
+    startup_timer.mark("Core and LiveStreamManager")
     print("Initialization 1/7: Core and LiveStreamManager initialized")
+    splash.show_progress("Changing livestream ROI", 2, 7)
 
     if microscope_online:
         live_stream_wrap.set_live_mode_on(False)
         core_wrap.set_roi(0,512,2048,1024)
         live_stream_wrap.set_live_mode_on(True)
+    # Camera readout shared by the computer vision and the display. On the microscope it narrows to the
+    # tracked panel and follows the specimen, a replay or detached run always has full frames
+    roi_manager = RoiManager(core_wrap, live_stream_wrap, adaptive=microscope_online)
+    startup_timer.mark("Livestream ROI")
     print("Initialization 2/7: Livestream ROI Changed")
+    splash.show_progress("Creating main window", 3, 7)
 
     # Create the main window
     window = MainWindow(core_wrap,live_stream_wrap,microscope_online)
+    startup_timer.mark("Main window")
     print("Initialization 3/7: Main Window Created")
+    splash.show_progress("Starting image grab and display threads", 4, 7)
 
     # Initialize and start the grab image thread
-    grab_image_thread = ImageGrabThread(live_stream_wrap, microscope_online) # New parameter
-    grab_image_thread.frame_ready.connect(window.update_image) # Sends captured image to MainWindow
+    grab_image_thread = ImageGrabThread(live_stream_wrap, microscope_online, roi_manager) # New parameter
     window.grab_image_thread = grab_image_thread
+
+    # Initialize and start the display thread, it prepares the preview panels for MainWindow off the GUI thread
+    # and refreshes them at most DISPLAY_MAX_FPS times a second, dropping the frames in between
+    display_thread = DisplayThread(DISPLAY_MAX_FPS, roi_manager)
+    grab_image_thread.worker.subscribe("frame", display_thread.worker.receive_frame) # Sends captured image to the display thread
+    display_thread.display_ready.connect(window.update_display)
+    window.display_thread = display_thread
+    display_thread.start()
+
+    # Report the startup time once the first frame arrives
+    def first_frame(frame):
+        grab_image_thread.worker.unsubscribe("frame", first_frame)
+        seconds = startup_timer.mark("First frame")
+        print("Time to first frame: " + str(round(seconds, 3)) + " s\n" + startup_timer.report())
+    grab_image_thread.worker.subscribe("frame", first_frame)
+
     grab_image_thread.start()
-    print("Initialization 4/7: Grab Image Thread Started")
+    print("Initialization 4/7: Grab Image and Display Threads Started")
+    splash.show_progress("Starting computer vision thread", 5, 7)
 
     # Initialize and start the computer vision thread
-    computer_vision_thread = ComputerVisionThread(core_wrap, microscope_online)
-    grab_image_thread.frame_ready.connect(computer_vision_thread.receive_frame) # Sends captured image to ComputerVisionThread
-    computer_vision_thread.result_ready.connect(window.update_segmented_image) # Sends segmented image to MainWindow
-    computer_vision_thread.skeleton_ready.connect(window.update_skeleton_image)  # Sends skeleton image to MainWindow
+    computer_vision_thread = ComputerVisionThread(core_wrap, microscope_online, roi_manager, grab_image_thread.worker.tracking_binning)
+    # Frames go straight from the grab worker to the computer vision worker, not through the GUI event loop,
+    # so tracking keeps the camera rate however slowly the display refreshes. It gets the binned raw frame,
+    # the full resolution 8 bit frame is only made for the display
+    grab_image_thread.worker.subscribe("tracking_frame", computer_vision_thread.worker.receive_frame) # Sends captured image to ComputerVisionThread
+    computer_vision_thread.worker.subscribe("segmented", display_thread.worker.receive_segmented) # Sends segmented image to the display thread
+    computer_vision_thread.worker.subscribe("track_image", display_thread.worker.receive_track_image) # Sends skeleton image to the display thread
     window.computer_vision_thread = computer_vision_thread
     computer_vision_thread.start()
     print("Initialization 5/7: Computer Vision-Segmentation Thread Started")
+    splash.show_progress("Starting track thread", 6, 7)
 
     # Initialize and start the track thread
     track_thread = TrackThread(core_wrap, microscope_online)
     track_thread.cur_coordinates_ready.connect(window.update_coordinates)
-    computer_vision_thread.tracking_ready.connect(track_thread.receive_tracking_pointer) # Sends tracking coordinates from ComputerVisionThread to TrackThread
+    # Targets go straight from the computer vision worker to the track worker as well, painting never holds them up
+    track_thread.worker.follow(computer_vision_thread.worker) # Sends tracking coordinates from ComputerVisionThread to TrackThread
     window.track_thread = track_thread
     track_thread.start()
     print("Initialization 6/7: Track Thread Started")
+    splash.show_progress("Showing GUI", 7, 7)
+
+    # Watchdog restarting a stage that stalls, dies or keeps failing, its health is shown in the GUI
+    supervisor = Supervisor()
+    supervisor.watch("Grab", grab_image_thread.worker, WatchPolicy(stall_after=2.0, output_event="frame", silent_after=2.0))
+    supervisor.watch("CV", computer_vision_thread.worker, WatchPolicy(stall_after=3.0, max_errors=20, error_window=5.0))
+    supervisor.watch("Track", track_thread.worker, WatchPolicy(stall_after=1.0))
+    supervisor.watch("Display", display_thread.worker, WatchPolicy(stall_after=2.0))
+    window.supervisor = supervisor
+    supervisor.start()
+
+    # Profiles can also be taken without the GUI with: kill -USR1 <pid>
+    install_signal_trigger()
 
     # Show the main window
     window.show()
+    splash.finish(window)
+    startup_timer.mark("GUI shown")
     print("Initialization 7/7: Show GUI to User")
 
     # Start the GUI event loop
     sys.exit(app.exec_())
-
@@ -0,0 +1,134 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Lightweight pipeline metrics. Workers update counters, timings and gauges with a dictionary update
+# and no lock, each metric having a single writer. Readers such as the GUI dashboard call sample()
+# now and then, which turns counters into rates and keeps a short history of every metric:
+#
+#     metrics.count("frames_captured")
+#     metrics.observe("cv_latency", seconds)
+#     metrics.set_gauge("display_queue", 1)
+#     values = metrics.sample()  # {"frames_captured": 29.7, "cv_latency": 0.093, ...}
+
+from imports_and_constants import *
+from collections import deque
+
+# ---- Registry ----#
+
+class MetricsRegistry():
+
+    def __init__(self, history: int = 120):
+        """
+        Initializes an empty registry.
+
+        Parameters
+        ----------
+        history: int
+            Number of samples kept per metric.
+
+        Returns
+        -------
+        None
+        """
+
+        self.history_length = history
+        self.counters = {}
+        self.timings = {}
+        self.gauges = {}
+        self.histories = {}
+        self.last_counters = {}
+        self.last_sample = None
+        self.lock = threading.Lock() # Only taken by readers
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, name: str, value: float):
+        # Timings are averaged over each sample interval, [total, count]
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [value, 1]
+        else:
+            timing[0] += value
+            timing[1] += 1
+
+    def set_gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def sample(self, now: float = None) -> dict:
+        """
+        Reads every metric and appends it to its history. Counters become rates per second since
+        the previous sample, timings the mean of the values observed since then, None if there were
+        none, and gauges their current value.
+
+        Parameters
+        ----------
+        now: float
+            Current time from time.perf_counter(), defaults to now.
+
+        Returns
+        -------
+        dict
+            Metric name to sampled value.
+        """
+
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            values = {}
+            elapsed = None if self.last_sample is None else now - self.last_sample
+            for name, total in list(self.counters.items()):
+                previous = self.last_counters.get(name, 0)
+                if elapsed is None or elapsed <= 0:
+                    values[name] = 0.0
+                else:
+                    values[name] = (total - previous) / elapsed
+                self.last_counters[name] = total
+
+            for name in list(self.timings):
+                timing = self.timings[name]
+                total, count = timing
+                if count:
+                    values[name] = total / count
+                    timing[0] -= total
+                    timing[1] -= count
+                else:
+                    values[name] = None
+
+            values.update(self.gauges)
+            self.last_sample = now
+
+            for name, value in values.items():
+                if name not in self.histories:
+                    self.histories[name] = deque(maxlen=self.history_length)
+                self.histories[name].append(value)
+            return values
+
+    def history(self, name: str) -> list:
+        with self.lock:
+            return list(self.histories.get(name, ()))
+
+    def total(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.timings.clear()
+            self.gauges.clear()
+            self.histories.clear()
+            self.last_counters.clear()
+            self.last_sample = None
+
+# Registry shared by the pipeline workers and the GUI
+metrics = MetricsRegistry()
@@ -0,0 +1,181 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Jerk-limited velocity profiles for the stage. The controller's velocity jumps from one step to the
+# next, the profile turns them into a trajectory whose acceleration ramps up and down at a bounded
+# rate, so the stage moves without shocks and frames blur less. A reversal passes through an explicit
+# zero command, so the SDK stops the old movement before starting the new one:
+#
+#     profile = MotionProfile()
+#     x_velocity, y_velocity = profile.update((x_request, y_request), dt)
+
+from imports_and_constants import *
+import math
+
+PROFILE_MAX_VELOCITY = 1000.0 # Largest velocity on either axis
+PROFILE_MAX_ACCELERATION = 5000.0 # Largest acceleration on either axis, per second
+PROFILE_MAX_JERK = 50000.0 # Largest change of acceleration on either axis, per second
+
+# ---- Profile ----#
+
+# MotionProfile is an object that follows requested velocities with bounded acceleration and jerk
+class MotionProfile():
+
+    def __init__(self, max_velocity: float = PROFILE_MAX_VELOCITY, max_acceleration: float = PROFILE_MAX_ACCELERATION,
+                 max_jerk: float = PROFILE_MAX_JERK, axes: int = 2):
+        """
+        Initializes a profile at rest.
+
+        Parameters
+        ----------
+        max_velocity: float
+            Largest velocity on either axis.
+        max_acceleration: float
+            Largest acceleration on either axis, velocity per second.
+        max_jerk: float
+            Largest change of acceleration on either axis, acceleration per second.
+        axes: int
+            Number of axes.
+
+        Returns
+        -------
+        None
+        """
+
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.max_jerk = max_jerk
+        self.velocity = [0.0] * axes
+        self.acceleration = [0.0] * axes
+
+    def reset(self, velocity: tuple = None):
+        # Back to rest, or to a known velocity with no acceleration, e.g. after an emergency stop
+        self.velocity = [0.0] * len(self.velocity) if velocity is None else [float(v) for v in velocity]
+        self.acceleration = [0.0] * len(self.velocity)
+
+    def step_axis(self, velocity: float, acceleration: float, target: float, dt: float) -> tuple:
+        """
+        Advances one axis by dt towards a target velocity.
+
+        Parameters
+        ----------
+        velocity: float
+            Current velocity.
+        acceleration: float
+            Current acceleration.
+        target: float
+            Requested velocity, already clamped to max_velocity.
+        dt: float
+            Time step, in seconds.
+
+        Returns
+        -------
+        tuple
+            (velocity, acceleration) after the step.
+        """
+
+        error = target - velocity
+        if error == 0:
+            # On target, let the acceleration ramp down
+            change = min(abs(acceleration), self.max_jerk * dt)
+            return velocity, acceleration - math.copysign(change, acceleration)
+
+        # Largest acceleration that can still ramp down to zero by the time the target is reached
+        desired = math.copysign(min(self.max_acceleration, math.sqrt(2 * self.max_jerk * abs(error))), error)
+        change = min(max(desired - acceleration, -self.max_jerk * dt), self.max_jerk * dt)
+        acceleration += change
+        new_velocity = velocity + acceleration * dt
+
+        # Land on the target instead of overshooting it
+        if (target - new_velocity) * error <= 0:
+            return target, 0.0
+        return new_velocity, acceleration
+
+    def update(self, targets: tuple, dt: float) -> tuple:
+        """
+        Advances the profile by dt towards the requested velocities.
+
+        Parameters
+        ----------
+        targets: tuple
+            Requested velocity of each axis.
+        dt: float
+            Time since the last update, in seconds.
+
+        Returns
+        -------
+        tuple
+            Velocity of each axis to command. An axis changing direction is commanded 0 for one step.
+        """
+
+        dt = max(dt, 0.0)
+        for axis, target in enumerate(targets):
+            target = min(max(target, -self.max_velocity), self.max_velocity)
+            velocity, acceleration = self.step_axis(self.velocity[axis], self.acceleration[axis], target, dt)
+            if velocity * self.velocity[axis] < 0:
+                velocity = 0.0 # Stop before reversing, the acceleration carries on through zero
+            self.velocity[axis] = velocity
+            self.acceleration[axis] = acceleration
+        return tuple(self.velocity)
+
+# ---- Simulated stage ----#
+
+# SimulatedStage is an object that stands in for MoveStage.drive_stage and integrates the commanded velocities
+class SimulatedStage():
+
+    def __init__(self):
+        self.position = [0.0, 0.0]
+        self.velocity = (0.0, 0.0)
+        self.last_time = None
+        self.commands = [] # (time, x velocity, y velocity) of every command
+        self.reversals_without_stop = 0 # Commands that flipped an axis without stopping it first
+
+    def drive_stage(self, x_vel: float, y_vel: float, prev_x_vel: int, prev_y_vel: int, microscope_online: bool, now: float = None):
+        """
+        Takes a command with the signature of MoveStage.drive_stage.
+
+        Parameters
+        ----------
+        x_vel: float
+            X Velocity
+        y_vel: float
+            Y Velocity
+        prev_x_vel: int
+            Previous X direction
+        prev_y_vel: int
+            Previous Y direction
+        microscope_online: bool
+            Ignored, the stage is simulated.
+        now: float
+            Time of the command, defaults to time.perf_counter().
+
+        Returns
+        -------
+        None
+        """
+
+        now = time.perf_counter() if now is None else now
+        self.advance(now)
+        for old, new in zip(self.velocity, (x_vel, y_vel)):
+            if old * new < 0:
+                self.reversals_without_stop += 1
+        self.velocity = (x_vel, y_vel)
+        self.commands.append((now, x_vel, y_vel))
+
+    def advance(self, now: float):
+        # Moves the stage at its current velocity up to now
+        if self.last_time is not None:
+            for axis in range(2):
+                self.position[axis] += self.velocity[axis] * (now - self.last_time)
+        self.last_time = now
@@ -0,0 +1,289 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# On-demand sampling profiler for a running session. A background thread reads the stack of every
+# Python thread (grab, computer vision, tracker, display and the GUI thread) a few hundred times a
+# second with sys._current_frames, so nothing has to be restarted and the threads being profiled
+# are not slowed down by tracing. It writes the stacks in the collapsed format read by flamegraph.pl
+# and speedscope, and a per-function summary:
+#
+#     profiler = SamplingProfiler()
+#     profiler.start()
+#     ...
+#     profiler.stop()
+#     collapsed_path, summary_path = profiler.save("../profiles")
+
+from imports_and_constants import *
+import datetime
+import signal
+
+default_profile_seconds = 10
+default_profile_directory = os.path.join("..", "profiles")
+
+# ---- Thread names ----#
+
+# QThreads are not known to the threading module, so the workers name the thread they run in
+thread_names = {}
+
+def name_current_thread(name: str):
+    thread_names[threading.get_ident()] = name
+
+def thread_name(ident: int) -> str:
+    if ident in thread_names:
+        return thread_names[ident]
+    if ident == threading.main_thread().ident:
+        return "GUI"
+    for thread in threading.enumerate():
+        if thread.ident == ident:
+            return thread.name
+    return "Thread-" + str(ident)
+
+# ---- Profiler ----#
+
+class SamplingProfiler():
+
+    def __init__(self, interval: float = 0.005, threads: tuple = None):
+        """
+        Initializes the profiler.
+
+        Parameters
+        ----------
+        interval: float
+            Time between samples in seconds.
+        threads: tuple
+            Names of the threads to sample, all of them if None.
+
+        Returns
+        -------
+        None
+        """
+
+        self.interval = interval
+        self.threads = threads
+        self.stacks = {} # (thread name, frames from the outermost) to number of samples
+        self.num_samples = 0
+        self.started = None
+        self.seconds = 0.0
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def frame_label(frame) -> str:
+        code = frame.f_code
+        return code.co_name + " (" + os.path.basename(code.co_filename) + ":" + str(code.co_firstlineno) + ")"
+
+    def sample(self):
+        """
+        Records the current stack of every sampled thread once.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        own_ident = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == own_ident:
+                continue
+            name = thread_name(ident)
+            if self.threads is not None and name not in self.threads:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(SamplingProfiler.frame_label(frame))
+                frame = frame.f_back
+            key = (name, tuple(reversed(labels)))
+            self.stacks[key] = self.stacks.get(key, 0) + 1
+        self.num_samples += 1
+
+    def run(self):
+        name_current_thread("SamplingProfiler")
+        while not self.stop_event.wait(self.interval):
+            self.sample()
+        self.seconds = time.perf_counter() - self.started
+
+    def start(self, seconds: float = None):
+        """
+        Starts sampling in a daemon thread.
+
+        Parameters
+        ----------
+        seconds: float
+            Stops by itself after this long, None to sample until stop() is called.
+
+        Returns
+        -------
+        None
+        """
+
+        if self.is_running():
+            return
+        self.stop_event.clear()
+        self.started = time.perf_counter()
+        self.thread = threading.Thread(target=self.run, name="SamplingProfiler", daemon=True)
+        self.thread.start()
+        if seconds is not None:
+            timer = threading.Timer(seconds, self.stop_event.set)
+            timer.daemon = True
+            timer.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join()
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    # ---- Results ----#
+
+    def collapsed(self) -> list:
+        """
+        Stacks in the collapsed format: "thread;outer;...;inner count", one line per stack.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            Lines sorted by stack.
+        """
+
+        lines = []
+        for (name, labels), count in self.stacks.items():
+            lines.append(";".join((name,) + labels) + " " + str(count))
+        return sorted(lines)
+
+    def summary(self) -> list:
+        """
+        Per-function totals over all sampled threads.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        list
+            One dict per (thread, function) with "thread", "function", "self" samples (the
+            function was running) and "total" samples (it was on the stack), most total first.
+        """
+
+        functions = {}
+        for (name, labels), count in self.stacks.items():
+            for label in set(labels):
+                functions.setdefault((name, label), {"thread": name, "function": label, "self": 0, "total": 0})["total"] += count
+            if labels:
+                functions[(name, labels[-1])]["self"] += count
+        return sorted(functions.values(), key=lambda row: (-row["total"], -row["self"], row["function"]))
+
+    def thread_samples(self) -> dict:
+        samples = {}
+        for (name, labels), count in self.stacks.items():
+            samples[name] = samples.get(name, 0) + count
+        return samples
+
+    def format_summary(self, limit: int = 40) -> str:
+        """
+        Summary as text, the busiest functions of every thread.
+
+        Parameters
+        ----------
+        limit: int
+            Functions listed per thread.
+
+        Returns
+        -------
+        str
+            Text table.
+        """
+
+        lines = [str(self.num_samples) + " samples over " + str(round(self.seconds, 2)) + " s, every " +
+                 str(round(self.interval * 1000, 1)) + " ms"]
+        rows = self.summary()
+        for name, samples in sorted(self.thread_samples().items(), key=lambda item: -item[1]):
+            lines.append("")
+            lines.append(name + " (" + str(samples) + " samples)")
+            lines.append("   self %  total %  function")
+            for row in [row for row in rows if row["thread"] == name][:limit]:
+                lines.append("{:8.1f} {:8.1f}  {}".format(100 * row["self"] / samples, 100 * row["total"] / samples, row["function"]))
+        return "\n".join(lines) + "\n"
+
+    def save(self, directory: str = default_profile_directory, prefix: str = "profile") -> tuple:
+        """
+        Writes the collapsed stacks and the summary, named after the current time.
+
+        Parameters
+        ----------
+        directory: str
+            Output folder, created if needed.
+        prefix: str
+            Start of the file names.
+
+        Returns
+        -------
+        tuple
+            (collapsed stacks path, summary path).
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        name = prefix + "_" + datetime.datetime.now().strftime("%m%d%Y_%H%M%S")
+        collapsed_path = os.path.join(directory, name + ".collapsed")
+        summary_path = os.path.join(directory, name + ".txt")
+        with open(collapsed_path, "w") as f:
+            f.write("\n".join(self.collapsed()) + "\n")
+        with open(summary_path, "w") as f:
+            f.write(self.format_summary())
+        return collapsed_path, summary_path
+
+# ---- Trigger from outside the GUI ----#
+
+def install_signal_trigger(seconds: float = default_profile_seconds, directory: str = default_profile_directory):
+    """
+    Profiles the whole program for a few seconds whenever it receives SIGUSR1 (kill -USR1 <pid>),
+    on systems that have that signal.
+
+    Parameters
+    ----------
+    seconds: float
+        Length of each profile.
+    directory: str
+        Output folder.
+
+    Returns
+    -------
+    bool
+        True if the trigger was installed.
+    """
+
+    if not hasattr(signal, "SIGUSR1"):
+        return False
+
+    def profile_and_save():
+        profiler = SamplingProfiler()
+        profiler.start(seconds)
+        profiler.thread.join()
+        print("Profile written to " + ", ".join(profiler.save(directory)))
+
+    def handler(signum, frame):
+        threading.Thread(target=profile_and_save, name="ProfileTrigger", daemon=True).start()
+
+    signal.signal(signal.SIGUSR1, handler)
+    return True
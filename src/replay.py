@@ -0,0 +1,286 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Offline replay of recorded sessions through the tracking pipeline. Every frame goes through the
+# same binning, crop, segmentation, coordinate conversion and controller as the live threads, and the
+# report compares the targets produced with where the stage actually went in the recording:
+#
+#     python replay.py ../recordings/recording_05062024_101500 --output replay.json
+#     python replay.py ../recordings/recording_05062024_101500 --baseline replay.json
+#
+# The GUI can also be started on a recording with: python main.py --replay <recording>
+
+from imports_and_constants import *
+from hardware_wrappers import *
+from image_processing import *
+from tracking_engine import FrameGrabber, FrameSegmenter, StageTracker
+import json
+import math
+import click
+
+# Recording reader lives with the recording scripts
+scripts_path = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "scripts"))
+if scripts_path not in sys.path:
+    sys.path.append(scripts_path)
+from recording_reader import Recording
+
+# ---- Replay ----#
+
+def open_replay(path: str, realtime: bool = True, loop: bool = True) -> tuple:
+    """
+    Opens a recorded session as a stand in for the live stream and the core.
+
+    Parameters
+    ----------
+    path: str
+        TIFF recording folder or HDF5 video.
+    realtime: bool
+        If true, frames are served at their recorded times.
+    loop: bool
+        If true, the replay starts over at the end of the recording.
+
+    Returns
+    -------
+    tuple
+        (ReplayStreamWrapper, ReplayCoreWrapper)
+    """
+
+    live_stream_wrap = ReplayStreamWrapper(Recording(path), realtime=realtime, loop=loop)
+    core_wrap = ReplayCoreWrapper(live_stream_wrap)
+    return live_stream_wrap, core_wrap
+
+def replay_session(recording, realtime: bool = False, track_right: bool = True, inverse: bool = False,
+                   lag: int = 1, start_index: int = 0, stop_index: int = None,
+                   progress_callback = None) -> dict:
+    """
+    Runs every frame of a recording through the tracking pipeline and reports on the targets produced.
+
+    Parameters
+    ----------
+    recording: Recording
+        Recorded session with its recording log.
+    realtime: bool
+        If true, frames are paced at their recorded times, otherwise processed as fast as possible.
+    track_right: bool
+        Tracks the right panel if true, the left panel otherwise.
+    inverse: bool
+        Uses inverted segmentation if true.
+    lag: int
+        Number of frames after a frame at which the recorded stage position is compared to its target.
+    start_index: int
+        First frame to replay.
+    stop_index: int
+        Frame to stop before, defaults to the end of the recording.
+    progress_callback: callable
+        Called with (frames done, total frames) after every frame.
+
+    Returns
+    -------
+    dict
+        Report, see summarize_replay. Its "frames" list holds per frame results.
+    """
+
+    live_stream_wrap = ReplayStreamWrapper(recording, realtime=realtime, start_index=start_index, stop_index=stop_index)
+    core_wrap = ReplayCoreWrapper(live_stream_wrap)
+    frame_grabber = FrameGrabber(live_stream_wrap, False)
+    segmenter = FrameSegmenter(core_wrap, False, interval=0, binning=frame_grabber.tracking_binning)
+    segmenter.track_right = track_right
+    segmenter.roi_manager.set_track_right(track_right)
+    segmenter.inverse = inverse
+    targets = []
+    segmenter.subscribe("target", targets.append)
+    get_stage_coords = GetStageCoords(core_wrap, False)
+
+    frames = []
+    s = time.perf_counter()
+    for count in range(live_stream_wrap.num_frames):
+        # Same steps as the tracking engine, the binned raw frame through the segmenter's crop, change
+        # detection and coordinate conversion, one frame at a time so none is skipped
+        tracking_frame = bin_image(frame_grabber.grab_raw(), frame_grabber.tracking_binning)
+        x_cur_pos = get_stage_coords.get_x_coord()
+        y_cur_pos = get_stage_coords.get_y_coord()
+        result = {"frame": live_stream_wrap.index, "stage": [x_cur_pos, y_cur_pos]}
+
+        cv_s = time.perf_counter()
+        targets.clear()
+        segmenter.receive_frame(tracking_frame)
+        if not segmenter.frame_event.is_set():
+            result["error"] = "Frame does not match the camera readout"
+        else:
+            segmenter.step()
+            if targets and isinstance(targets[-1], int) and targets[-1] == -1:
+                result["error"] = repr(segmenter.last_error)
+            elif targets:
+                head_coordinates, cart_coords = segmenter.last_result[3], targets[-1]
+                result["pixel"] = [int(head_coordinates[0]), int(head_coordinates[1])]
+                result["target"] = [float(cart_coords[0]), float(cart_coords[1])]
+                result["velocity"] = [float(v) for v in StageTracker.compute_velocity(cart_coords, x_cur_pos, y_cur_pos)]
+        result["cv_ms"] = (time.perf_counter() - cv_s) * 1000
+
+        frames.append(result)
+        if progress_callback is not None:
+            progress_callback(count + 1, live_stream_wrap.num_frames)
+    seconds = time.perf_counter() - s
+
+    report = summarize_replay(frames, core_wrap, lag, seconds)
+    report.update(recording=getattr(recording, "path", None), realtime=realtime, track_right=track_right, inverse=inverse)
+    return report
+
+def summary_stats(values) -> dict:
+    if len(values) == 0:
+        return {"mean": None, "median": None, "p95": None, "max": None}
+    values = np.asarray(values, dtype=float)
+    return {"mean": float(values.mean()), "median": float(np.median(values)),
+            "p95": float(np.percentile(values, 95)), "max": float(values.max())}
+
+def summarize_replay(frames: list, core_wrap: ReplayCoreWrapper, lag: int, seconds: float) -> dict:
+    """
+    Builds the replay report. The recording only logs where the stage was, so each target is
+    compared with the recorded stage position lag frames later, where the live tracker got to.
+
+    Parameters
+    ----------
+    frames: list
+        Per frame results from replay_session.
+    core_wrap: ReplayCoreWrapper
+        Replayed stage holding the logged positions.
+    lag: int
+        Frames between a target and the recorded position it is compared with.
+    seconds: float
+        Duration of the replay.
+
+    Returns
+    -------
+    dict
+        Frame counts, replay rate, computer vision time and target error statistics.
+    """
+
+    tracked = [frame for frame in frames if "target" in frame]
+    target_errors = []
+    if core_wrap.positions is not None:
+        for frame in tracked:
+            index = frame["frame"] + lag
+            if index < len(core_wrap.positions):
+                x_pos, y_pos = core_wrap.get_position(index)
+                target_errors.append(math.hypot(frame["target"][0] - x_pos, frame["target"][1] - y_pos))
+
+    return {
+        "num_frames": len(frames),
+        "tracked": len(tracked),
+        "lost": sum(1 for frame in frames if "target" not in frame and "error" not in frame),
+        "errors": sum(1 for frame in frames if "error" in frame),
+        "seconds": seconds,
+        "fps": len(frames) / seconds if seconds > 0 else 0,
+        "cv_ms": summary_stats([frame["cv_ms"] for frame in frames]),
+        "lag": lag,
+        "target_error": dict(summary_stats(target_errors), compared=len(target_errors)),
+        "frames": frames,
+    }
+
+def compare_reports(report: dict, baseline: dict) -> dict:
+    """
+    Compares the targets of two replays of the same recording frame by frame, e.g. before and
+    after a change to the segmentation.
+
+    Parameters
+    ----------
+    report: dict
+        Report of the new replay.
+    baseline: dict
+        Report of the reference replay.
+
+    Returns
+    -------
+    dict
+        Distance between matching targets and the frames only one of the replays tracked.
+    """
+
+    baseline_frames = {frame["frame"]: frame for frame in baseline["frames"]}
+    shifts = []
+    newly_lost = []
+    newly_tracked = []
+    for frame in report["frames"]:
+        reference = baseline_frames.get(frame["frame"])
+        if reference is None:
+            continue
+        if "target" in frame and "target" in reference:
+            shifts.append(math.hypot(frame["target"][0] - reference["target"][0],
+                                     frame["target"][1] - reference["target"][1]))
+        elif "target" in reference:
+            newly_lost.append(frame["frame"])
+        elif "target" in frame:
+            newly_tracked.append(frame["frame"])
+
+    return {
+        "compared": len(shifts),
+        "target_shift": summary_stats(shifts),
+        "newly_lost": newly_lost,
+        "newly_tracked": newly_tracked,
+        "target_error_change": None if report["target_error"]["mean"] is None or baseline["target_error"]["mean"] is None
+                               else report["target_error"]["mean"] - baseline["target_error"]["mean"],
+    }
+
+def describe_stats(stats: dict, unit: str) -> str:
+    if stats["mean"] is None:
+        return "n/a"
+    return ("mean " + str(round(stats["mean"], 2)) + unit + ", median " + str(round(stats["median"], 2)) + unit +
+            ", p95 " + str(round(stats["p95"], 2)) + unit + ", max " + str(round(stats["max"], 2)) + unit)
+
+# ---- Command line ----#
+
+@click.command()
+@click.argument("recording_path", type=click.Path(exists=True))
+@click.option("--realtime", is_flag=True, help="Pace frames at their recorded times instead of as fast as possible.")
+@click.option("--track-left", is_flag=True, help="Track the left panel instead of the right one.")
+@click.option("--inverse", is_flag=True, help="Use inverted segmentation.")
+@click.option("--lag", type=click.IntRange(0), default=1, show_default=True,
+              help="Frames between a target and the recorded stage position it is compared with.")
+@click.option("--start", "start_index", type=click.IntRange(0), default=0, help="First frame to replay.")
+@click.option("--stop", "stop_index", type=click.IntRange(0), default=None, help="Frame to stop before.")
+@click.option("--output", type=click.Path(dir_okay=False), default=None, help="Write the report as JSON.")
+@click.option("--baseline", type=click.Path(exists=True, dir_okay=False), default=None,
+              help="JSON report of an earlier replay to compare the targets with.")
+def replay_command(recording_path, realtime, track_left, inverse, lag, start_index, stop_index, output, baseline):
+    """Replay a recorded session through the tracking pipeline and report on the targets."""
+
+    def progress(done, total):
+        if done % 500 == 0 or done == total:
+            click.echo(str(done) + "/" + str(total) + " frames")
+
+    with Recording(recording_path) as recording:
+        if recording.positions is None:
+            click.echo("No recording log found, targets can't be compared with the recorded stage positions")
+        report = replay_session(recording, realtime=realtime, track_right=not track_left, inverse=inverse, lag=lag,
+                                start_index=start_index, stop_index=stop_index, progress_callback=progress)
+
+    click.echo("Replayed " + str(report["num_frames"]) + " frames at " + str(round(report["fps"], 1)) + " fps: " +
+               str(report["tracked"]) + " tracked, " + str(report["lost"]) + " lost, " + str(report["errors"]) + " errors")
+    click.echo("Computer vision time: " + describe_stats(report["cv_ms"], " ms"))
+    click.echo("Target error vs recorded stage " + str(lag) + " frame(s) later: " + describe_stats(report["target_error"], ""))
+
+    if baseline is not None:
+        with open(baseline, 'r') as file:
+            comparison = compare_reports(report, json.load(file))
+        report["baseline"] = dict(comparison, path=baseline)
+        click.echo("Target shift vs baseline over " + str(comparison["compared"]) + " frames: " +
+                   describe_stats(comparison["target_shift"], ""))
+        click.echo(str(len(comparison["newly_lost"])) + " frames newly lost, " +
+                   str(len(comparison["newly_tracked"])) + " newly tracked")
+
+    if output is not None:
+        with open(output, 'w') as file:
+            json.dump(report, file, indent=1)
+
+if __name__ == "__main__":
+    replay_command()
@@ -0,0 +1,131 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Files shipped with the program (assets and the offline test frame). Paths are resolved from the
+# repository root, so they work on any OS and from any working directory, and arrays are memory
+# mapped once and shared read-only instead of being read from disk on every frame.
+
+from imports_and_constants import *
+
+repo_root = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+# Where the offline frame used in detached mode is looked for, in order
+offline_frame_paths = (("tests", "hongruo.npy"), ("hongruo.npy",), ("src", "hongruo.npy"))
+
+array_cache = {}
+array_cache_lock = threading.Lock()
+
+# ---- Paths ----#
+
+def resource_path(*parts: str) -> str:
+    """
+    Absolute path of a file in the repository.
+
+    Parameters
+    ----------
+    parts: str
+        Path components from the repository root, e.g. ("assets", "cv_error.npy").
+
+    Returns
+    -------
+    str
+        Absolute path.
+    """
+
+    return os.path.join(repo_root, *parts)
+
+def offline_frame_path() -> str:
+    for parts in offline_frame_paths:
+        path = resource_path(*parts)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError("Offline frame hongruo.npy not found, detached mode looks for it in " +
+                            ", ".join(resource_path(*parts) for parts in offline_frame_paths))
+
+# ---- Arrays ----#
+
+def load_array(path: str, mmap: bool = True) -> np.ndarray:
+    """
+    Loads a .npy file once, later calls return the same read-only array.
+
+    Parameters
+    ----------
+    path: str
+        Path of the file.
+    mmap: bool
+        Memory maps the file instead of reading it, so only the parts used are read.
+
+    Returns
+    -------
+    np.ndarray
+        Read-only array.
+    """
+
+    with array_cache_lock:
+        array = array_cache.get(path)
+        if array is None:
+            array = np.load(path, mmap_mode="r" if mmap else None)
+            array.flags.writeable = False
+            array_cache[path] = array
+        return array
+
+def cached_array(key: str, function) -> np.ndarray:
+    """
+    Computes an array once and caches it read-only under key, for arrays derived from resources.
+
+    Parameters
+    ----------
+    key: str
+        Cache key.
+    function: callable
+        Function without arguments returning the array.
+
+    Returns
+    -------
+    np.ndarray
+        Read-only array.
+    """
+
+    with array_cache_lock:
+        array = array_cache.get(key)
+    if array is None:
+        array = np.ascontiguousarray(function())
+        array.flags.writeable = False
+        with array_cache_lock:
+            array = array_cache.setdefault(key, array)
+    return array
+
+def clear_cache():
+    with array_cache_lock:
+        array_cache.clear()
+
+# ---- Resources ----#
+
+def offline_frame() -> np.ndarray:
+    # Full 2048x2048 frame the detached live stream returns
+    return load_array(offline_frame_path())
+
+def offline_image() -> np.ndarray:
+    # Detached ImageGrabber image: the 1024 rows inside the ROI, scaled to 8 bits
+    def scale():
+        reshaped_img = offline_frame()[512:1536,:] # The image would already be cropped
+        return (reshaped_img / reshaped_img.max() * 255).astype("uint8")
+    return cached_array("offline_image", scale)
+
+def error_image() -> np.ndarray:
+    # Shown in the segmentation panels when the computer vision fails
+    return load_array(resource_path("assets", "cv_error.npy"), mmap=False)
+
+def loading_screen_path() -> str:
+    return resource_path("assets", "loading_screen.png")
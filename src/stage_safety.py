@@ -0,0 +1,180 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Safety layer between the tracker and MoveStage. Every velocity command passes through a StageGuard,
+# which fades the command out when the newest target gets old (the computer vision stalled or lost
+# the specimen), clamps it to a maximum velocity and limits how fast it may speed up. Slowing down
+# is never limited, unless a jerk-limited MotionProfile smooths the commands, and stop() always
+# takes effect at once:
+#
+#     guard = StageGuard(microscope_online, profile=MotionProfile())
+#     guard.command(x_velocity, y_velocity, target_age)
+#     guard.stop()
+
+from imports_and_constants import *
+from hardware_wrappers import MoveStage
+from motion_profile import MotionProfile
+from metrics import metrics
+
+STAGE_MAX_VELOCITY = 1000.0 # Largest velocity sent on either axis
+STAGE_MAX_ACCELERATION = 5000.0 # Largest velocity increase per second on either axis
+STAGE_TARGET_MAX_AGE = 0.3 # Targets older than this, in seconds, start fading the command out
+STAGE_TARGET_DECAY = 0.2 # Time over which the command fades to zero after that, in seconds
+
+# StageGuard is an object that sends velocities to the stage within safe limits
+class StageGuard():
+
+    def __init__(self, microscope_online: bool, max_velocity: float = STAGE_MAX_VELOCITY,
+                 max_acceleration: float = STAGE_MAX_ACCELERATION, max_target_age: float = STAGE_TARGET_MAX_AGE,
+                 target_decay: float = STAGE_TARGET_DECAY, drive = None, profile: MotionProfile = None):
+        """
+        Initializes the guard with the stage at rest.
+
+        Parameters
+        ----------
+        microscope_online: bool
+            Boolean variable set to true if microscope is online
+        max_velocity: float
+            Largest velocity sent on either axis.
+        max_acceleration: float
+            Largest velocity increase per second on either axis.
+        max_target_age: float
+            Age of the newest target, in seconds, after which the command fades out.
+        target_decay: float
+            Time the command takes to fade to zero, in seconds, 0 to stop at once.
+        drive: callable
+            Function sending a command, with the signature of MoveStage.drive_stage. Defaults to
+            MoveStage.drive_stage, a simulated stage can be passed instead.
+        profile: MotionProfile
+            Smooths the faded and clamped commands with bounded acceleration and jerk, in both
+            directions. None limits speeding up only, to max_acceleration.
+
+        Returns
+        -------
+        None
+        """
+
+        self.microscope_online = microscope_online
+        self.max_velocity = max_velocity
+        self.max_acceleration = max_acceleration
+        self.max_target_age = max_target_age
+        self.target_decay = target_decay
+        self.drive = drive if drive is not None else MoveStage.drive_stage
+        self.profile = profile
+        self.velocity = (0.0, 0.0) # Last velocity sent
+        self.last_command = None
+        self.prev_x_direction = 1
+        self.prev_y_direction = 1
+        self.lock = threading.Lock() # The GUI thread stops the stage while the tracker thread drives it
+        self.metrics = metrics
+
+    def freshness(self, target_age: float) -> float:
+        """
+        Share of the requested velocity allowed for a target of a given age.
+
+        Parameters
+        ----------
+        target_age: float
+            Seconds since the newest target arrived, None if there never was one.
+
+        Returns
+        -------
+        float
+            1 for a fresh target, falling linearly to 0 over target_decay once it is older than max_target_age.
+        """
+
+        if target_age is None:
+            return 0.0
+        if target_age <= self.max_target_age:
+            return 1.0
+        if self.target_decay <= 0:
+            return 0.0
+        return max(0.0, 1.0 - (target_age - self.max_target_age) / self.target_decay)
+
+    def limit(self, current: float, requested: float, max_change: float) -> float:
+        # Clamp to the maximum velocity, then limit speeding up. Slowing down, down to a stop before a
+        # change of direction, is always allowed
+        requested = min(max(requested, -self.max_velocity), self.max_velocity)
+        base = current if current * requested > 0 else 0.0
+        if abs(requested) <= abs(base):
+            return requested
+        return base + min(max(requested - base, -max_change), max_change)
+
+    def command(self, x_velocity: float, y_velocity: float, target_age: float = 0.0, now: float = None) -> tuple:
+        """
+        Sends a velocity to the stage after fading it by target age and applying the limits.
+
+        Parameters
+        ----------
+        x_velocity: float
+            Requested X velocity of stage.
+        y_velocity: float
+            Requested Y velocity of stage.
+        target_age: float
+            Seconds since the target the velocity was computed from arrived, None if there is none.
+        now: float
+            Current time from time.perf_counter(), defaults to now.
+
+        Returns
+        -------
+        tuple
+            (x velocity, y velocity) actually sent.
+        """
+
+        now = time.perf_counter() if now is None else now
+        with self.lock:
+            # A late step must not allow a jump, so the time since the last command counts for at most 0.1 s
+            elapsed = 0.1 if self.last_command is None else min(max(now - self.last_command, 0.0), 0.1)
+            max_change = self.max_acceleration * elapsed
+            share = self.freshness(target_age)
+            if self.profile is not None:
+                clamp = lambda velocity: min(max(share * velocity, -self.max_velocity), self.max_velocity)
+                x_velocity, y_velocity = self.profile.update((clamp(x_velocity), clamp(y_velocity)), elapsed)
+            else:
+                x_velocity = self.limit(self.velocity[0], share * x_velocity, max_change)
+                y_velocity = self.limit(self.velocity[1], share * y_velocity, max_change)
+            self.send(x_velocity, y_velocity)
+            self.last_command = now
+            return x_velocity, y_velocity
+
+    def stop(self):
+        """
+        Stops the stage at once, whatever the limits.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        with self.lock:
+            self.send(0.0, 0.0)
+            self.last_command = None
+            if self.profile is not None:
+                self.profile.reset()
+
+    def is_moving(self) -> bool:
+        return self.velocity != (0.0, 0.0)
+
+    def send(self, x_velocity: float, y_velocity: float):
+        # Called under the lock, so commands from the GUI and the tracker thread are counted by one writer at a time
+        self.metrics.count("stage_commands")
+        # ti2_stage_wrapper.startAndStopMovement stops the previous movement by taking the previous direction of the movement, and begins a new one
+        self.drive(x_velocity, y_velocity, self.prev_x_direction, self.prev_y_direction, self.microscope_online)
+        self.velocity = (x_velocity, y_velocity)
+        self.prev_x_direction = 1 if (x_velocity > 0) else -1
+        self.prev_y_direction = 1 if (y_velocity > 0) else -1
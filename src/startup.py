@@ -0,0 +1,108 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from imports_and_constants import *
+from concurrent.futures import ThreadPoolExecutor
+from hardware_wrappers import CoreWrapper, LiveStreamWrapper
+
+# ---- Startup helpers ----#
+
+# Records how long each startup step took, up to the first frame
+class StartupTimer():
+
+    def __init__(self, start_time: float = None):
+        """
+        Initializes the timer.
+
+        Parameters
+        ----------
+        start_time: float
+            time.perf_counter() value startup is measured from, defaults to now.
+
+        Returns
+        -------
+        None
+        """
+
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.milestones = [] # (name, seconds since start)
+        self.lock = threading.Lock()
+
+    def mark(self, name: str) -> float:
+        """
+        Records that a startup step has finished.
+
+        Parameters
+        ----------
+        name: str
+            Name of the step.
+
+        Returns
+        -------
+        float
+            Seconds since the start.
+        """
+
+        seconds = time.perf_counter() - self.start_time
+        with self.lock:
+            self.milestones.append((name, seconds))
+        return seconds
+
+    def elapsed(self, name: str) -> float:
+        for milestone, seconds in self.milestones:
+            if milestone == name:
+                return seconds
+        return None
+
+    def report(self) -> str:
+        """
+        Formats the milestones with the time each step took.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        str
+            One line per milestone.
+        """
+
+        lines = []
+        previous = 0.0
+        for name, seconds in self.milestones:
+            lines.append(name + ": " + str(round(seconds, 3)) + " s (+" + str(round(seconds - previous, 3)) + " s)")
+            previous = seconds
+        return "\n".join(lines)
+
+def connect_hardware(microscope_online: bool) -> tuple:
+    """
+    Connects to the Studio live stream and the Core at the same time, each connection sets up
+    its own bridge to MicroManager.
+
+    Parameters
+    ----------
+    microscope_online: bool
+        Boolean variable set to true if microscope is online
+
+    Returns
+    -------
+    tuple
+        (LiveStreamWrapper, CoreWrapper)
+    """
+
+    with ThreadPoolExecutor(max_workers=2, thread_name_prefix="connect_hardware") as pool:
+        live_stream_future = pool.submit(LiveStreamWrapper, microscope_online)
+        core_future = pool.submit(CoreWrapper, microscope_online)
+        return live_stream_future.result(), core_future.result()
@@ -0,0 +1,977 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Tracking pipeline without Qt. Each stage is a worker running in a plain thread that publishes
+# its results to subscribed callbacks, so the pipeline can run headless (benchmarks, replay,
+# processing nodes) and the GUI threads in threads.py only forward the callbacks to Qt signals:
+#
+#     engine = TrackingEngine(core_wrap, live_stream_wrap, microscope_online)
+#     engine.subscribe("coordinates", print)
+#     targets = engine.queue("target")
+#     engine.start()
+#     target = targets.get()
+#     engine.stop()
+
+from imports_and_constants import *
+import queue
+from collections import deque
+from hardware_wrappers import CoreWrapper, LiveStreamWrapper, GetStageCoords, MoveStage, PixToCartCoords
+from image_processing import ImageGrabber, ImageSegmentation, bin_image
+from metrics import metrics
+from profiler import name_current_thread
+from resources import error_image
+from stage_safety import StageGuard
+from motion_profile import MotionProfile
+from camera_roi import RoiManager, ReadoutFrame, FULL_ROI, crop_square, panel_center
+from dual_channel import DualChannel
+
+# ---- Worker base ----#
+
+class EngineWorker():
+    events = ()
+
+    def __init__(self):
+        """
+        Initializes a worker, which repeats step() until stopped and publishes events to subscribers.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.subscribers = {event: [] for event in self.events}
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.metrics = metrics # Registry the worker reports its rates, latencies and drops to
+
+        # Read by the watchdog: start of the latest step, when each event was last published and recent errors
+        self.heartbeat = None
+        self.running_until = None
+        self.last_published = {}
+        self.error_times = deque(maxlen=1000)
+
+    def subscribe(self, event: str, callback):
+        """
+        Calls callback with the value of every published event. Callbacks run on the worker's
+        thread, so they should hand work off rather than block.
+
+        Parameters
+        ----------
+        event: str
+            One of the worker's events.
+        callback: callable
+            Function taking the published value.
+
+        Returns
+        -------
+        None
+        """
+
+        if event not in self.subscribers:
+            raise ValueError("Unknown event " + repr(event) + ", expected one of " + str(self.events))
+        self.subscribers[event].append(callback)
+
+    def unsubscribe(self, event: str, callback):
+        self.subscribers[event].remove(callback)
+
+    def has_subscribers(self, event: str) -> bool:
+        # Lets a worker skip computing what nobody listens to
+        return len(self.subscribers[event]) > 0
+
+    def publish(self, event: str, value):
+        self.last_published[event] = time.perf_counter()
+        for callback in list(self.subscribers[event]):
+            callback(value)
+
+    def record_error(self):
+        # Errors the worker recovers from itself, the watchdog restarts it when they come too fast
+        self.error_times.append(time.perf_counter())
+
+    def start(self):
+        """
+        Runs the worker in a new daemon thread.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        if self.is_running() and not self.stop_event.is_set():
+            return
+        self.stop_event = threading.Event() # A fresh one, a hung thread left behind by a restart still sees its own
+        self.thread = threading.Thread(target=self.run, name=type(self).__name__, daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Asks the worker to stop after its current step and waits for its thread.
+
+        Parameters
+        ----------
+        timeout: float
+            Longest time to wait for the thread in seconds, None to wait until it ends.
+
+        Returns
+        -------
+        None
+        """
+
+        self.stop_event.set()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout)
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def run(self):
+        """
+        Worker loop, runs in whichever thread calls it (a plain thread from start(), or a QThread).
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        name_current_thread(type(self).__name__) # Shows up under this name in profiles
+        stop_event = self.stop_event
+        self.running_until = stop_event
+        try:
+            while not stop_event.is_set():
+                self.heartbeat = time.perf_counter()
+                self.step()
+        finally:
+            if self.running_until is stop_event:
+                self.running_until = None
+
+    def is_looping(self) -> bool:
+        # True while run() loops in any thread, plain or QThread, and has not been replaced by a restart
+        return self.running_until is not None and not self.running_until.is_set()
+
+    def step(self):
+        raise NotImplementedError
+
+# ---- Pipeline stages ----#
+
+TRACKING_BINNING = 2 # The computer vision works on a 512x512 image from a 770x770 crop, half the resolution loses little
+CHANGE_THRESHOLD = 0.05 # Largest change of a thumbnail pixel, as a share of the thumbnail's range, for a frame to count as unchanged
+THUMBNAIL_SIZE = 32 # Side of the thumbnail compared between frames
+
+# Grabs frames from the live stream. Each capture is published in the forms subscribed to, and only
+# those are computed: "frame" scaled to 8 bits at full resolution (display), "raw_frame" as captured
+# (recording) and "tracking_frame", the raw frame binned by tracking_binning (computer vision)
+class FrameGrabber(EngineWorker):
+    events = ("frame", "raw_frame", "tracking_frame", "finished")
+
+    def __init__(self, live_stream_wrap: LiveStreamWrapper, microscope_online: bool, tracking_binning: int = TRACKING_BINNING,
+                 roi_manager: RoiManager = None):
+        """
+        Initializes the frame grabber.
+
+        Parameters
+        ----------
+        live_stream_wrap: LiveStreamWrapper
+            Takes an instance of the wrapper of the LiveStream object in Micromanager.
+        microscope_online: bool
+            Boolean variable set to true if microscope is online
+        tracking_binning: int
+            Side of the pixel blocks averaged into one pixel of "tracking_frame".
+        roi_manager: RoiManager
+            Camera readout, "frame" and "tracking_frame" are published as ReadoutFrame tagged with the
+            readout they were read with. None publishes plain arrays.
+
+        Returns
+        -------
+        None
+        """
+
+        super().__init__()
+        self.display_capture_time = False
+        self.live_stream_wrap = live_stream_wrap
+        self.microscope_online = microscope_online
+        self.tracking_binning = tracking_binning
+        self.roi_manager = roi_manager
+        self.image_grabber = ImageGrabber(self.microscope_online)
+
+    def toggle_display_capture_time(self):
+        """
+        Toggles display capture time.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.display_capture_time = not self.display_capture_time
+        print("Display capture time toggled:", self.display_capture_time)
+
+    def grab(self) -> np.ndarray:
+        """
+        Grabs one frame, oriented like the live view.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        np.ndarray
+            2D image.
+        """
+
+        frame = self.image_grabber.get_image(self.live_stream_wrap)
+        return np.flipud(frame) # NOTE: Had to invert y-axis for new camera!
+
+    def grab_raw(self) -> np.ndarray:
+        # Raw frame at full resolution and bit depth, oriented like the live view
+        return np.flipud(self.image_grabber.get_raw(self.live_stream_wrap))
+
+    def step(self):
+        s = time.time()
+        start = None if self.roi_manager is None else self.roi_manager.readout()
+        needs_raw = self.has_subscribers("raw_frame") or self.has_subscribers("tracking_frame")
+        raw = self.grab_raw() if needs_raw else None
+        frame = self.grab() if raw is None else None
+        e = time.time()
+
+        # Frames for the crops carry the readout they were read with, as a change to a readout of the
+        # same size, e.g. on the other panel, cannot be told from their shape
+        if self.roi_manager is None:
+            tag = lambda image: image
+        else:
+            roi = self.roi_manager.read_with(start)
+            tag = lambda image: ReadoutFrame(image, roi)
+        if(self.display_capture_time):
+            print("Image capture time: " + str(e-s)) # DEBUG
+        self.metrics.observe("capture_time", e - s)
+
+        # A replay without looping ends with its last frame
+        if self.live_stream_wrap.replay and self.live_stream_wrap.finished:
+            self.stop_event.set()
+            self.publish("finished", None)
+            return
+
+        self.metrics.count("frames_captured")
+        if raw is not None:
+            self.publish("raw_frame", raw)
+            if self.has_subscribers("tracking_frame"):
+                self.publish("tracking_frame", tag(bin_image(raw, self.tracking_binning)))
+            if self.has_subscribers("frame"):
+                frame = np.flipud(self.image_grabber.image_from_raw(np.flipud(raw), self.live_stream_wrap))
+        if frame is not None:
+            self.publish("frame", tag(frame))
+
+# Segments the latest frame and publishes the tracking point as "target", -1 after an error
+class FrameSegmenter(EngineWorker):
+    events = ("target", "segmented", "track_image", "ratio")
+
+    def __init__(self, core_wrap: CoreWrapper, microscope_online: bool, interval: float = 0.09, roi_manager: RoiManager = None,
+                 binning: int = 1, change_threshold: float = CHANGE_THRESHOLD):
+        """
+        Initializes the segmenter.
+
+        Parameters
+        ----------
+        core_wrap: CoreWrapper
+            Takes an instance of the wrapper of the Core object in Micromanager.
+        microscope_online: bool
+            Boolean variable set to true if microscope is online
+        interval: float
+            Pause after segmenting a frame, in seconds.
+        roi_manager: RoiManager
+            Camera readout and crop, a fixed one with the crop at the centre of the tracked panel if None.
+        binning: int
+            Binning of the frames received, TRACKING_BINNING for the grabber's "tracking_frame", 1 for "frame".
+        change_threshold: float
+            Largest change of a thumbnail pixel, as a share of the thumbnail's range, for a frame to
+            reuse the last segmentation. None segments every frame.
+
+        Returns
+        -------
+        None
+        """
+
+        super().__init__()
+        self.inverse = False
+        self.track_right = True
+        self.core_wrap = core_wrap
+        self.microscope_online = microscope_online
+        self.interval = interval
+        self.coordinate_converter = PixToCartCoords(self.microscope_online)
+        self.roi_manager = roi_manager if roi_manager is not None else RoiManager(core_wrap)
+        self.binning = binning
+        self.dual_channel = None # DualChannel while both panels are segmented
+        self.sqr_crop_img = None # Crop of the tracked panel, or a stack of both panels' crops in dual channel
+        self.crop_center = None # Sensor position of the centre of sqr_crop_img
+        self.frame_time = None
+        self.target_frame_time = None # Arrival of the frame the latest published target was found in
+        self.change_threshold = change_threshold
+        self.last_result = None # (key, thumbnail, segmented image, head pixel coordinates) of the last segmented frame
+        self.frame_event = threading.Event()
+        self.error_interval = 1.0 # Shortest time between two error reports, in seconds
+        self.last_error_report = None
+        self.last_error = None # Exception of the last frame that failed
+        self.suppressed_errors = 0
+
+    def toggle_inverse(self):
+        """
+        Toggles inverse segmentation.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.inverse = not self.inverse
+        print("Inverse segmentation toggled:", self.inverse)
+
+    def toggle_track_right(self):
+        """
+        Toggles tracking the right or left panel.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.track_right = not self.track_right
+        self.roi_manager.set_track_right(self.track_right)
+        if(self.track_right):
+            print("Track other panel toggled: Track Right")
+        else:
+            print("Track other panel toggled: Track Left")
+
+    def toggle_dual_channel(self):
+        """
+        Toggles segmenting both panels, the other panel confirms the target or stands in for the
+        tracked one. The panels are registered again every time it is turned on.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        self.dual_channel = DualChannel() if self.dual_channel is None else None
+        self.roi_manager.set_both_panels(self.dual_channel is not None)
+        print("Dual channel toggled:", self.dual_channel is not None)
+
+    def receive_frame(self, frame: np.ndarray):
+        """
+        Receives a frame from the frame grabber, only the latest one is segmented.
+
+        Parameters
+        ----------
+        frame: np.ndarray
+            Frame from the frame grabber.
+
+        Returns
+        -------
+        None
+        """
+
+        # A frame read out before the last ROI change is skipped
+        sqr_crop_img, crop_center = self.roi_manager.crop(frame, self.binning)
+        if sqr_crop_img is None:
+            return
+
+        # In dual channel the other panel is cropped as well, if the readout holds it
+        dual_channel = self.dual_channel
+        if dual_channel is not None:
+            placement = self.roi_manager.placement(frame, self.binning)
+            pair = None if placement is None else dual_channel.crop_pair(frame, placement[0], crop_center, self.track_right, self.binning)
+            if pair is None:
+                self.metrics.count("dual_unavailable")
+            else:
+                sqr_crop_img = pair
+
+        # A frame still waiting when the next one arrives is never segmented
+        if self.frame_event.is_set():
+            self.metrics.count("cv_frames_dropped")
+        self.sqr_crop_img, self.crop_center = sqr_crop_img, crop_center
+        self.frame_time = time.perf_counter()
+        self.frame_event.set()
+        self.metrics.set_gauge("cv_queue", 1)
+
+    @staticmethod
+    def crop_panel(frame: np.ndarray, track_right: bool) -> np.ndarray:
+        """
+        Crops the square region tracked by the computer vision out of the left or right panel.
+
+        Parameters
+        ----------
+        frame: np.ndarray
+            Full frame from the Image Grabber, read out with FULL_ROI.
+        track_right: bool
+            True to crop the right panel, False for the left panel.
+
+        Returns
+        -------
+        np.ndarray
+            770x770 square crop around the centre of the panel.
+        """
+
+        return crop_square(frame, FULL_ROI, panel_center(track_right))
+
+    def process_frame(self, sqr_crop_img: np.ndarray, coordinate_converter: PixToCartCoords = None):
+        """
+        Segments a cropped frame and converts the tracking point to stage coordinates.
+
+        Parameters
+        ----------
+        sqr_crop_img: np.ndarray
+            Square crop of the tracked panel, 8 bit or raw.
+        coordinate_converter: PixToCartCoords
+            Converter from pixel to stage coordinates, defaults to the segmenter's own.
+
+        Returns
+        -------
+        tuple
+            (segmented image, head pixel coordinates, stage coordinates) of the tracking point, or
+            (segmented image, None, None) if nothing was segmented.
+        """
+
+        if coordinate_converter is None:
+            coordinate_converter = self.coordinate_converter
+
+        # Raw crops from "tracking_frame" are scaled to 8 bits here, a crop costs far less than the full frame
+        if sqr_crop_img.dtype != np.uint8:
+            sqr_crop_img = (sqr_crop_img * (255 / max(int(sqr_crop_img.max()), 1))).astype("uint8")
+
+        # Perform segmentation here
+        segmented = None
+        if self.inverse == False:
+            segmented = ImageSegmentation.binary_thresholding(sqr_crop_img)
+        elif self.inverse == True:
+            segmented = ImageSegmentation.inverted_binary_thresholding(sqr_crop_img)
+
+        # If the mask has non-zero values
+        if not np.any(segmented):
+            return segmented, None, None
+
+        # Calculate the coordinate to recentre on
+        head_coordinates = ImageSegmentation.find_center(segmented)
+        cart_coords = coordinate_converter.pixel_to_cartesian_coords(self.core_wrap,head_coordinates[0], head_coordinates[1], 512, 512)
+        return segmented, head_coordinates, cart_coords
+
+    def process_pair(self, pair: np.ndarray, coordinate_converter: PixToCartCoords = None):
+        """
+        Segments both panels' crops together and converts the tracking point to stage coordinates.
+
+        Parameters
+        ----------
+        pair: np.ndarray
+            Stack of the tracked and the other panel's crops, from DualChannel.crop_pair.
+        coordinate_converter: PixToCartCoords
+            Converter from pixel to stage coordinates, defaults to the segmenter's own.
+
+        Returns
+        -------
+        tuple
+            (segmented image, head pixel coordinates, stage coordinates, ratio image), as
+            process_frame with the ratio image last, None unless "ratio" has subscribers.
+        """
+
+        if coordinate_converter is None:
+            coordinate_converter = self.coordinate_converter
+        dual_channel = self.dual_channel if self.dual_channel is not None else DualChannel(offset=(0, 0))
+        segmented, head_coordinates, ratio_img = dual_channel.process(pair, self.inverse, ratio=self.has_subscribers("ratio"))
+        if head_coordinates is None:
+            return segmented, None, None, ratio_img
+        cart_coords = coordinate_converter.pixel_to_cartesian_coords(self.core_wrap,head_coordinates[0], head_coordinates[1], 512, 512)
+        return segmented, head_coordinates, cart_coords, ratio_img
+
+    @staticmethod
+    def thumbnail(sqr_crop_img: np.ndarray) -> np.ndarray:
+        # THUMBNAIL_SIZE wide average of a crop, or of both crops stacked in dual channel. Every
+        # 4th pixel still leaves dozens per thumbnail pixel to average out the noise
+        stack = sqr_crop_img.reshape(-1, sqr_crop_img.shape[-1])[::4, ::4]
+        if stack.dtype not in (np.uint8, np.uint16, np.float32):
+            stack = stack.astype(np.float32)
+        size = (THUMBNAIL_SIZE, THUMBNAIL_SIZE * stack.shape[0] // stack.shape[1])
+        return cv2.resize(stack, size, interpolation=cv2.INTER_AREA).astype(np.float32)
+
+    def unchanged(self, key: tuple, thumbnail: np.ndarray) -> bool:
+        """
+        Whether a frame shows the same scene as the last segmented one, so its result can be reused.
+
+        Parameters
+        ----------
+        key: tuple
+            Crop centre, segmentation mode and crop shape of the frame, any change means a new result.
+        thumbnail: np.ndarray
+            Thumbnail of the frame's crop, None if frames are never skipped.
+
+        Returns
+        -------
+        bool
+            True if no thumbnail pixel changed by more than change_threshold of the last thumbnail's range.
+        """
+
+        if thumbnail is None or self.last_result is None or self.last_result[0] != key:
+            return False
+        # Compared with the last segmented frame, not the last frame, so a slow drift adds up
+        reference = self.last_result[1]
+        scale = max(float(reference.max() - reference.min()), 1.0)
+        return float(np.abs(thumbnail - reference).max()) <= self.change_threshold * scale
+
+    def step(self):
+        # Wait for a new frame, checking for stop requests in between
+        if not self.frame_event.wait(0.1):
+            return
+        self.frame_event.clear()
+        self.metrics.set_gauge("cv_queue", 0)
+        frame_time = self.frame_time
+        sqr_crop_img, crop_center = self.sqr_crop_img, self.crop_center
+
+        try:
+            self.coordinate_converter.offset = self.roi_manager.tracking_offset(crop_center)
+
+            # A scene that has not changed since the last segmented frame keeps its result, only
+            # the stage coordinates are worked out again from the current stage position
+            key = (crop_center, self.inverse, sqr_crop_img.shape)
+            thumbnail = None if self.change_threshold is None else self.thumbnail(sqr_crop_img)
+            skipped = self.unchanged(key, thumbnail)
+            if skipped:
+                self.metrics.count("cv_frames_skipped")
+                segmented, head_coordinates = self.last_result[2:]
+                if head_coordinates is not None:
+                    cart_coords = self.coordinate_converter.pixel_to_cartesian_coords(self.core_wrap,head_coordinates[0], head_coordinates[1], 512, 512)
+            elif sqr_crop_img.ndim == 3:
+                segmented, head_coordinates, cart_coords, ratio_img = self.process_pair(sqr_crop_img)
+                if ratio_img is not None:
+                    self.publish("ratio", ratio_img)
+            else:
+                segmented, head_coordinates, cart_coords = self.process_frame(sqr_crop_img)
+            if not skipped:
+                self.last_result = (key, thumbnail, segmented, head_coordinates)
+            time.sleep(self.interval)
+
+            if head_coordinates is not None:
+                self.roi_manager.observe(head_coordinates, crop_center)
+
+                # Publish the coordinate to recentre on
+                self.metrics.observe("cv_latency", time.perf_counter() - frame_time)
+                self.target_frame_time = frame_time
+                self.publish("target", cart_coords)
+
+                # The images shown already are those of a skipped frame
+                if not skipped:
+                    # Publish segmented image
+                    self.publish("segmented", segmented)
+
+                    # Publish skeleton image (In this case the center of mass visualization)
+                    color = (1,1,1)
+                    track_img = cv2.circle(np.float32(segmented),head_coordinates,10,color,2)
+                    self.publish("track_image", track_img)
+
+            elif not skipped:
+                print("Lighting conditions aren't good")
+
+        except Exception as e:
+            # Publish error message in case of emergency. The tracker is told after every error, the
+            # error image and message at most once per error_interval in case it fails on every frame
+            self.metrics.count("cv_errors")
+            self.last_result = None
+            self.last_error = e
+            self.record_error()
+            now = time.perf_counter()
+            if self.last_error_report is None or now - self.last_error_report >= self.error_interval:
+                suppressed = "" if self.suppressed_errors == 0 else " (" + str(self.suppressed_errors) + " more since the last report)"
+                print("Computer vision error: " + repr(e) + suppressed)
+                self.last_error_report = now
+                self.suppressed_errors = 0
+                disp_img = error_image()
+                self.publish("segmented", disp_img)
+                self.publish("track_image", disp_img)
+            else:
+                self.suppressed_errors += 1
+            self.publish("target", -1)
+
+# Drives the stage towards the latest target with a proportional controller, publishes the stage position as "coordinates"
+class StageTracker(EngineWorker):
+    events = ("coordinates", "velocity")
+
+    def __init__(self, core_wrap: CoreWrapper, microscope_online: bool, interval: float = 0.05, stage_guard: StageGuard = None):
+        """
+        Initializes the stage tracker, connecting to the microscope.
+
+        Parameters
+        ----------
+        core_wrap: CoreWrapper
+            Takes an instance of the wrapper of the Core object in Micromanager.
+        microscope_online: bool
+            Boolean variable set to true if microscope is online
+        interval: float
+            Time between control steps, in seconds.
+        stage_guard: StageGuard
+            Safety layer every stage command goes through, one with the default limits and a
+            jerk-limited motion profile if None.
+
+        Returns
+        -------
+        None
+        """
+
+        super().__init__()
+        self.core_wrap = core_wrap
+        self.track_coords = None
+        self.target_time = None # When the frame of the newest valid target arrived
+        self.requested_velocity = (0.0, 0.0) # Controller output before the safety limits
+        self.is_tracking_enabled = False  # Flag to indicate whether the tracking loop is enabled
+        self.microscope_online = microscope_online
+        self.interval = interval
+        self.stage_guard = stage_guard if stage_guard is not None else StageGuard(microscope_online, profile=MotionProfile())
+        self.get_stage_coords = GetStageCoords(self.core_wrap, self.microscope_online)
+        MoveStage.connectToMicroscope(self.microscope_online)
+
+    # Make destructor to stop last movement, when program is terminated
+    def __del__(self):
+        """
+        Destructor for the stage tracker, stops movement before program termination.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        print("Reached!")
+        self.drive_stage(0,0)
+
+    def receive_tracking_pointer(self, pointer, frame_time: float = None):
+        """
+        Segmenter delivers the tracking point, -1 after a segmentation error.
+
+        Parameters
+        ----------
+        pointer: np.ndarray
+            Desired tracking coordinates.
+        frame_time: float
+            time.perf_counter() when the frame the target was found in arrived, defaults to now.
+
+        Returns
+        -------
+        None
+        """
+
+        self.track_coords = pointer
+        if self.has_target():
+            self.target_time = time.perf_counter() if frame_time is None else frame_time
+
+    def follow(self, segmenter: FrameSegmenter):
+        """
+        Subscribes to the segmenter's targets on its own thread, their age counted from the arrival
+        of the frame they were found in, so targets held up on their way still fade the stage out.
+
+        Parameters
+        ----------
+        segmenter: FrameSegmenter
+            Segmenter publishing the targets.
+
+        Returns
+        -------
+        None
+        """
+
+        segmenter.subscribe("target", lambda pointer: self.receive_tracking_pointer(pointer, segmenter.target_frame_time))
+
+    def target_age(self, now: float = None) -> float:
+        # Seconds since the frame of the newest valid target arrived, None before the first one
+        if self.target_time is None:
+            return None
+        return (time.perf_counter() if now is None else now) - self.target_time
+
+    def has_target(self) -> bool:
+        return self.track_coords is not None and not (isinstance(self.track_coords, int) and self.track_coords == -1)
+
+    # This is the function to drive the stage, it receives the x, y velocities
+    def drive_stage(self,x_velocity,y_velocity):
+        """
+        Calls custom stage API to drive the stage in a given x and y velocity, within the stage
+        guard's velocity and acceleration limits. (0, 0) stops the stage at once.
+
+        Parameters
+        ----------
+        x_velocity: float
+            Desired X velocity of stage.
+        y_velocity: float
+            Desired Y velocity of stage.
+
+        Returns
+        -------
+        tuple
+            (x velocity, y velocity) actually sent.
+        """
+
+        if x_velocity == 0 and y_velocity == 0:
+            self.stage_guard.stop()
+            return 0.0, 0.0
+        return self.stage_guard.command(x_velocity, y_velocity)
+
+    @staticmethod
+    def compute_velocity(track_coords, x_cur_pos: float, y_cur_pos: float) -> tuple:
+        """
+        Proportional controller turning the distance to the tracking point into a stage velocity.
+
+        Parameters
+        ----------
+        track_coords: list
+            Desired [x, y] stage coordinates.
+        x_cur_pos: float
+            Current x position of the stage.
+        y_cur_pos: float
+            Current y position of the stage.
+
+        Returns
+        -------
+        tuple
+            (x velocity, y velocity) to drive the stage with.
+        """
+
+        # Proportional controller
+        x_diff = track_coords[0] - x_cur_pos
+        y_diff = track_coords[1] - y_cur_pos # TODO account for inversion
+        x_velocity = 6 * x_diff
+        y_velocity = 6 * y_diff
+        return x_velocity, y_velocity
+
+    def run(self):
+        # Whatever ends the loop, a stop request or an exception, the stage must not keep moving
+        try:
+            super().run()
+        finally:
+            self.stage_guard.stop()
+
+    def step(self):
+        self.metrics.count("tracker_steps")
+
+        # Idle until the segmenter delivers a target
+        if self.has_target():
+            x_cur_pos = self.get_stage_coords.get_x_coord()
+            y_cur_pos = self.get_stage_coords.get_y_coord()
+            self.publish("coordinates", [round(x_cur_pos, 1), round(y_cur_pos, 1)])
+            if self.is_tracking_enabled:  # Check if the tracking loop is enabled
+                self.requested_velocity = StageTracker.compute_velocity(self.track_coords, x_cur_pos, y_cur_pos)
+
+        if self.is_tracking_enabled and (self.has_target() or self.stage_guard.is_moving()):
+            # Without a new target the last request keeps fading out with the target's age instead of coasting
+            target_age = self.target_age()
+            if target_age is not None and target_age > self.stage_guard.max_target_age:
+                self.metrics.count("stale_target_steps")
+            x_velocity, y_velocity = self.stage_guard.command(*self.requested_velocity, target_age)
+            self.publish("velocity", [x_velocity, y_velocity])
+        self.stop_event.wait(self.interval)
+
+    def toggle_tracking_loop(self):
+        """
+        Toggles the tracking flag.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        None
+        """
+
+        # Toggle the state of the tracking loop when the button is clicked
+        self.is_tracking_enabled = not self.is_tracking_enabled
+        if self.is_tracking_enabled:
+            print("Tracking loop enabled.")
+        else:
+            print("Tracking loop paused.")
+            # The stage guard serialises commands and their directions, so no wait is needed to prevent the -4 error
+            self.drive_stage(0,0) # Stop last movement if tracking loop is paused!
+
+# ---- Engine ----#
+
+class TrackingEngine():
+
+    def __init__(self, core_wrap: CoreWrapper, live_stream_wrap: LiveStreamWrapper, microscope_online: bool,
+                 segment_interval: float = 0.09, track_interval: float = 0.05):
+        """
+        Initializes the whole pipeline: frame grabber, segmenter and stage tracker, connected directly.
+
+        Parameters
+        ----------
+        core_wrap: CoreWrapper
+            Takes an instance of the wrapper of the Core object in Micromanager.
+        live_stream_wrap: LiveStreamWrapper
+            Takes an instance of the wrapper of the LiveStream object in Micromanager.
+        microscope_online: bool
+            Boolean variable set to true if microscope is online
+        segment_interval: float
+            Pause after segmenting a frame, in seconds.
+        track_interval: float
+            Time between control steps, in seconds.
+
+        Returns
+        -------
+        None
+        """
+
+        roi_manager = RoiManager(core_wrap) # Fixed at FULL_ROI, shared so frames are tagged with their readout
+        self.grabber = FrameGrabber(live_stream_wrap, microscope_online, roi_manager=roi_manager)
+        self.segmenter = FrameSegmenter(core_wrap, microscope_online, segment_interval, roi_manager=roi_manager,
+                                        binning=self.grabber.tracking_binning)
+        self.tracker = StageTracker(core_wrap, microscope_online, track_interval)
+        self.workers = (self.grabber, self.segmenter, self.tracker)
+
+        self.grabber.subscribe("tracking_frame", self.segmenter.receive_frame)
+        self.tracker.follow(self.segmenter)
+
+    def worker_for(self, event: str) -> EngineWorker:
+        for worker in self.workers:
+            if event in worker.events:
+                return worker
+        raise ValueError("Unknown event " + repr(event))
+
+    def subscribe(self, event: str, callback):
+        """
+        Calls callback with every published value of an event: "frame", "raw_frame", "tracking_frame",
+        "finished" (grabber), "target", "segmented", "track_image" (segmenter), "coordinates" or
+        "velocity" (tracker).
+
+        Parameters
+        ----------
+        event: str
+            Event name.
+        callback: callable
+            Function taking the published value, runs on the publishing worker's thread.
+
+        Returns
+        -------
+        None
+        """
+
+        self.worker_for(event).subscribe(event, callback)
+
+    def unsubscribe(self, event: str, callback):
+        self.worker_for(event).unsubscribe(event, callback)
+
+    def queue(self, event: str, maxsize: int = 1) -> queue.Queue:
+        """
+        Subscribes a queue to an event. When the queue is full the oldest value is dropped, so a
+        slow consumer always gets the latest values instead of stalling the pipeline.
+
+        Parameters
+        ----------
+        event: str
+            Event name, see subscribe.
+        maxsize: int
+            Number of values kept.
+
+        Returns
+        -------
+        queue.Queue
+            Queue receiving the published values.
+        """
+
+        values = queue.Queue(maxsize)
+        registry = self.worker_for(event).metrics
+
+        def put_latest(value):
+            while True:
+                try:
+                    values.put_nowait(value)
+                    return
+                except queue.Full:
+                    try:
+                        values.get_nowait()
+                        registry.count("queue_dropped." + event)
+                    except queue.Empty:
+                        pass
+
+        self.subscribe(event, put_latest)
+        return values
+
+    def start(self):
+        for worker in self.workers:
+            worker.start()
+
+    def stop(self, timeout: float = None):
+        """
+        Stops the workers and the stage.
+
+        Parameters
+        ----------
+        timeout: float
+            Longest time to wait for each worker thread in seconds.
+
+        Returns
+        -------
+        None
+        """
+
+        for worker in self.workers:
+            worker.stop(timeout)
+        self.tracker.is_tracking_enabled = False
+        self.tracker.drive_stage(0, 0)
+
+    def wait_until_finished(self, timeout: float = None) -> bool:
+        """
+        Waits for the frame grabber to end, which happens when a replay without looping runs out of frames.
+
+        Parameters
+        ----------
+        timeout: float
+            Longest time to wait in seconds.
+
+        Returns
+        -------
+        bool
+            True if the frame grabber ended.
+        """
+
+        if self.grabber.thread is not None:
+            self.grabber.thread.join(timeout)
+        return not self.grabber.is_running()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
@@ -0,0 +1,263 @@
+# Copyright 2025 Danish Islam
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# Watchdog for the pipeline workers. Every worker stamps a heartbeat at the start of each step, the
+# time it last published each event and the errors it recovered from. The supervisor checks them
+# against each worker's deadlines and restarts a worker that stalled (a hung camera or stage call),
+# died from an exception or hit an error storm, without touching the rest of the application:
+#
+#     supervisor = Supervisor()
+#     supervisor.watch("CV", segmenter, WatchPolicy(stall_after=3.0))
+#     supervisor.subscribe("health", print)
+#     supervisor.start()
+
+from imports_and_constants import *
+from tracking_engine import EngineWorker
+
+# Statuses that get a worker restarted
+restart_statuses = ("stalled", "dead", "error storm")
+
+# ---- Policies ----#
+
+# Deadlines a worker is held to
+class WatchPolicy():
+
+    def __init__(self, stall_after: float = 2.0, output_event: str = None, silent_after: float = None,
+                 max_errors: int = 20, error_window: float = 5.0, max_restarts: int = 5, restart_timeout: float = 1.0):
+        """
+        Initializes a policy.
+
+        Parameters
+        ----------
+        stall_after: float
+            A worker whose current step started longer ago than this, in seconds, is stalled.
+        output_event: str
+            Event the worker should keep publishing, e.g. "frame", None not to check.
+        silent_after: float
+            The worker is reported silent when output_event was not published for this long. Silence
+            is only a warning, a segmenter without a target in view is not broken.
+        max_errors: int
+            Number of recovered errors within error_window that makes an error storm.
+        error_window: float
+            Time window for counting errors, in seconds.
+        max_restarts: int
+            Restarts allowed before the worker is reported failed and left alone.
+        restart_timeout: float
+            Longest wait for a stalled worker to stop before a new thread replaces it, in seconds.
+
+        Returns
+        -------
+        None
+        """
+
+        self.stall_after = stall_after
+        self.output_event = output_event
+        self.silent_after = silent_after
+        self.max_errors = max_errors
+        self.error_window = error_window
+        self.max_restarts = max_restarts
+        self.restart_timeout = restart_timeout
+
+def restart_worker(worker: EngineWorker, timeout: float = 1.0):
+    """
+    Stops a worker and runs it again in a new plain thread. A thread stuck in a call is left to end on
+    its own when the call returns, its stop request stays set.
+
+    Parameters
+    ----------
+    worker: EngineWorker
+        Worker to restart, running in a plain thread or a QThread.
+    timeout: float
+        Longest wait for the old thread, in seconds.
+
+    Returns
+    -------
+    None
+    """
+
+    worker.stop(timeout)
+    worker.error_times.clear()
+    worker.heartbeat = None
+    worker.start()
+
+# ---- Supervisor ----#
+
+class Supervisor(EngineWorker):
+    events = ("health", "restart")
+
+    def __init__(self, interval: float = 0.5):
+        """
+        Initializes the supervisor.
+
+        Parameters
+        ----------
+        interval: float
+            Time between checks, in seconds.
+
+        Returns
+        -------
+        None
+        """
+
+        super().__init__()
+        self.interval = interval
+        self.watched = {}
+        self.states = {}
+        self.lock = threading.Lock()
+
+    def watch(self, name: str, worker: EngineWorker, policy: WatchPolicy = None, restart = None):
+        """
+        Adds a worker to supervise.
+
+        Parameters
+        ----------
+        name: str
+            Name shown in the health report.
+        worker: EngineWorker
+            The worker.
+        policy: WatchPolicy
+            Its deadlines, the defaults if None.
+        restart: callable
+            Called with the worker and the policy's restart_timeout to restart it, restart_worker if None.
+
+        Returns
+        -------
+        None
+        """
+
+        self.watched[name] = (worker, policy if policy is not None else WatchPolicy(), restart if restart is not None else restart_worker)
+        with self.lock:
+            self.states[name] = {"status": "starting", "detail": "", "restarts": 0, "last_restart": None,
+                                 "since": time.perf_counter()}
+
+    def check(self, name: str, now: float = None) -> tuple:
+        """
+        Status of a worker against its policy.
+
+        Parameters
+        ----------
+        name: str
+            Name of the worker.
+        now: float
+            Current time from time.perf_counter(), defaults to now.
+
+        Returns
+        -------
+        tuple
+            (status, detail). Status is "starting", "ok", "silent", "stalled", "dead", "error storm" or "stopped".
+        """
+
+        now = time.perf_counter() if now is None else now
+        worker, policy, _ = self.watched[name]
+        if worker.heartbeat is None:
+            return "starting", ""
+        if not worker.is_looping():
+            if worker.stop_event.is_set():
+                return "stopped", ""
+            return "dead", "worker loop ended"
+
+        heartbeat_age = now - worker.heartbeat
+        if heartbeat_age > policy.stall_after:
+            return "stalled", "no step for " + str(round(heartbeat_age, 1)) + " s"
+
+        errors = sum(1 for error_time in worker.error_times if now - error_time <= policy.error_window)
+        if errors >= policy.max_errors:
+            return "error storm", str(errors) + " errors in " + str(policy.error_window) + " s"
+
+        if policy.output_event is not None and policy.silent_after is not None:
+            # Before the first output, silence counts from when watching or the last restart began
+            with self.lock:
+                last = worker.last_published.get(policy.output_event, self.states[name]["since"])
+            if now - last > policy.silent_after:
+                return "silent", "no " + policy.output_event + " for " + str(round(now - last, 1)) + " s"
+        return "ok", ""
+
+    def restart(self, name: str, status: str, detail: str, now: float = None):
+        worker, policy, restart = self.watched[name]
+        print("Watchdog: restarting " + name + ", " + status + (" (" + detail + ")" if detail else ""))
+        restart(worker, policy.restart_timeout)
+        with self.lock:
+            state = self.states[name]
+            state["restarts"] += 1
+            state["last_restart"] = state["since"] = time.perf_counter() if now is None else now
+        self.metrics.count("watchdog_restarts." + name)
+        self.publish("restart", name)
+
+    def check_all(self, now: float = None):
+        """
+        Checks every worker, restarts the ones that need it and publishes the health report.
+
+        Parameters
+        ----------
+        now: float
+            Current time from time.perf_counter(), defaults to now.
+
+        Returns
+        -------
+        None
+        """
+
+        now = time.perf_counter() if now is None else now
+        for name, (worker, policy, _) in self.watched.items():
+            status, detail = self.check(name, now)
+            with self.lock:
+                state = self.states[name]
+                restarts, last_restart = state["restarts"], state["last_restart"]
+
+            if status in restart_statuses:
+                if restarts >= policy.max_restarts:
+                    status, detail = "failed", status + " after " + str(restarts) + " restarts"
+                elif last_restart is None or now - last_restart >= policy.stall_after:
+                    self.restart(name, status, detail, now)
+
+            with self.lock:
+                self.states[name]["status"] = status
+                self.states[name]["detail"] = detail
+        self.publish("health", self.health())
+
+    def health(self) -> dict:
+        """
+        Latest health report.
+
+        Parameters
+        ----------
+        None
+
+        Returns
+        -------
+        dict
+            Worker name to {"status", "detail", "restarts"}.
+        """
+
+        with self.lock:
+            return {name: {"status": state["status"], "detail": state["detail"], "restarts": state["restarts"]}
+                    for name, state in self.states.items()}
+
+    def step(self):
+        self.check_all()
+        self.stop_event.wait(self.interval)
+
+def describe_health(health: dict) -> str:
+    # One line for the GUI: the problems, or that every stage is fine
+    problems = []
+    for name, state in health.items():
+        if state["status"] not in ("ok", "starting", "stopped"):
+            text = name + " " + state["status"]
+            if state["restarts"]:
+                text += " (" + str(state["restarts"]) + " restart" + ("s" if state["restarts"] > 1 else "") + ")"
+            problems.append(text)
+    if not problems:
+        restarts = sum(state["restarts"] for state in health.values())
+        return "all stages ok" + ("" if restarts == 0 else ", " + str(restarts) + " restarts so far")
+    return ", ".join(problems)
@@ -0,0 +1,50 @@
+import sys
+import os
+import json
+import pytest
+import numpy as np
+import tifffile
+import h5py
+from click.testing import CliRunner
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts')))
+
+from batch_cli import cli
+
+def make_recording(folder, num_frames, offset):
+    os.makedirs(folder)
+    for i in range(num_frames):
+        tifffile.imwrite(os.path.join(folder, "frame_" + str(i) + ".tif"), np.full((16, 32), offset + i, dtype=np.uint16))
+
+def test_convert_then_split_many_inputs(tmp_path):
+    folders = [str(tmp_path / "recording_a"), str(tmp_path / "recording_b")]
+    make_recording(folders[0], 3, 0)
+    make_recording(folders[1], 5, 100)
+    output_dir = str(tmp_path / "h5")
+    report_path = str(tmp_path / "convert.json")
+
+    result = CliRunner().invoke(cli, ["convert", *folders, "--output-dir", output_dir, "--workers", "2",
+                                      "--codec", "gzip", "--level", "1", "--chunks", "1,16,32", "--report", report_path])
+    assert result.exit_code == 0, result.output
+
+    with open(report_path) as file:
+        report = json.load(file)
+    assert report["done_jobs"] == 2 and report["failed_jobs"] == 0
+    assert sorted(job["frames"] for job in report["jobs"]) == [3, 5]
+    with h5py.File(os.path.join(output_dir, "recording_b.h5"), 'r') as file:
+        video = file['video_frames']
+        assert video.chunks == (1, 16, 32) and video.compression_opts == 1
+        assert list(video[:, 0, 0]) == [100, 101, 102, 103, 104]
+
+    video_path = os.path.join(output_dir, "recording_b.h5")
+    report_path = str(tmp_path / "split.json")
+    result = CliRunner().invoke(cli, ["split", video_path, "--ranges", "(0,1) (2,4)", "--report", report_path])
+    assert result.exit_code == 0, result.output
+    with open(report_path) as file:
+        report = json.load(file)
+    assert report["done_jobs"] == 2
+    assert all(job["direct_chunk_copy"] for job in report["jobs"])
+
+def test_bad_chunks_are_rejected(tmp_path):
+    result = CliRunner().invoke(cli, ["convert", str(tmp_path), "--chunks", "1,2"])
+    assert result.exit_code != 0
+    assert "three positive sizes" in result.output
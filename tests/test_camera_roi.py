@@ -0,0 +1,109 @@
+import sys
+import os
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from camera_roi import *
+from tracking_engine import FrameSegmenter
+from hardware_wrappers import CoreWrapper
+from metrics import MetricsRegistry
+
+# Camera stand-in recording the ROI changes and live stream restarts
+class FakeCamera():
+
+    def __init__(self):
+        self.calls = []
+        self.replay = False
+
+    def set_roi(self, x_start, y_start, x_size, y_size):
+        self.calls.append(("set_roi", (x_start, y_start, x_size, y_size)))
+
+    def set_live_mode_on(self, on):
+        self.calls.append(("live", on))
+
+def sensor_frame(roi, spot):
+    # Readout of roi with a bright spot at a sensor position
+    frame = np.zeros((roi[3], roi[2]), dtype=np.uint8)
+    frame[spot[1] - roi[1] - 5:spot[1] - roi[1] + 5, spot[0] - roi[0] - 5:spot[0] - roi[0] + 5] = 255
+    return frame
+
+def test_fixed_manager_crops_the_centre_of_the_panel():
+    manager = RoiManager(CoreWrapper(False))
+    frame = np.arange(1024 * 2048, dtype=np.uint32).reshape(1024, 2048)
+    for track_right in (True, False):
+        manager.set_track_right(track_right)
+        crop, center = manager.crop(frame)
+        assert np.array_equal(crop, FrameSegmenter.crop_panel(frame, track_right))
+        assert crop.shape == (CROP_SIZE, CROP_SIZE)
+        assert manager.tracking_offset(center) == (0, 0)
+    manager.observe((500, 500), center) # Not adaptive, nothing moves
+    assert manager.roi == FULL_ROI and manager.crop_center == panel_center(False)
+
+def test_adaptive_manager_narrows_follows_and_grows():
+    camera = FakeCamera()
+    manager = RoiManager(camera, camera, adaptive=True, shrink_after=3, min_interval=1.0)
+    manager.metrics = MetricsRegistry()
+    small = manager.roi_for(0)
+    assert camera.calls == [("live", False), ("set_roi", small), ("live", True)]
+    assert small[2:] == ROI_LEVELS[0] and small[2] * small[3] < 0.4 * FULL_ROI[2] * FULL_ROI[3]
+
+    # Full frames still on their way are placed, frames of unknown shape are skipped
+    assert manager.placement(np.zeros((1024, 2048)))[0] == FULL_ROI
+    assert manager.crop(np.zeros((100, 100))) == (None, None)
+    assert manager.metrics.total("roi_mismatched_frames") == 1
+
+    # The specimen outruns the stage to the right, the crop follows it as far as the readout allows
+    center = panel_center(True)
+    spot = (center[0] + 300, center[1])
+    crop, crop_center = manager.crop(sensor_frame(small, spot))
+    head = ((spot[0] - crop_center[0]) * TRACK_SIZE / CROP_SIZE + TRACK_SIZE / 2, TRACK_SIZE / 2)
+    start = manager.last_change + 1.0 # After min_interval since narrowing at start
+    manager.observe(head, crop_center, now=start)
+    assert manager.level == 1 and manager.roi == manager.roi_for(1) # Grown, the crop did not fit
+    assert manager.crop_center == manager.clamp(spot, manager.roi)
+
+    # The next crop holds the spot where its offset says it is, as seen by the stage conversion
+    crop, crop_center = manager.crop(sensor_frame(manager.roi, spot))
+    rows, cols = np.nonzero(crop)
+    offset = manager.tracking_offset(crop_center)
+    spot_in_tracking_pixels = (cols.mean() * TRACK_SIZE / CROP_SIZE + offset[0], rows.mean() * TRACK_SIZE / CROP_SIZE + offset[1])
+    expected = ((spot[0] - 0.5 - center[0]) * TRACK_SIZE / CROP_SIZE + TRACK_SIZE / 2,
+                (spot[1] - 0.5 - center[1]) * TRACK_SIZE / CROP_SIZE + TRACK_SIZE / 2)
+    assert spot_in_tracking_pixels == pytest.approx(expected, abs=1)
+
+    # No new change within min_interval, the readout shrinks after a few centred targets
+    manager.observe((TRACK_SIZE / 2, TRACK_SIZE / 2), center, now=start + 0.5)
+    manager.observe((TRACK_SIZE / 2, TRACK_SIZE / 2), center, now=start + 0.6)
+    manager.observe((TRACK_SIZE / 2, TRACK_SIZE / 2), center, now=start + 0.7)
+    assert manager.level == 1 and manager.crop_center == center
+    manager.observe((TRACK_SIZE / 2, TRACK_SIZE / 2), center, now=start + 1.5)
+    manager.observe((TRACK_SIZE / 2, TRACK_SIZE / 2), center, now=start + 1.6)
+    manager.observe((TRACK_SIZE / 2, TRACK_SIZE / 2), center, now=start + 1.7)
+    assert manager.level == 0 and manager.roi == small
+    assert manager.metrics.total("roi_changes") == 2
+
+def test_switching_panels_moves_the_readout():
+    camera = FakeCamera()
+    manager = RoiManager(camera, None, adaptive=True)
+    manager.set_track_right(False)
+    assert camera.calls[-1] == ("set_roi", manager.roi_for(0))
+    assert manager.roi[0] + manager.roi[2] <= PANEL_WIDTH
+    assert manager.crop_center == panel_center(False)
+
+def test_frames_are_placed_by_the_readout_they_were_read_with():
+    manager = RoiManager(FakeCamera(), None, adaptive=True)
+    manager.metrics = MetricsRegistry()
+    right = manager.roi
+    in_flight = ReadoutFrame(np.zeros((right[3], right[2])), right)
+    start = manager.readout()
+
+    # Same level on the other panel, a frame of the same size from the old readout is not cropped here
+    manager.set_track_right(False)
+    left = manager.roi
+    assert left[2:] == right[2:] and manager.read_with(start) is None
+    assert manager.crop(in_flight) == (None, None)
+    assert manager.metrics.total("roi_mismatched_frames") == 1
+    assert manager.crop(ReadoutFrame(np.zeros((left[3], left[2])), None)) == (None, None) # Read during the change
+    crop, center = manager.crop(ReadoutFrame(sensor_frame(left, panel_center(False)), manager.read_with(manager.readout())))
+    assert center == panel_center(False) and type(crop) is np.ndarray and crop.max() == 255
@@ -0,0 +1,36 @@
+import sys
+import os
+import pytest
+import numpy as np
+import h5py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts')))
+
+from chunk_advisor import advise, rechunk, chunks_touched, candidate_chunks
+
+def make_video(path):
+    rng = np.random.default_rng(0)
+    video = (rng.poisson(50, size=(32, 128, 256)) + np.arange(256)).astype(np.uint16)
+    with h5py.File(path, 'w') as file:
+        file.create_dataset('video_frames', data=video, chunks=(1, 128, 256), compression='gzip', compression_opts=4)
+    return video
+
+def test_chunks_touched():
+    assert chunks_touched((1, 1024, 2048), ((0, 100), (5, 6), (7, 8))) == 100
+    assert chunks_touched((64, 64, 64), ((0, 100), (60, 70), (0, 64))) == 4
+    assert candidate_chunks((1024, 2048), 8)[0] == (1, 1024, 2048)
+    assert all(chunks[0] <= 8 for chunks in candidate_chunks((1024, 2048), 8))
+
+def test_pixel_workload_prefers_time_chunks_and_rechunks(tmp_path):
+    path = str(tmp_path / "video.h5")
+    video = make_video(path)
+
+    best, results, current = advise(path, sample_frames=32, workload="pixel", reads=2)
+    assert best["chunks"][0] > 1 # Whole-frame chunks make a pixel time-series read every frame
+    assert best["patterns"]["pixel"]["mb_read"] * 10 < current["patterns"]["pixel"]["mb_read"]
+    assert all(result["compression_ratio"] > 1 for result in results)
+
+    output_path = str(tmp_path / "rechunked.h5")
+    rechunk(path, output_path, best)
+    with h5py.File(output_path, 'r') as file:
+        assert file['video_frames'].chunks == best["chunks"]
+        assert np.array_equal(file['video_frames'][:], video)
@@ -0,0 +1,119 @@
+import sys
+import os
+import threading
+import pytest
+import numpy as np
+import tifffile
+import h5py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts')))
+
+from compression_app import create_video_hdf5, natural_sort_key, VideoHDF5App
+
+FRAME_BYTES = 16 * 32 * 2
+
+def make_recording(folder, num_frames):
+    os.makedirs(folder)
+    for i in range(num_frames):
+        tifffile.imwrite(os.path.join(folder, "frame_" + str(i) + ".tif"), np.full((16, 32), i, dtype=np.uint16))
+    with open(os.path.join(folder, "notes.txt"), 'w') as file:
+        file.write("not a frame")
+
+def test_natural_sort_key():
+    names = ["frame_10.tif", "frame_2.tif", "frame_1.tif"]
+    assert sorted(names, key=natural_sort_key) == ["frame_1.tif", "frame_2.tif", "frame_10.tif"]
+
+def test_frames_are_written_in_frame_order_in_batches(tmp_path):
+    folder = str(tmp_path / "recording")
+    make_recording(folder, 23)
+    path = str(tmp_path / "video.h5")
+    progress = []
+
+    # Batches of 4 chunks of 2 frames each
+    stats = create_video_hdf5(folder, path, chunks=(2, 16, 32), batch_bytes=8 * FRAME_BYTES,
+                              progress_callback=lambda done, total, left: progress.append(done))
+    assert stats["frames"] == 23 and stats["files"] == 23
+    assert progress == [8, 16, 23]
+    with h5py.File(path, 'r') as file:
+        video = file['video_frames']
+        assert video.attrs["frames_written"] == 23
+        assert np.array_equal(video[:, 0, 0], np.arange(23))
+
+def test_interrupted_conversion_resumes(tmp_path, monkeypatch):
+    folder = str(tmp_path / "recording")
+    make_recording(folder, 120)
+    path = str(tmp_path / "video.h5")
+
+    def interrupt(done, total, left):
+        if done >= 60:
+            raise KeyboardInterrupt
+    with pytest.raises(KeyboardInterrupt):
+        create_video_hdf5(folder, path, chunks=(1, 16, 32), batch_bytes=10 * FRAME_BYTES, progress_callback=interrupt)
+    with h5py.File(path, 'r') as file:
+        assert file['video_frames'].attrs["frames_written"] == 50 # Last checkpoint before the interruption
+
+    stats = create_video_hdf5(folder, path, chunks=(1, 16, 32), batch_bytes=10 * FRAME_BYTES, resume=True)
+    assert stats["frames"] == 120
+    assert stats["input_bytes"] == 70 * FRAME_BYTES # Only the frames after the checkpoint were read again
+    with h5py.File(path, 'r') as file:
+        assert np.array_equal(file['video_frames'][:, 0, 0], np.arange(120))
+
+def test_cancelled_conversion_is_consistent_and_resumes(tmp_path):
+    folder = str(tmp_path / "recording")
+    make_recording(folder, 30)
+    path = str(tmp_path / "video.h5")
+    cancel_event = threading.Event()
+
+    def cancel_after_first_batch(done, total, left):
+        cancel_event.set()
+    stats = create_video_hdf5(folder, path, chunks=(1, 16, 32), batch_bytes=10 * FRAME_BYTES,
+                              progress_callback=cancel_after_first_batch, cancel_event=cancel_event)
+    assert stats["cancelled"] and stats["frames"] == 10
+    with h5py.File(path, 'r') as file:
+        assert file['video_frames'].shape[0] == 10 and file['video_frames'].attrs["frames_written"] == 10
+
+    stats = create_video_hdf5(folder, path, chunks=(1, 16, 32), resume=True)
+    assert not stats["cancelled"] and stats["frames"] == 30
+
+def test_resuming_a_video_without_checkpoints_keeps_it(tmp_path):
+    folder = str(tmp_path / "recording")
+    make_recording(folder, 5)
+    path = str(tmp_path / "video.h5")
+    with h5py.File(path, 'w') as file:
+        file.create_dataset('frames', data=np.ones((2, 16, 32), dtype=np.uint16))
+
+    stats = create_video_hdf5(folder, path, chunks=(1, 16, 32), resume=True)
+    assert stats["frames"] == 5
+    with h5py.File(path + ".corrupt", 'r') as file:
+        assert file['frames'].shape == (2, 16, 32)
+
+def test_gui_converts_in_background_thread(qtbot, tmp_path):
+    folder = str(tmp_path / "recordings" / "recording")
+    make_recording(folder, 12)
+    window = VideoHDF5App()
+    qtbot.addWidget(window)
+    window.selected_folder = folder
+
+    window.run_function()
+    assert not window.run_button.isEnabled()
+    assert window.cancel_button.isEnabled()
+    qtbot.waitUntil(lambda: window.conversion_thread is None, timeout=5000)
+
+    assert window.run_button.isEnabled()
+    assert window.progress_label.text().endswith("Done!")
+    with h5py.File(str(tmp_path / "recordings" / "output" / "video.h5"), 'r') as file:
+        assert np.array_equal(file['video_frames'][:, 0, 0], np.arange(12))
+
+def test_closing_the_window_cancels_the_conversion(qtbot, tmp_path):
+    folder = str(tmp_path / "recordings" / "recording")
+    make_recording(folder, 12)
+    window = VideoHDF5App()
+    qtbot.addWidget(window)
+    window.selected_folder = folder
+    window.show()
+
+    window.run_function()
+    window.close()
+    assert window.conversion_thread.isFinished()
+    with h5py.File(str(tmp_path / "recordings" / "output" / "video.h5"), 'r') as file:
+        video = file['video_frames']
+        assert video.shape[0] == video.attrs["frames_written"] # Consistent, ready to resume
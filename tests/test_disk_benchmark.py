@@ -0,0 +1,33 @@
+import sys
+import os
+import pytest
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts')))
+
+import disk_benchmark
+from disk_benchmark import benchmark_write_throughput, plan_recording, make_sample_frame
+
+def test_benchmark_leaves_directory_clean(tmp_path):
+    sample_frame = make_sample_frame((256, 512))
+    result = benchmark_write_throughput(str(tmp_path), sample_frame, compression_level=3, n_frames=4)
+
+    assert os.listdir(tmp_path) == []
+    assert result["fps"] > 0
+    assert result["compression_ratio"] > 1 # The sample frame is compressible like a real one
+    assert result["raw_mb_per_s"] == pytest.approx(result["fps"] * sample_frame.nbytes / 1e6)
+
+def test_plan_picks_cheapest_level_that_keeps_up(tmp_path, monkeypatch):
+    # Simulated disk where only compressed frames are small enough to keep up
+    rates = {0: 8.0, 1: 11.0, 3: 15.0, 6: 14.0, 9: 6.0}
+    def fake_benchmark(directory, sample_frame, compression_level=0, n_frames=24):
+        return {"compression_level": compression_level, "fps": rates[compression_level]}
+    monkeypatch.setattr(disk_benchmark, "benchmark_write_throughput", fake_benchmark)
+
+    chosen, results = plan_recording(str(tmp_path), 10, sample_frame=np.zeros((4, 4), dtype=np.uint16))
+    assert chosen["compression_level"] == 3
+    assert [result["compression_level"] for result in results] == [0, 1, 3]
+
+    # Nothing sustains the target, the fastest level is returned so the caller can warn
+    chosen, results = plan_recording(str(tmp_path), 20, sample_frame=np.zeros((4, 4), dtype=np.uint16))
+    assert chosen["compression_level"] == 3
+    assert len(results) == 5
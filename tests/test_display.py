@@ -0,0 +1,166 @@
+import sys
+import os
+import numpy as np
+import pytest
+from PyQt5 import QtCore
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from gui import *
+from display import *
+from dashboard import MetricsDashboard
+from metrics import MetricsRegistry
+
+def make_frame(seed=0):
+    return np.random.default_rng(seed).integers(0, 256, size=(1024, 2048), dtype=np.uint8)
+
+def make_inputs(frame):
+    segmented = np.zeros((512, 512), dtype=np.uint8)
+    segmented[200:220, 300:320] = 255
+    track_image = cv2.circle(np.float32(segmented), (310, 210), 10, (1, 1, 1), 2)
+    return {"frame": frame, "segmented": segmented, "track_image": track_image}
+
+def test_panels_match_the_original_conversions(qapp):
+    frame = np.flipud(make_frame())
+    inputs = make_inputs(frame)
+    display_frame = DisplayFrame()
+    display_frame.fill(inputs, {"frame": 1, "segmented": 1, "track_image": 1}, track_right=False)
+
+    left = cv2.resize(frame[:,:1024],(512,512))
+    right = cv2.resize(frame[:,1024:],(512,512))
+    zoomed = cv2.resize(frame[:,:1024][(512 - 385):(512 + 385), (512 - 385):(512 + 385)],(512,512))
+    assert np.array_equal(display_frame.overview.array[:, :512], left)
+    assert np.array_equal(display_frame.overview.array[:, 512:], right)
+    assert np.array_equal(display_frame.zoomed.array, zoomed)
+    assert np.array_equal(display_frame.segmented.array, inputs["segmented"])
+    assert np.array_equal(display_frame.track_image.array, inputs["track_image"].astype('uint8') * 255)
+
+    # The QImages read the buffers directly, a later frame shows up without rebuilding them
+    right_image = display_frame.right_image()
+    assert right_image.width() == 512 and right_image.height() == 512
+    assert right_image.pixelColor(7, 3).red() == right[3, 7]
+    frame = np.flipud(make_frame(1))
+    display_frame.fill(dict(inputs, frame=frame), {"frame": 2, "segmented": 1, "track_image": 1}, track_right=False)
+    assert display_frame.right_image() is right_image
+    assert right_image.pixelColor(7, 3).red() == cv2.resize(frame[:,1024:],(512,512))[3, 7]
+
+def test_narrowed_readout_is_shown_in_place(qapp):
+    from camera_roi import RoiManager, crop_square
+
+    class FakeCamera():
+        def set_roi(self, *roi):
+            pass
+
+    manager = RoiManager(FakeCamera(), adaptive=True)
+    roi = manager.roi
+    frame = np.random.default_rng(0).integers(0, 256, size=(roi[3], roi[2]), dtype=np.uint8)
+    preparer = DisplayPreparer(roi_manager=manager)
+    preparer.receive_frame(frame)
+    preparer.receive_frame(make_frame()[:100]) # Unknown readout, not shown
+    display_frame = preparer.prepare()
+
+    overview = display_frame.overview.array
+    assert overview.shape == (512, 1024)
+    x_start, y_start = roi[0] // 2, (roi[1] - 512) // 2
+    assert np.array_equal(overview[y_start:y_start + roi[3] // 2, x_start:x_start + roi[2] // 2],
+                          cv2.resize(frame, (roi[2] // 2, roi[3] // 2)))
+    assert not overview[:, :x_start].any() # The other panel is dark
+    assert np.array_equal(display_frame.zoomed.array, cv2.resize(crop_square(frame, roi, manager.crop_center), (512, 512)))
+
+def test_preparer_keeps_only_the_latest_panels(qapp):
+    preparer = DisplayPreparer()
+    notifications = []
+    preparer.subscribe("display_ready", notifications.append)
+
+    for seed in range(5):
+        preparer.receive_frame(make_frame(seed))
+        preparer.post(preparer.prepare())
+    assert len(notifications) == 1 # The GUI is told once until it takes the panels
+
+    display_frame = preparer.take()
+    assert display_frame.versions["overview"] == 5
+    assert preparer.take() is None
+    assert len(preparer.free) == 2
+    preparer.release(display_frame)
+    assert len(preparer.free) == 3
+
+    preparer.receive_segmented(make_inputs(None)["segmented"])
+    preparer.post(preparer.prepare())
+    assert len(notifications) == 2
+
+def test_display_thread_updates_main_window(qtbot):
+    core_wrap = CoreWrapper(False)
+    window = MainWindow(core_wrap, LiveStreamWrapper(False), False)
+    qtbot.addWidget(window)
+    window.computer_vision_thread = ComputerVisionThread(core_wrap, False)
+    display_thread = DisplayThread()
+    display_thread.display_ready.connect(window.update_display)
+    window.display_thread = display_thread
+    display_thread.start()
+
+    inputs = make_inputs(make_frame())
+    display_thread.worker.receive_frame(inputs["frame"])
+    display_thread.worker.receive_segmented(inputs["segmented"])
+    qtbot.waitUntil(lambda: window.shown_versions.get("segmented") == 1, timeout=2000)
+    assert not window.left_label.pixmap().isNull()
+    assert not window.zoomed_label.pixmap().isNull()
+    assert not window.segmented_label.pixmap().isNull()
+
+    # Frames delivered to the update slots are handed to the display thread, not prepared on the GUI thread
+    window.update_skeleton_image(inputs["track_image"])
+    qtbot.waitUntil(lambda: window.shown_versions.get("track_image") == 1, timeout=2000)
+    assert not window.skeleton_label.pixmap().isNull()
+
+    qtbot.mouseClick(window.track_other_panel_button, QtCore.Qt.LeftButton)
+    assert window.zoomed_video_title.text() == "LEFT CROPPED"
+    display_thread.stop()
+
+def test_rate_meter():
+    meter = RateMeter(window=1.0)
+    assert meter.rate(now=0.0) == 0.0
+    for i in range(11):
+        meter.tick(now=i * 0.05)
+    assert meter.rate(now=0.5) == pytest.approx(20.0)
+    assert meter.rate(now=2.0) == 0.0 # Old events leave the window
+
+def test_display_refresh_is_capped_and_frames_are_dropped():
+    preparer = DisplayPreparer(max_fps=20)
+    preparer.subscribe("display_ready", lambda value: preparer.release(preparer.take()))
+    preparer.start()
+    frame = make_frame()
+    start = time.perf_counter()
+    while time.perf_counter() - start < 0.5:
+        preparer.receive_frame(frame) # Camera far faster than the display
+        time.sleep(0.002)
+    preparer.stop()
+
+    display_fps, acquisition_fps = preparer.rates()
+    assert acquisition_fps > 100
+    assert 0 < display_fps <= 22
+    assert preparer.display_meter.times[-1] - preparer.display_meter.times[0] > 0.3
+
+def test_dashboard_shows_sampled_metrics(qtbot):
+    registry = MetricsRegistry()
+    dashboard = MetricsDashboard(registry)
+    qtbot.addWidget(dashboard)
+    dashboard.show()
+    for _ in range(5):
+        registry.count("cv_frames_dropped")
+    registry.observe("cv_latency", 0.095)
+    dashboard.refresh()
+    assert dashboard.value_labels["cv_latency"].text() == "95.0 ms"
+    assert dashboard.value_labels["cv_frames_dropped"].text().endswith("(5 total)")
+    assert dashboard.value_labels["tracker_steps"].text() == "-"
+    assert len(dashboard.sparklines["cv_latency"].values) == 1
+    dashboard.hide()
+    assert not dashboard.timer.isActive()
+
+def test_profile_button_writes_a_profile(qtbot, tmp_path):
+    window = MainWindow(CoreWrapper(False), LiveStreamWrapper(False), False)
+    qtbot.addWidget(window)
+    window.profile_seconds = 0.2
+    window.profile_directory = str(tmp_path)
+    qtbot.mouseClick(window.profile_button, QtCore.Qt.LeftButton)
+    assert not window.profile_button.isEnabled()
+    qtbot.waitUntil(lambda: window.profile_button.isEnabled(), timeout=3000)
+    assert sorted(os.path.splitext(name)[1] for name in os.listdir(tmp_path)) == [".collapsed", ".txt"]
+    assert "GUI" in window.profiler.thread_samples()
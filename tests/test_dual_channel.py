@@ -0,0 +1,125 @@
+import sys
+import os
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from dual_channel import *
+from camera_roi import FULL_ROI, RoiManager, panel_center
+from image_processing import ImageSegmentation
+from tracking_engine import FrameSegmenter
+from hardware_wrappers import CoreWrapper
+from metrics import MetricsRegistry
+
+def split_frame(spot, offset=(0, 0), brightness=(200, 200), seed=0):
+    # Full readout with the same noisy scene in both panels and a bright spot at a position relative to
+    # the right panel's centre, the left panel shifted by offset
+    rng = np.random.default_rng(seed)
+    scene = rng.integers(0, 60, size=(1024 + 64, 1024 + 64)).astype(np.float64)
+    center = (512 + 32, 512 + 32)
+    scene[center[1] + spot[1] - 8:center[1] + spot[1] + 8, center[0] + spot[0] - 8:center[0] + spot[0] + 8] = 255
+    frame = np.zeros((1024, 2048))
+    frame[:, 1024:] = scene[32:32 + 1024, 32:32 + 1024] * brightness[0] / 255
+    frame[:, :1024] = scene[32 - offset[1]:32 - offset[1] + 1024, 32 - offset[0]:32 - offset[0] + 1024] * brightness[1] / 255
+    return frame.astype(np.uint8)
+
+def test_both_channels_segment_as_one():
+    frame = split_frame((40, -25))
+    dual_channel = DualChannel(offset=(0, 0))
+    pair = dual_channel.crop_pair(frame, FULL_ROI, panel_center(True), True)
+    for inverse in (False, True):
+        segmented = dual_channel.segment(dual_channel.resize_pair(pair), inverse)
+        centers = dual_channel.centers(segmented)[0]
+        for channel in range(2):
+            single = (ImageSegmentation.inverted_binary_thresholding if inverse else ImageSegmentation.binary_thresholding)(pair[channel].copy())
+            assert np.array_equal(segmented[channel], single)
+            assert (int(centers[channel][0]), int(centers[channel][1])) == ImageSegmentation.find_center(single)
+
+def test_histogram_thresholds_match_quantiles():
+    rng = np.random.default_rng(1)
+    for high in (2, 5, 256):
+        frames = rng.integers(0, high, size=(2, 512, 512)).astype(np.uint8)
+        for quantile in (FOREGROUND_QUANTILE, INVERSE_QUANTILE, 0.5):
+            thresholds = DualChannel.thresholds(frames, quantile)
+            for channel in range(2):
+                expected = frames[channel] >= np.quantile(frames[channel], quantile)
+                assert np.array_equal(frames[channel] >= thresholds[channel], expected)
+
+def test_registration_recovers_the_panel_offset():
+    frame = split_frame((0, 0), offset=(14, -8))
+    dual_channel = DualChannel()
+    pair = dual_channel.crop_pair(frame, FULL_ROI, panel_center(True), True)
+    assert dual_channel.offset == (14, -8)
+    assert np.array_equal(pair[0], pair[1]) # The secondary crop shows the same part of the scene
+
+    # Kept for the next frames, a binned frame registers in sensor pixels
+    dual_channel.crop_pair(split_frame((0, 0)), FULL_ROI, panel_center(True), True)
+    assert dual_channel.offset == (14, -8)
+    dual_channel.reset_registration()
+    binned = split_frame((0, 0), offset=(14, -8))[::2, ::2]
+    dual_channel.crop_pair(binned, FULL_ROI, panel_center(True), True, binning=2)
+    assert dual_channel.offset == (14, -8)
+
+def test_secondary_confirms_or_stands_in():
+    dual_channel = DualChannel(offset=(0, 0))
+    dual_channel.metrics = MetricsRegistry()
+    frame = split_frame((40, -25))
+    pair = dual_channel.crop_pair(frame, FULL_ROI, panel_center(True), True)
+    segmented, head, ratio = dual_channel.process(pair, False)
+    assert head == ImageSegmentation.find_center(ImageSegmentation.binary_thresholding(pair[0].copy()))
+    assert ratio is None and dual_channel.metrics.total("dual_confirmed") == 1
+
+    # The tracked panel goes dark, the other one still holds the target
+    pair[0] = 0
+    segmented, fallback_head, _ = dual_channel.process(pair, False)
+    assert fallback_head == head and np.any(segmented)
+    assert dual_channel.metrics.total("dual_fallbacks") == 1
+
+    pair[1] = 0
+    assert dual_channel.process(pair, False)[1] is None
+
+def test_ratio_image():
+    dual_channel = DualChannel(offset=(0, 0))
+    dual_channel.metrics = MetricsRegistry()
+    frame = split_frame((0, 0), brightness=(200, 100)).astype(np.uint16) * 10
+    pair = dual_channel.crop_pair(frame, FULL_ROI, panel_center(True), True)
+    segmented, head, ratio = dual_channel.process(pair, False, ratio=True)
+    assert ratio.shape == (512, 512) and ratio.dtype == np.float32
+    bright = ratio[segmented > 0]
+    assert bright.mean() == pytest.approx(2.0, abs=0.05)
+    assert dual_channel.metrics.gauges["channel_ratio"] == pytest.approx(bright.mean())
+
+def test_segmenter_in_dual_channel():
+    segmenter = FrameSegmenter(CoreWrapper(False), False, interval=0)
+    segmenter.metrics = MetricsRegistry()
+    segmenter.toggle_dual_channel()
+    segmenter.dual_channel.metrics = segmenter.metrics
+    published = {}
+    for event in ("target", "segmented", "ratio"):
+        segmenter.subscribe(event, lambda value, event=event: published.__setitem__(event, value))
+
+    frame = split_frame((40, -25), offset=(6, 4))
+    segmenter.receive_frame(frame)
+    segmenter.step()
+    assert segmenter.dual_channel.offset == (6, 4)
+    assert segmenter.metrics.total("dual_confirmed") == 1
+    target = published["target"]
+
+    frame[:, 1024:] = 0 # Only the other panel sees the specimen
+    segmenter.receive_frame(frame)
+    segmenter.step()
+    assert segmenter.metrics.total("dual_fallbacks") == 1
+    assert published["target"] == pytest.approx(target, abs=1)
+    assert published["ratio"].shape == (512, 512) and np.any(published["segmented"])
+
+    # Turning it off lets an adaptive readout narrow to the tracked panel, turning it on again
+    # reads out both panels, a frame already narrowed is segmented as a single channel
+    segmenter.roi_manager = RoiManager(CoreWrapper(False), adaptive=True)
+    segmenter.roi_manager.metrics = segmenter.metrics
+    segmenter.toggle_dual_channel()
+    narrowed = segmenter.roi_manager.roi
+    assert narrowed != FULL_ROI
+    segmenter.toggle_dual_channel()
+    assert segmenter.roi_manager.roi == FULL_ROI and segmenter.roi_manager.previous_roi == narrowed
+    segmenter.receive_frame(np.zeros((narrowed[3], narrowed[2]), dtype=np.uint8))
+    assert segmenter.metrics.total("dual_unavailable") == 1 and segmenter.sqr_crop_img.ndim == 2
@@ -16,23 +16,28 @@ def create_window():
     window = MainWindow(core_wrap,live_stream_wrap,MICROSCOPE_STATUS)
     print("Main Window Created")
 
+    display_thread = DisplayThread()
+    display_thread.display_ready.connect(window.update_display) # Panels are prepared off the GUI thread
+    window.display_thread = display_thread
+    display_thread.start()
+
     grab_image_thread = ImageGrabThread(live_stream_wrap, MICROSCOPE_STATUS) # New parameter
-    grab_image_thread.frame_ready.connect(window.update_image) # Sends captured image to MainWindow
+    grab_image_thread.frame_ready.connect(window.update_image) # Sends captured image to the display thread
     window.grab_image_thread = grab_image_thread
     grab_image_thread.start()
     print("Grab Image Thread Started")
 
     computer_vision_thread = ComputerVisionThread(core_wrap, MICROSCOPE_STATUS)
     grab_image_thread.frame_ready.connect(computer_vision_thread.receive_frame) # Sends captured image to ComputerVisionThread
-    computer_vision_thread.result_ready.connect(window.update_segmented_image) # Sends segmented image to MainWindow
-    computer_vision_thread.skeleton_ready.connect(window.update_skeleton_image)  # Sends skeleton image to MainWindow
+    computer_vision_thread.result_ready.connect(window.update_segmented_image) # Sends segmented image to the display thread
+    computer_vision_thread.skeleton_ready.connect(window.update_skeleton_image)  # Sends skeleton image to the display thread
     window.computer_vision_thread = computer_vision_thread
     computer_vision_thread.start()
     print("Computer Vision-Segmentation Thread Started")
 
     track_thread = TrackThread(core_wrap, MICROSCOPE_STATUS)
     track_thread.cur_coordinates_ready.connect(window.update_coordinates)
-    computer_vision_thread.tracking_ready.connect(track_thread.receive_tracking_pointer) # Sends tracking coordinates from ComputerVisionThread to TrackThread
+    track_thread.worker.follow(computer_vision_thread.worker) # Sends tracking coordinates from ComputerVisionThread to TrackThread
     window.track_thread = track_thread
     track_thread.start()
     print("Track Thread Started")
@@ -0,0 +1,49 @@
+import sys
+import os
+import pytest
+import numpy as np
+import h5py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts')))
+
+from hdf5_splitter import write_subvideo, split_video_parallel, subvideo_path
+
+def make_video(path, num_frames=12, chunks=(1, 32, 64), compression="gzip", compression_opts=4):
+    video = np.arange(num_frames * 32 * 64, dtype=np.uint16).reshape(num_frames, 32, 64)
+    with h5py.File(path, 'w') as file:
+        file.create_dataset('video_frames', data=video, chunks=chunks, compression=compression,
+                            compression_opts=compression_opts, maxshape=(None, 32, 64))
+    return video
+
+def test_matching_layout_copies_chunks_directly(tmp_path):
+    path = str(tmp_path / "video.h5")
+    video = make_video(path)
+
+    _, _, output_path, _, direct = write_subvideo(path, 'video_frames', 3, 7, str(tmp_path / "sub.h5"))
+    assert direct
+    with h5py.File(output_path, 'r') as file:
+        sub_video = file['video_frames']
+        assert sub_video.compression == "gzip" and sub_video.compression_opts == 4
+        assert np.array_equal(sub_video[:], video[3:8])
+
+def test_different_layout_streams_and_recompresses(tmp_path):
+    path = str(tmp_path / "video.h5")
+    video = make_video(path, chunks=(4, 32, 64))
+
+    # Start isn't aligned to the 4 frame chunks, and the output asks for another codec
+    _, end_index, output_path, _, direct = write_subvideo(path, 'video_frames', 2, 20, str(tmp_path / "sub.h5"),
+                                                          compression="lzf")
+    assert not direct
+    assert end_index == 11 # Clamped to the end of the video
+    with h5py.File(output_path, 'r') as file:
+        assert file['video_frames'].compression == "lzf"
+        assert np.array_equal(file['video_frames'][:], video[2:12])
+
+def test_split_runs_ranges_in_parallel(tmp_path):
+    path = str(tmp_path / "video.h5")
+    video = make_video(path)
+
+    results = list(split_video_parallel(path, 'video_frames', [(0, 3), (4, 11), (6, 6)], workers=2))
+    assert sorted(result[:2] for result in results) == [(0, 3), (4, 11), (6, 6)]
+    for start_index, end_index in [(0, 3), (4, 11), (6, 6)]:
+        with h5py.File(subvideo_path(path, start_index, end_index), 'r') as file:
+            assert np.array_equal(file['video_frames'][:], video[start_index:end_index + 1])
@@ -57,3 +57,14 @@ def test_image_grab_and_inverse_binthreshold():
     expected_pixel_coordinates = (351, 236)
     assert (actual_pixel_coordinates == expected_pixel_coordinates)
 
+
+def test_bin_image_averages_blocks_in_integers():
+    image = np.array([[1, 2, 3, 4, 9],
+                      [3, 4, 5, 7, 9],
+                      [9, 9, 9, 9, 9]], dtype=np.uint16)
+    binned = bin_image(image, 2)
+    assert binned.dtype == np.uint16
+    assert binned.tolist() == [[2, 4]] # Floor of the block means, the odd row and column are dropped
+    assert bin_image(image, 1) is image
+    big = np.full((4, 4), 65535, dtype=np.uint16)
+    assert bin_image(big, 2).tolist() == [[65535, 65535], [65535, 65535]] # No overflow
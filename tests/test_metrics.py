@@ -0,0 +1,63 @@
+import sys
+import os
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from metrics import *
+from tracking_engine import TrackingEngine
+from replay import Recording, ReplayStreamWrapper, ReplayCoreWrapper
+from test_tracking_engine import make_recording
+
+def test_registry_samples_rates_timings_and_gauges():
+    registry = MetricsRegistry(history=3)
+    registry.sample(now=0.0)
+    for _ in range(10):
+        registry.count("frames")
+    registry.observe("latency", 0.1)
+    registry.observe("latency", 0.3)
+    registry.set_gauge("queue", 2)
+
+    values = registry.sample(now=0.5)
+    assert values["frames"] == pytest.approx(20.0)
+    assert values["latency"] == pytest.approx(0.2)
+    assert values["queue"] == 2
+
+    # Nothing happened since, rates drop to zero and timings have no value
+    values = registry.sample(now=1.0)
+    assert values["frames"] == 0.0 and values["latency"] is None
+    assert registry.total("frames") == 10
+
+    registry.sample(now=1.5)
+    registry.sample(now=2.0)
+    assert registry.history("frames") == [0.0, 0.0, 0.0] # Only the latest samples are kept
+    assert registry.history("missing") == []
+
+def test_engine_workers_report_metrics(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path, num_frames=3)), realtime=False)
+    engine = TrackingEngine(ReplayCoreWrapper(live_stream_wrap), live_stream_wrap, False, segment_interval=0)
+    registry = MetricsRegistry()
+    for worker in engine.workers:
+        worker.metrics = registry
+    engine.tracker.stage_guard.metrics = registry
+    values = engine.queue("velocity", maxsize=1)
+
+    # Frames arriving before the segmenter gets to them are dropped
+    for _ in range(3):
+        engine.grabber.step()
+    assert registry.total("frames_captured") == 3
+    assert registry.total("cv_frames_dropped") == 2
+    assert registry.gauges["cv_queue"] == 1
+
+    engine.segmenter.step()
+    assert registry.gauges["cv_queue"] == 0
+    assert registry.timings["cv_latency"][1] == 1
+
+    engine.tracker.is_tracking_enabled = True
+    engine.tracker.step()
+    engine.tracker.step()
+    assert registry.total("tracker_steps") == 2
+    assert registry.total("stage_commands") == 2
+    assert registry.total("queue_dropped.velocity") == 1
+    assert values.qsize() == 1
+    engine.stop()
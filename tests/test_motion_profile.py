@@ -0,0 +1,67 @@
+import sys
+import os
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from motion_profile import *
+from stage_safety import StageGuard
+
+DT = 0.01
+
+def run_profile(profile, stage, requests, start=0.0):
+    # Feeds (x, y) requests every DT seconds and sends the profile's output to the simulated stage
+    now = start
+    for request in requests:
+        now += DT
+        stage.drive_stage(*profile.update(request, DT), 1, 1, False, now=now)
+    return now
+
+def test_profile_bounds_acceleration_and_jerk():
+    profile = MotionProfile(max_velocity=100, max_acceleration=1000, max_jerk=20000, axes=2)
+    stage = SimulatedStage()
+    run_profile(profile, stage, [(500, -40)] * 60)
+
+    x_velocities = [command[1] for command in stage.commands]
+    accelerations = [(b - a) / DT for a, b in zip([0.0] + x_velocities, x_velocities)]
+    jerks = [(b - a) / DT for a, b in zip([0.0] + accelerations, accelerations)]
+    assert max(abs(v) for v in x_velocities) == 100 # Clamped
+    assert max(abs(a) for a in accelerations) <= 1000 + 1e-6
+    landing = x_velocities.index(100)
+    assert max(abs(j) for j in jerks[:landing]) <= 20000 + 1e-6 # Landing on the target ends the ramp down early
+    assert stage.commands[-1][1:] == (100, -40)
+    assert profile.acceleration == [0.0, 0.0]
+
+def test_reversals_stop_first_on_the_simulated_stage():
+    profile = MotionProfile(max_velocity=100, max_acceleration=1000, max_jerk=20000, axes=2)
+    stage = SimulatedStage()
+    now = run_profile(profile, stage, [(80, 0)] * 30)
+    run_profile(profile, stage, [(-80, 0)] * 60, start=now)
+
+    x_velocities = [command[1] for command in stage.commands]
+    assert stage.reversals_without_stop == 0
+    assert x_velocities[-1] == -80
+    # Slowing down is smooth as well, no jump from 80 straight to 0
+    assert max(abs(b - a) for a, b in zip(x_velocities, x_velocities[1:])) <= 1000 * DT + 1e-6
+
+    # The stage keeps moving the other way
+    position = stage.position[0]
+    run_profile(profile, stage, [(-80, 0)] * 10, start=stage.last_time)
+    assert stage.position[0] < position
+
+def test_guard_sends_profiled_commands():
+    stage = SimulatedStage()
+    clock = [0.0]
+    guard = StageGuard(False, drive=lambda x, y, prev_x, prev_y, online: stage.drive_stage(x, y, prev_x, prev_y, online, now=clock[0]),
+                       profile=MotionProfile(max_acceleration=1000, max_jerk=20000))
+    for _ in range(5):
+        clock[0] += DT
+        guard.command(200, 0, 0.0, now=clock[0])
+    assert 0 < stage.velocity[0] < 200
+
+    for _ in range(100):
+        clock[0] += DT
+        guard.command(-200, 0, 0.0, now=clock[0])
+    assert stage.velocity[0] == -200 and stage.reversals_without_stop == 0
+
+    guard.stop() # Immediate, and the profile starts again from rest
+    assert stage.velocity == (0.0, 0.0) and guard.profile.velocity == [0.0, 0.0]
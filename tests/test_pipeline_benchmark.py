@@ -0,0 +1,63 @@
+import sys
+import os
+import json
+import pytest
+from click.testing import CliRunner
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../benchmarks')))
+
+from pipeline_benchmark import *
+
+def make_results(**medians):
+    return {"benchmarks": {name: ({"error": "boom"} if median is None else {"median_ms": median})
+                           for name, median in medians.items()}}
+
+def test_time_function_batches_fast_calls():
+    calls = []
+    result = time_function(lambda: calls.append(1), repeat=3, min_time=0.001)
+    assert result["repeat"] == 3 and result["calls"] > 1
+    assert 0 < result["min_ms"] <= result["median_ms"]
+
+def test_run_benchmarks_on_the_simulated_recording():
+    results = run_benchmarks(repeat=2, min_time=0.001, num_frames=4, only=("find_center", "pipeline_end_to_end"))
+    assert set(results["benchmarks"]) == {"find_center", "pipeline_end_to_end"}
+    pipeline = results["benchmarks"]["pipeline_end_to_end"]
+    # Every frame is segmented and the blob is found in each of them
+    assert pipeline["frames"] == 4 and pipeline["tracked"] == 4 and pipeline["dropped"] == 0
+    assert pipeline["fps"] == pytest.approx(1000 / pipeline["median_ms"])
+    json.dumps(results)
+
+def test_compare_flags_regressions_beyond_tolerance():
+    baseline = make_results(fast=1.0, slow=1.0, same=1.0, gone=1.0, broken=1.0, never=None)
+    results = make_results(fast=0.5, slow=1.3, same=1.1, broken=None, never=None, added=2.0)
+    rows = {row["name"]: row for row in compare_results(results, baseline, tolerance=0.15)}
+
+    assert rows["fast"]["status"] == "improved"
+    assert rows["slow"]["status"] == "regressed" and rows["slow"]["ratio"] == pytest.approx(1.3)
+    assert rows["same"]["status"] == "ok"
+    assert rows["gone"]["status"] == "missing"
+    assert rows["broken"]["status"] == "broken"
+    assert rows["never"]["status"] == "error"
+    assert rows["added"]["status"] == "new"
+    assert has_regressions(rows.values())
+    assert not has_regressions([rows["fast"], rows["same"], rows["never"], rows["added"]])
+
+def test_compare_flags_dropped_frames():
+    baseline = {"benchmarks": {"pipeline_end_to_end": {"median_ms": 10.0, "dropped": 0}}}
+    results = {"benchmarks": {"pipeline_end_to_end": {"median_ms": 10.0, "dropped": 7}}}
+    row = compare_results(results, baseline)[0]
+    assert row["status"] == "regressed" and row["dropped"] == (0, 7)
+    assert describe_row(row) == "pipeline_end_to_end: 10 ms -> 10 ms (+0.0%, dropped 0 -> 7 frames) regressed"
+    assert compare_results(baseline, results)[0]["status"] == "ok"
+
+def test_compare_command_exit_status(tmp_path):
+    baseline_path, results_path = str(tmp_path / "baseline.json"), str(tmp_path / "results.json")
+    with open(baseline_path, "w") as f:
+        json.dump(make_results(find_center=1.0), f)
+    with open(results_path, "w") as f:
+        json.dump(make_results(find_center=1.2), f)
+
+    result = CliRunner().invoke(cli, ["compare", baseline_path, results_path, "--tolerance", "0.25"])
+    assert result.exit_code == 0, result.output
+    result = CliRunner().invoke(cli, ["compare", baseline_path, results_path, "--tolerance", "0.1"])
+    assert result.exit_code == 1
+    assert "find_center: 1 ms -> 1.2 ms (+20.0%) regressed" in result.output
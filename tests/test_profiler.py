@@ -0,0 +1,56 @@
+import sys
+import os
+import time
+import threading
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from profiler import *
+
+def busy_loop(stop_event):
+    name_current_thread("Busy")
+    while not stop_event.is_set():
+        sum(range(1000))
+
+def test_profiler_samples_named_threads(tmp_path):
+    stop_event = threading.Event()
+    thread = threading.Thread(target=busy_loop, args=(stop_event,))
+    thread.start()
+    profiler = SamplingProfiler(interval=0.002, threads=("Busy",))
+    profiler.start(seconds=0.3)
+    profiler.thread.join(timeout=5)
+    stop_event.set()
+    thread.join()
+
+    assert not profiler.is_running()
+    assert profiler.num_samples > 10 and profiler.seconds >= 0.3
+    assert set(profiler.thread_samples()) == {"Busy"}
+
+    # Every stack starts at the thread and ends in the busy loop
+    lines = profiler.collapsed()
+    stack, count = lines[0].rsplit(" ", 1)
+    assert stack.startswith("Busy;") and int(count) > 0
+    assert sum(int(line.rsplit(" ", 1)[1]) for line in lines) == profiler.thread_samples()["Busy"]
+
+    rows = profiler.summary()
+    busy = [row for row in rows if row["function"].startswith("busy_loop (test_profiler.py")][0]
+    assert busy["total"] == profiler.thread_samples()["Busy"]
+    assert busy["self"] <= busy["total"]
+
+    collapsed_path, summary_path = profiler.save(str(tmp_path), prefix="test")
+    with open(collapsed_path) as f:
+        assert f.read().splitlines() == lines
+    with open(summary_path) as f:
+        summary = f.read()
+    assert "Busy (" in summary and "busy_loop" in summary
+
+def test_summary_counts_self_and_total():
+    profiler = SamplingProfiler()
+    profiler.stacks = {("GUI", ("main", "update", "paint")): 3, ("GUI", ("main", "update")): 1,
+                       ("FrameSegmenter", ("run", "step")): 2}
+    rows = {(row["thread"], row["function"]): row for row in profiler.summary()}
+    assert rows[("GUI", "update")] == {"thread": "GUI", "function": "update", "self": 1, "total": 4}
+    assert rows[("GUI", "paint")]["self"] == 3
+    assert rows[("FrameSegmenter", "step")]["total"] == 2
+    assert [row["function"] for row in profiler.summary()][:2] == ["update", "main"] # Ties go to the busier function
+    assert profiler.collapsed()[0] == "FrameSegmenter;run;step 2"
@@ -0,0 +1,43 @@
+import sys
+import os
+import time
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts')))
+
+from record_raw import FramePacer
+
+def test_frame_pacer_holds_target_rate_without_drift():
+    fps = 100
+    pacer = FramePacer(fps)
+    ticks = []
+    walls = []
+    for i in range(50):
+        tick, wall = pacer.wait_for_next_frame()
+        ticks.append(tick)
+        walls.append(wall)
+        time.sleep(0.003) # Simulated per-frame work, should not push the schedule back
+
+    # Deadlines are anchored to the first frame, so the total span matches the frame count
+    assert ticks[-1] - ticks[0] == pytest.approx(49 / fps, abs=0.01)
+    assert all(b > a for a, b in zip(ticks, ticks[1:]))
+    assert walls[-1] >= walls[0]
+
+    stats = pacer.jitter_stats()
+    assert stats["intervals"] == 49
+    assert stats["mean_interval_ms"] == pytest.approx(10, abs=1)
+    assert stats["missed_deadlines"] == 0
+
+def test_frame_pacer_skips_missed_slots():
+    pacer = FramePacer(100)
+    pacer.wait_for_next_frame()
+    time.sleep(0.035) # Overrun by more than three periods
+    pacer.wait_for_next_frame()
+    tick, _ = pacer.wait_for_next_frame()
+
+    assert pacer.jitter_stats()["missed_deadlines"] >= 2
+    # Next deadline stays on the original grid instead of bursting to catch up
+    assert (pacer.next_deadline - pacer.start_time) / pacer.period == pytest.approx(round((pacer.next_deadline - pacer.start_time) / pacer.period), abs=1e-6)
+    assert pacer.next_deadline > tick
+
+    pacer.reset()
+    assert pacer.jitter_stats()["intervals"] == 0
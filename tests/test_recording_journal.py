@@ -0,0 +1,136 @@
+import sys
+import os
+import ast
+import time
+import subprocess
+import textwrap
+import pytest
+import numpy as np
+import tifffile
+import h5py
+SCRIPTS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts'))
+sys.path.insert(0, SCRIPTS_PATH)
+
+from recording_journal import RecordingJournal, recover_recording, recover_video_hdf5, frame_index
+
+HEADER = '(Frame count, (X coord, Y coord), Elapsed Time, Wall Clock Time) \n'
+
+# Writer that records forever until killed, printing the count after every frame
+TIFF_WRITER = textwrap.dedent("""
+    import sys, time
+    import numpy as np
+    sys.path.insert(0, {scripts!r})
+    from recording_journal import RecordingJournal
+    journal = RecordingJournal({folder!r}, {log!r}, header={header!r}, checkpoint_interval=5)
+    i = 0
+    while True:
+        journal.append(np.full((64, 64), i, dtype=np.uint16), i, -i, i * 0.1, time.time())
+        i += 1
+        print(i, flush=True)
+""")
+
+HDF5_WRITER = textwrap.dedent("""
+    import sys
+    import numpy as np
+    import h5py
+    sys.path.insert(0, {scripts!r})
+    from recording_journal import checkpoint_video_hdf5
+    with h5py.File({path!r}, 'w') as hdf5_file:
+        video = hdf5_file.create_dataset('video_frames', shape=(0, 64, 64), maxshape=(None, 64, 64),
+                                         chunks=(1, 64, 64), compression='gzip', dtype='uint16')
+        i = 0
+        while True:
+            video.resize(i + 1, axis=0)
+            video[i] = i
+            i += 1
+            if i % 5 == 0:
+                checkpoint_video_hdf5(hdf5_file, video, i)
+            print(i, flush=True)
+""")
+
+def run_and_kill(script, min_frames):
+    # Start the writer, let it get past a few checkpoints, then kill it without any cleanup
+    process = subprocess.Popen([sys.executable, "-c", script], stdout=subprocess.PIPE, text=True)
+    written = 0
+    while written < min_frames:
+        written = int(process.stdout.readline())
+    process.kill()
+    process.wait()
+    return written
+
+def read_log(log_path):
+    with open(log_path, 'r') as file:
+        lines = file.read().split('\n')
+    assert lines[-1] == ''
+    return [ast.literal_eval(line) for line in lines[1:-1]]
+
+def test_killed_tiff_recording_recovers_and_resumes(tmp_path):
+    folder = str(tmp_path / "recording_test")
+    log = str(tmp_path / "recording_log_test.txt")
+    os.makedirs(folder)
+    run_and_kill(TIFF_WRITER.format(scripts=SCRIPTS_PATH, folder=folder, log=log, header=HEADER), 23)
+
+    journal = recover_recording(folder)
+    frames = journal.count
+    assert frames >= 20 # Everything up to the last checkpoint before the kill
+
+    entries = read_log(log)
+    assert [entry[0] for entry in entries] == list(range(frames))
+    indices = sorted(frame_index(name) for name in os.listdir(folder) if frame_index(name) is not None)
+    assert indices == list(range(frames))
+    assert not [name for name in os.listdir(folder) if name.endswith(".part")]
+    for i in range(frames):
+        assert tifffile.imread(os.path.join(folder, "frame_" + str(i) + ".tif"))[0, 0] == i
+
+    # Appending continues the frame numbering and the elapsed time
+    journal.append(np.zeros((64, 64), dtype=np.uint16), 0, 0, 0.0, time.time())
+    journal.close()
+    entries = read_log(log)
+    assert entries[-1][0] == frames
+    assert entries[-1][2] >= entries[-2][2]
+    assert os.path.exists(os.path.join(folder, "frame_" + str(frames) + ".tif"))
+
+def test_recover_discards_incomplete_tail(tmp_path):
+    folder = str(tmp_path / "recording_test")
+    log = str(tmp_path / "recording_log_test.txt")
+    os.makedirs(folder)
+    journal = RecordingJournal(folder, log, header=HEADER, checkpoint_interval=100)
+    for i in range(4):
+        journal.append(np.zeros((8, 8), dtype=np.uint16), i, i, i * 0.1, 1000.0 + i)
+    journal.text_file.write(b"(4, (4, 4), 0.")  # Crash in the middle of a log line
+    journal.text_file.flush()
+    os.remove(os.path.join(folder, "frame_3.tif")) # Frame 3 was never made durable
+    tifffile.imwrite(os.path.join(folder, "frame_4.tif.part"), np.zeros((8, 8), dtype=np.uint16))
+
+    recovered = recover_recording(folder)
+    recovered.close()
+    assert recovered.count == 3
+    assert [entry[0] for entry in read_log(log)] == [0, 1, 2]
+    assert sorted(os.listdir(folder)) == ["checkpoint.json", "frame_0.tif", "frame_1.tif", "frame_2.tif"]
+
+def test_killed_hdf5_conversion_recovers(tmp_path):
+    path = str(tmp_path / "video.h5")
+    run_and_kill(HDF5_WRITER.format(scripts=SCRIPTS_PATH, path=path), 23)
+
+    frames = recover_video_hdf5(path)
+    assert frames >= 20 and frames % 5 == 0
+    with h5py.File(path, 'r') as hdf5_file:
+        video = hdf5_file['video_frames']
+        assert video.shape[0] == frames
+        assert np.array_equal(video[:, 0, 0], np.arange(frames))
+
+def test_unjournaled_hdf5_is_left_alone(tmp_path):
+    # A complete video without checkpoints, and a file holding something else
+    complete = str(tmp_path / "complete.h5")
+    foreign = str(tmp_path / "foreign.h5")
+    with h5py.File(complete, 'w') as hdf5_file:
+        hdf5_file.create_dataset('video_frames', data=np.arange(10, dtype=np.uint16).reshape(10, 1, 1), maxshape=(None, 1, 1))
+    with h5py.File(foreign, 'w') as hdf5_file:
+        hdf5_file.create_dataset('frames', data=np.zeros((3, 4, 4), dtype=np.uint16))
+    contents = {path: open(path, 'rb').read() for path in (complete, foreign)}
+
+    for path in (complete, foreign):
+        with pytest.raises(ValueError):
+            recover_video_hdf5(path)
+        with open(path, 'rb') as file:
+            assert file.read() == contents[path]
@@ -0,0 +1,78 @@
+import sys
+import os
+import time
+import pytest
+import numpy as np
+import h5py
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts')))
+
+from recording_reader import Recording, ChunkCache
+from recording_journal import RecordingJournal
+
+HEADER = '(Frame count, (X coord, Y coord), Elapsed Time, Wall Clock Time) \n'
+
+def make_video():
+    return np.arange(12 * 20 * 30, dtype=np.uint16).reshape(12, 20, 30)
+
+def make_tiff_recording(tmp_path, video, compression_level=0):
+    folder = str(tmp_path / "recording_01012025_120000")
+    os.makedirs(folder)
+    journal = RecordingJournal(folder, str(tmp_path / "recording_log_01012025_120000.txt"), header=HEADER,
+                               compression_level=compression_level)
+    for i, frame in enumerate(video):
+        journal.append(frame, 10.0 * i, -5.0 * i, 0.1 * i, 1000.0 + 0.1 * i)
+    journal.close()
+    return folder
+
+def make_hdf5_recording(tmp_path, video, **kwargs):
+    path = str(tmp_path / "video.h5")
+    with h5py.File(path, 'w') as file:
+        file.create_dataset('video_frames', data=video, **kwargs)
+    return path
+
+KEYS = [
+    5, -1, slice(None), slice(2, 9, 3), (slice(None), 4, 7), (3, slice(5, 15), slice(None, None, -2)),
+    [0, 11, 4], (Ellipsis, 3), (slice(1, 10), slice(2, 19), [0, 29, 14]),
+]
+
+@pytest.mark.parametrize("layout", ["tiff", "tiff_compressed", "hdf5_frames", "hdf5_bricks", "hdf5_contiguous"])
+def test_numpy_indexing_matches_array(tmp_path, layout):
+    video = make_video()
+    if layout == "tiff":
+        path = make_tiff_recording(tmp_path, video)
+    elif layout == "tiff_compressed":
+        path = make_tiff_recording(tmp_path, video, compression_level=3)
+    elif layout == "hdf5_frames":
+        path = make_hdf5_recording(tmp_path, video, chunks=(1, 20, 30), compression='gzip')
+    elif layout == "hdf5_bricks":
+        path = make_hdf5_recording(tmp_path, video, chunks=(4, 8, 8), compression='lzf')
+    else:
+        path = make_hdf5_recording(tmp_path, video)
+
+    with Recording(path) as recording:
+        assert recording.shape == video.shape and len(recording) == 12
+        for key in KEYS:
+            assert np.array_equal(recording[key], video[key]), key
+        with pytest.raises(IndexError):
+            recording[12]
+
+def test_frames_are_joined_with_stage_positions(tmp_path):
+    video = make_video()
+    with Recording(make_tiff_recording(tmp_path, video)) as recording:
+        assert recording.stage_position(3) == (30.0, -15.0)
+        rows = list(recording.frames_with_positions(2, 4))
+        assert [(x, y) for _, x, y, _ in rows] == [(20.0, -10.0), (30.0, -15.0)]
+        assert np.array_equal(rows[0][0], video[2])
+        assert recording.wall[1] == pytest.approx(1000.1)
+
+def test_chunk_cache_respects_memory_limit():
+    cache = ChunkCache(max_bytes=3 * 800)
+    loads = []
+    def load(key):
+        loads.append(key)
+        return np.zeros(100, dtype=np.float64) # 800 bytes
+    for key in [0, 1, 2, 0, 3, 1]:
+        cache.get(key, lambda: load(key))
+    assert loads == [0, 1, 2, 3, 1] # 0 was kept by its recent use, 1 was evicted
+    assert cache.nbytes <= 3 * 800
+    assert cache.hits == 1
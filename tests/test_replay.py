@@ -0,0 +1,74 @@
+import sys
+import os
+import json
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from replay import *
+from recording_journal import RecordingJournal
+
+NUM_FRAMES = 6
+STEP = 10 # Stage moves this far in x every frame
+OFFSET = 100 # Worm is this many camera pixels right of the crop centre
+
+def make_recording(tmp_path):
+    # A bright square OFFSET pixels right of the centre of the right panel, stage moving in x
+    recording_path = tmp_path / "recording_test"
+    recording_path.mkdir()
+    journal = RecordingJournal(str(recording_path), str(tmp_path / "recording_log_test.txt"), header="header\n")
+    rng = np.random.default_rng(0)
+    for i in range(NUM_FRAMES):
+        frame = rng.poisson(100, size=(1024, 2048)).astype(np.uint16)
+        frame[492:532, 1024 + 512 + OFFSET - 20:1024 + 512 + OFFSET + 20] = 4000
+        journal.append(frame, STEP * i, 5.0, 0.1 * i, 1000.0 + 0.1 * i)
+    journal.close()
+    return str(recording_path)
+
+def test_replay_stream_serves_frames_and_logged_positions(tmp_path):
+    recording = Recording(make_recording(tmp_path))
+    live_stream_wrap = ReplayStreamWrapper(recording, realtime=False, start_index=2)
+    core_wrap = ReplayCoreWrapper(live_stream_wrap)
+
+    assert live_stream_wrap.num_frames == NUM_FRAMES - 2
+    for index in range(2, NUM_FRAMES):
+        frame = live_stream_wrap.snap(False)
+        assert frame.shape == (1024, 2048)
+        assert GetStageCoords(core_wrap, False).get_x_coord() == STEP * index
+    assert not live_stream_wrap.finished
+
+    # Without looping the last frame is held
+    live_stream_wrap.snap(False)
+    assert live_stream_wrap.finished
+    assert core_wrap.get_x_position() == STEP * (NUM_FRAMES - 1)
+
+def test_replay_realtime_follows_recorded_times(tmp_path):
+    recording = Recording(make_recording(tmp_path))
+    live_stream_wrap = ReplayStreamWrapper(recording, realtime=True, stop_index=4)
+    s = time.perf_counter()
+    for _ in range(4):
+        live_stream_wrap.snap(False)
+    assert time.perf_counter() - s >= 0.3 - 0.01
+
+def test_replay_session_reports_targets(tmp_path):
+    with Recording(make_recording(tmp_path)) as recording:
+        report = replay_session(recording, lag=1)
+
+    assert report["num_frames"] == NUM_FRAMES
+    assert report["tracked"] == NUM_FRAMES
+    assert report["lost"] == 0 and report["errors"] == 0
+
+    # Target is OFFSET pixels right of the stage, in stage units
+    scale = 0.1 * (770 / 512) * (512 / 770)
+    for frame in report["frames"]:
+        assert frame["target"][0] - frame["stage"][0] == pytest.approx(OFFSET * scale, abs=0.3)
+        assert frame["target"][1] == pytest.approx(5.0, abs=0.3)
+        assert frame["velocity"][0] > 0
+
+    assert report["target_error"]["compared"] == NUM_FRAMES - 1
+    assert report["target_error"]["max"] < abs(STEP - OFFSET * scale) + 0.3
+
+    comparison = compare_reports(report, json.loads(json.dumps(report)))
+    assert comparison["compared"] == NUM_FRAMES
+    assert comparison["target_shift"]["max"] == 0
+    assert comparison["newly_lost"] == [] and comparison["newly_tracked"] == []
@@ -0,0 +1,68 @@
+import sys
+import os
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+import resources
+from resources import *
+from image_processing import ImageGrabber
+from hardware_wrappers import CoreWrapper, LiveStreamWrapper
+from tracking_engine import FrameSegmenter
+
+@pytest.fixture
+def fake_repo(tmp_path, monkeypatch):
+    # Repository with its own offline frame, so detached mode works wherever the tests run
+    (tmp_path / "tests").mkdir()
+    frame = np.random.default_rng(0).integers(0, 4000, size=(2048, 2048)).astype(np.uint16)
+    np.save(tmp_path / "tests" / "hongruo.npy", frame)
+    monkeypatch.setattr(resources, "repo_root", str(tmp_path))
+    clear_cache()
+    yield frame
+    clear_cache()
+
+def test_resource_paths_are_portable():
+    assert resource_path("assets", "cv_error.npy") == os.path.join(resources.repo_root, "assets", "cv_error.npy")
+    assert os.path.exists(resource_path("assets", "cv_error.npy"))
+    assert os.path.exists(loading_screen_path())
+
+def test_arrays_are_loaded_once_and_read_only():
+    first = error_image()
+    assert error_image() is first
+    assert not first.flags.writeable
+    with pytest.raises(ValueError):
+        first[0, 0] = 1
+
+def test_detached_frames_come_from_the_cache(fake_repo):
+    image = ImageGrabber(False).get_image(LiveStreamWrapper(False))
+    expected = (fake_repo[512:1536,:] / fake_repo[512:1536,:].max() * 255).astype("uint8")
+    assert np.array_equal(image, expected)
+    assert ImageGrabber(False).get_image(LiveStreamWrapper(False)) is image
+    assert np.array_equal(LiveStreamWrapper(False).snap(False), fake_repo)
+
+def test_missing_offline_frame_names_the_searched_paths(tmp_path, monkeypatch):
+    monkeypatch.setattr(resources, "repo_root", str(tmp_path))
+    with pytest.raises(FileNotFoundError, match="hongruo.npy"):
+        offline_frame_path()
+
+def test_segmentation_errors_are_rate_limited(capsys):
+    segmenter = FrameSegmenter(CoreWrapper(False), False, interval=0)
+    def fail(sqr_crop_img):
+        raise RuntimeError("bad frame")
+    segmenter.process_frame = fail
+    published = {"segmented": 0, "target": []}
+    segmenter.subscribe("segmented", lambda value: published.__setitem__("segmented", published["segmented"] + 1))
+    segmenter.subscribe("target", published["target"].append)
+
+    for _ in range(5):
+        segmenter.frame_event.set()
+        segmenter.step()
+    assert published["target"] == [-1] * 5 # The tracker hears about every error
+    assert published["segmented"] == 1
+    assert capsys.readouterr().out.count("Computer vision error") == 1
+
+    segmenter.last_error_report -= segmenter.error_interval
+    segmenter.frame_event.set()
+    segmenter.step()
+    assert published["segmented"] == 2
+    assert "(4 more since the last report)" in capsys.readouterr().out
@@ -0,0 +1,44 @@
+import sys
+import os
+import subprocess
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from startup import *
+
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '../src'))
+
+def test_engine_import_skips_heavy_modules():
+    # Run in a fresh interpreter, this one has imported everything already
+    code = ("import sys; sys.path.insert(0, " + repr(SRC_PATH) + "); import tracking_engine; "
+            "print(sorted(name for name in ('PyQt5', 'matplotlib', 'pycromanager', 'cv2', 'scipy') if name in sys.modules))")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == "[]"
+
+def test_lazy_module_imports_on_first_use():
+    module = LazyModule("json")
+    assert not module.is_loaded()
+    assert module.dumps([1]) == "[1]"
+    assert module.is_loaded()
+    assert module.load() is sys.modules["json"]
+
+    # Submodules listed in imports are available as attributes of the package
+    assert scipy.ndimage.center_of_mass is sys.modules["scipy.ndimage"].center_of_mass
+
+def test_preload_modules():
+    module = LazyModule("colorsys")
+    preload_modules(module).join(timeout=10)
+    assert module.is_loaded()
+
+def test_connect_hardware_and_startup_timer():
+    timer = StartupTimer()
+    live_stream_wrap, core_wrap = connect_hardware(False)
+    assert isinstance(live_stream_wrap, LiveStreamWrapper)
+    assert isinstance(core_wrap, CoreWrapper)
+    timer.mark("Hardware")
+    timer.mark("First frame")
+
+    assert 0 <= timer.elapsed("Hardware") <= timer.elapsed("First frame")
+    assert timer.elapsed("Missing") is None
+    lines = timer.report().splitlines()
+    assert lines[0].startswith("Hardware: ") and lines[1].startswith("First frame: ")
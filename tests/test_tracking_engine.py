@@ -0,0 +1,214 @@
+import sys
+import os
+import time
+import numpy as np
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from tracking_engine import *
+from replay import Recording, ReplayStreamWrapper, ReplayCoreWrapper
+from recording_journal import RecordingJournal
+from stage_safety import StageGuard
+from metrics import MetricsRegistry
+
+def make_recording(tmp_path, num_frames=6):
+    # A bright square in the centre of the right panel, stage moving 10 per frame in x
+    recording_path = tmp_path / "recording_test"
+    recording_path.mkdir()
+    journal = RecordingJournal(str(recording_path), str(tmp_path / "recording_log_test.txt"), header="header\n")
+    rng = np.random.default_rng(0)
+    for i in range(num_frames):
+        frame = rng.poisson(100, size=(1024, 2048)).astype(np.uint16)
+        frame[492:532, 1536 - 20:1536 + 20] = 4000
+        journal.append(frame, 10.0 * i, 5.0, 0.05 * i, 1000.0 + 0.05 * i)
+    journal.close()
+    return str(recording_path)
+
+def test_engine_runs_headless_on_a_replay(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path)), realtime=True)
+    core_wrap = ReplayCoreWrapper(live_stream_wrap)
+    engine = TrackingEngine(core_wrap, live_stream_wrap, False, segment_interval=0, track_interval=0.01)
+
+    targets = []
+    frames = []
+    engine.subscribe("target", targets.append)
+    engine.subscribe("frame", lambda frame: frames.append(frame.shape))
+    coordinates = engine.queue("coordinates")
+    finished = engine.queue("finished")
+
+    engine.start()
+    assert engine.wait_until_finished(timeout=10)
+    finished.get(timeout=1)
+    latest = coordinates.get(timeout=2)
+    engine.stop(timeout=2)
+
+    assert frames == [(1024, 2048)] * 6
+    assert len(targets) >= 1
+    for target in targets:
+        assert target != -1
+        assert target[1] == pytest.approx(5.0, abs=0.3)
+    assert latest[1] == 5.0
+    assert not any(worker.is_running() for worker in engine.workers)
+
+def test_queue_keeps_the_latest_values(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path, num_frames=1)), realtime=False)
+    engine = TrackingEngine(ReplayCoreWrapper(live_stream_wrap), live_stream_wrap, False)
+    values = engine.queue("velocity", maxsize=2)
+    for i in range(5):
+        engine.tracker.publish("velocity", i)
+    assert [values.get_nowait(), values.get_nowait()] == [3, 4]
+
+    with pytest.raises(ValueError):
+        engine.subscribe("not_an_event", print)
+
+def test_tracker_only_drives_towards_a_target(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path, num_frames=1)), realtime=False)
+    live_stream_wrap.snap(False)
+    tracker = StageTracker(ReplayCoreWrapper(live_stream_wrap), False)
+    velocities = []
+    tracker.subscribe("velocity", velocities.append)
+    tracker.is_tracking_enabled = True
+
+    tracker.step()
+    tracker.receive_tracking_pointer(-1)
+    tracker.step()
+    assert velocities == []
+
+    tracker.receive_tracking_pointer([1.0, 7.0])
+    tracker.step()
+    assert velocities == [[6.0, 12.0]]
+
+def test_stage_guard_fades_stale_targets_and_limits_commands():
+    sent = []
+    guard = StageGuard(False, max_velocity=100, max_acceleration=1000, max_target_age=0.3, target_decay=0.2,
+                       drive=lambda x, y, prev_x, prev_y, online: sent.append((x, y)))
+
+    assert guard.command(50, -500, 0.0, now=0.0) == (50, -100) # Clamped, from rest 0.1 s of acceleration
+    assert guard.command(80, -100, 0.0, now=0.01) == (60, -100) # Speeding up is limited
+    assert guard.command(80, -100, 0.4, now=0.02) == pytest.approx((40, -50)) # Half way through fading out
+    assert guard.command(80, -100, 0.5, now=0.03) == (0, 0)
+    assert guard.command(80, -100, None, now=0.04) == (0, 0) # No target at all
+    assert not guard.is_moving()
+
+    # A change of direction brakes to zero first
+    guard.command(-100, 0, 0.0, now=1.0)
+    assert guard.command(100, 0, 0.0, now=1.01) == pytest.approx((10, 0))
+    guard.stop()
+    assert sent[-1] == (0, 0) and guard.prev_x_direction == -1
+
+def test_tracker_stops_the_stage_when_targets_stop_coming(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path, num_frames=1)), realtime=False)
+    live_stream_wrap.snap(False)
+    sent = []
+    guard = StageGuard(False, max_acceleration=1e6, drive=lambda x, y, prev_x, prev_y, online: sent.append((x, y)))
+    tracker = StageTracker(ReplayCoreWrapper(live_stream_wrap), False, interval=0, stage_guard=guard)
+    tracker.is_tracking_enabled = True
+
+    tracker.receive_tracking_pointer([1.0, 7.0])
+    tracker.step()
+    assert sent == [(6.0, 12.0)]
+
+    # The segmenter loses the specimen, the last command fades out instead of coasting
+    tracker.receive_tracking_pointer(-1)
+    tracker.target_time -= guard.max_target_age + guard.target_decay / 2
+    tracker.step()
+    assert sent[-1] == pytest.approx((3.0, 6.0), abs=0.1)
+    tracker.target_time -= guard.target_decay
+    tracker.step()
+    tracker.step()
+    assert sent[-1] == (0, 0) and len(sent) == 3 # Nothing more is sent once stopped
+
+def test_target_age_counts_from_the_frame(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path, num_frames=1)), realtime=False)
+    grabber = FrameGrabber(live_stream_wrap, False)
+    segmenter = FrameSegmenter(ReplayCoreWrapper(live_stream_wrap), False, interval=0)
+    tracker = StageTracker(ReplayCoreWrapper(live_stream_wrap), False, interval=0)
+    tracker.follow(segmenter)
+    grabber.subscribe("raw_frame", segmenter.receive_frame)
+
+    # The frame waited half a second before it was segmented, so did its target
+    grabber.step()
+    segmenter.frame_time -= 0.5
+    segmenter.step()
+    assert tracker.has_target() and tracker.target_age() >= 0.5
+
+def test_tracker_stops_the_stage_when_its_loop_fails(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path, num_frames=1)), realtime=False)
+    live_stream_wrap.snap(False)
+    sent = []
+    guard = StageGuard(False, drive=lambda x, y, prev_x, prev_y, online: sent.append((x, y)))
+    tracker = StageTracker(ReplayCoreWrapper(live_stream_wrap), False, interval=0, stage_guard=guard)
+    tracker.is_tracking_enabled = True
+    tracker.receive_tracking_pointer([1.0, 7.0])
+
+    def fail():
+        raise RuntimeError("stage read failed")
+    tracker.get_stage_coords.get_x_coord = fail
+    with pytest.raises(RuntimeError):
+        tracker.run()
+    assert sent == [(0, 0)]
+
+def test_grabber_only_computes_subscribed_products(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path, num_frames=2)), realtime=False)
+    grabber = FrameGrabber(live_stream_wrap, False)
+    grabber.image_grabber.image_from_raw = None # Scaling to 8 bits must not happen without a "frame" subscriber
+    products = {}
+    grabber.subscribe("raw_frame", lambda frame: products.__setitem__("raw_frame", frame))
+    grabber.subscribe("tracking_frame", lambda frame: products.__setitem__("tracking_frame", frame))
+    grabber.step()
+
+    raw = products["raw_frame"]
+    assert raw.shape == (1024, 2048) and raw.dtype == np.uint16
+    tracking_frame = products["tracking_frame"]
+    assert tracking_frame.shape == (512, 1024) and tracking_frame.dtype == np.uint16
+    assert tracking_frame[3, 5] == raw[6:8, 10:12].astype(int).sum() // 4
+
+    # The segmenter finds the same spot in the binned frame as in the full one
+    segmenter = FrameSegmenter(ReplayCoreWrapper(live_stream_wrap), False, binning=2)
+    head = segmenter.process_frame(segmenter.roi_manager.crop(tracking_frame, 2)[0])[1]
+    full_head = segmenter.process_frame(FrameSegmenter.crop_panel((raw / raw.max() * 255).astype("uint8"), True))[1]
+    assert abs(head[0] - full_head[0]) <= 2 and abs(head[1] - full_head[1]) <= 2
+
+    # With the readout shared, the frames for the crops carry the ROI they were read with
+    grabber.roi_manager = segmenter.roi_manager
+    grabber.step()
+    assert products["tracking_frame"].roi == FULL_ROI and not hasattr(products["raw_frame"], "roi")
+
+def test_segmenter_reuses_the_result_of_an_unchanged_scene(tmp_path):
+    live_stream_wrap = ReplayStreamWrapper(Recording(make_recording(tmp_path, num_frames=3)), realtime=False)
+    grabber = FrameGrabber(live_stream_wrap, False)
+    segmenter = FrameSegmenter(ReplayCoreWrapper(live_stream_wrap), False, interval=0)
+    segmenter.metrics = MetricsRegistry()
+    targets, images, raw_frames = [], [], []
+    grabber.subscribe("raw_frame", raw_frames.append)
+    grabber.subscribe("raw_frame", segmenter.receive_frame)
+    segmenter.subscribe("target", targets.append)
+    segmenter.subscribe("segmented", images.append)
+
+    # Only the noise changes between the frames, the stage coordinates follow the stage
+    for _ in range(2):
+        grabber.step()
+        segmenter.step()
+    assert segmenter.metrics.total("cv_frames_skipped") == 1
+    assert len(images) == 1 and len(targets) == 2
+    assert targets[1][0] - targets[0][0] == pytest.approx(10.0)
+
+    # The specimen moves
+    moved = raw_frames[-1].copy()
+    moved[492:532, 1536 - 20:1536 + 20] = 100
+    moved[492:532, 1536 + 40:1536 + 80] = 4000
+    segmenter.receive_frame(moved)
+    segmenter.step()
+    assert segmenter.metrics.total("cv_frames_skipped") == 1 and len(images) == 2
+    assert targets[2][0] > targets[1][0]
+
+    # A new segmentation mode always segments, as does a segmenter without a threshold
+    segmenter.toggle_inverse()
+    segmenter.receive_frame(moved)
+    segmenter.step()
+    assert segmenter.metrics.total("cv_frames_skipped") == 1
+    segmenter.toggle_inverse()
+    segmenter.change_threshold = None
+    segmenter.receive_frame(moved)
+    segmenter.step()
+    assert segmenter.metrics.total("cv_frames_skipped") == 1 and len(images) == 4
@@ -0,0 +1,143 @@
+import sys
+import os
+import time
+import threading
+import pytest
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../src')))
+
+from watchdog import *
+from tracking_engine import EngineWorker
+
+# Worker that can be made to hang, crash or fail on demand
+class FlakyWorker(EngineWorker):
+    events = ("output",)
+
+    def __init__(self):
+        super().__init__()
+        self.hang = threading.Event()
+        self.release = threading.Event()
+        self.crash = False
+        self.fail = False
+        self.quiet = False
+        self.steps = 0
+
+    def step(self):
+        self.steps += 1
+        if self.hang.is_set():
+            self.hang.clear()
+            self.release.wait(5)
+        if self.crash:
+            self.crash = False
+            raise RuntimeError("worker crashed")
+        if self.fail:
+            self.record_error()
+        elif not self.quiet:
+            self.publish("output", self.steps)
+        self.stop_event.wait(0.01)
+
+def wait_for(condition, timeout=2.0):
+    end = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > end:
+            return False
+        time.sleep(0.01)
+    return True
+
+@pytest.fixture
+def watched():
+    worker = FlakyWorker()
+    supervisor = Supervisor()
+    supervisor.watch("Flaky", worker, WatchPolicy(stall_after=0.2, output_event="output", silent_after=0.2,
+                                                  max_errors=5, error_window=1.0, max_restarts=2, restart_timeout=0.1))
+    yield worker, supervisor
+    worker.release.set()
+    worker.stop(1)
+
+def test_healthy_worker_is_ok(watched):
+    worker, supervisor = watched
+    supervisor.check_all()
+    assert supervisor.health()["Flaky"]["status"] == "starting"
+    worker.start()
+    assert wait_for(lambda: worker.heartbeat is not None and "output" in worker.last_published)
+    supervisor.check_all()
+    assert supervisor.health()["Flaky"] == {"status": "ok", "detail": "", "restarts": 0}
+    worker.stop(1)
+    supervisor.check_all()
+    assert supervisor.health()["Flaky"]["status"] == "stopped" # Stopped on purpose, not restarted
+
+def test_stalled_worker_is_replaced(watched, capsys):
+    worker, supervisor = watched
+    worker.start()
+    assert wait_for(lambda: worker.heartbeat is not None)
+    worker.hang.set()
+    hung_thread = worker.thread
+    assert wait_for(lambda: supervisor.check("Flaky")[0] == "stalled")
+
+    supervisor.check_all()
+    assert supervisor.health()["Flaky"]["restarts"] == 1
+    assert "Watchdog: restarting Flaky, stalled" in capsys.readouterr().out
+    assert worker.thread is not hung_thread and worker.is_running()
+    assert wait_for(lambda: supervisor.check("Flaky")[0] == "ok")
+
+    # The hung thread ends on its own once its call returns, the new one keeps going
+    worker.release.set()
+    hung_thread.join(1)
+    assert not hung_thread.is_alive()
+    assert worker.is_looping()
+
+def test_dead_worker_and_error_storm_are_restarted(watched):
+    worker, supervisor = watched
+    worker.crash = True
+    worker.start()
+    assert wait_for(lambda: not worker.is_running())
+    assert supervisor.check("Flaky") == ("dead", "worker loop ended")
+    supervisor.check_all()
+    assert worker.is_running() and supervisor.health()["Flaky"]["restarts"] == 1
+
+    worker.fail = True
+    assert wait_for(lambda: supervisor.check("Flaky")[0] == "error storm")
+    supervisor.check_all(now=time.perf_counter() + 0.3) # After the cool down since the last restart
+    assert supervisor.health()["Flaky"]["restarts"] == 2
+    assert len(worker.error_times) < 5
+
+    # No more restarts once max_restarts is used up
+    assert wait_for(lambda: supervisor.check("Flaky")[0] == "error storm")
+    supervisor.check_all(now=time.perf_counter() + 0.6)
+    health = supervisor.health()["Flaky"]
+    assert health["status"] == "failed" and health["restarts"] == 2
+
+def test_silent_worker_is_only_reported(watched):
+    worker, supervisor = watched
+    worker.quiet = True # Keeps stepping without output, like a segmenter with nothing in view
+    worker.start()
+    assert wait_for(lambda: supervisor.check("Flaky")[0] == "silent")
+    supervisor.check_all()
+    assert supervisor.health()["Flaky"]["restarts"] == 0
+    assert describe_health(supervisor.health()) == "Flaky silent"
+
+def test_describe_health():
+    assert describe_health({"Grab": {"status": "ok", "detail": "", "restarts": 0}}) == "all stages ok"
+    assert describe_health({"Grab": {"status": "ok", "detail": "", "restarts": 1},
+                            "CV": {"status": "starting", "detail": "", "restarts": 0}}) == "all stages ok, 1 restarts so far"
+    assert describe_health({"CV": {"status": "stalled", "detail": "", "restarts": 2}}) == "CV stalled (2 restarts)"
+
+def test_stopping_a_restarted_qthread_does_not_wait_for_the_hung_call(watched):
+    from threads import WorkerThread, abandoned_threads
+    worker, supervisor = watched
+    thread = WorkerThread()
+    thread.worker = worker
+    thread.start()
+    assert wait_for(lambda: worker.heartbeat is not None)
+    worker.hang.set()
+    assert wait_for(lambda: supervisor.check("Flaky")[0] == "stalled")
+    supervisor.check_all()
+    assert worker.is_running() and thread.isRunning() # The QThread is still stuck in the call
+
+    # Closing the window stops the restarted worker and gives up on the QThread
+    start = time.perf_counter()
+    thread.stop(0.2)
+    assert time.perf_counter() - start < 1.0
+    assert not worker.is_running() and thread in abandoned_threads
+    worker.release.set()
+    assert thread.wait(2000)
+    abandoned_threads.remove(thread)